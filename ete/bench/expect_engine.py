@@ -0,0 +1,400 @@
+#!/usr/local/bin/python2.7
+
+'''
+Program Name: expect_engine.py
+
+Throughput benchmark of the vendored pexpect expect engine: the spawn read
+loop (SpawnBase.read_nonblocking, Expecter.expect_loop), Expecter.new_data
+and the searchers (searcher_string for expect_exact, searcher_re for
+expect).
+
+Every case pushes a stream of command outputs, each ending with a shell
+prompt, through a spawn and calls expect until the end of the stream,
+matching one prompt per call among decoy patterns that never match (the
+'Update Complete', 'WARNING', ... an updater waits for).  The cases vary
+the matching (exact or re), the number of patterns, the chunk size of the
+reads (maxread) and the searchwindowsize.  The stream comes from:
+
+    - memory: chunks held in memory by an in-process spawn, no I/O, so
+      only the engine is measured,
+    - cat: popen_spawn on cat of a file, the pipe and reader thread
+      included,
+    - a recording of lib/recording.py (--recording), its read chunks in
+      their recorded sizes, matched on the recorded prompt.
+
+The spawns do not sleep after each read (delayafterread), which would
+measure time.sleep.  Each case runs --runs times, each in a fresh
+interpreter; the best throughput (MB/s) and latency of an expect call
+(median and 99th percentile) of the runs and the median of the memory it
+grew by while matching (peak RSS) are compared against a stored baseline.
+Other load on the host only ever makes a run slower, the best of the runs
+is the number that holds from one invocation to the next.  The baseline
+keeps the number of runs it was recorded with, a comparison uses the same
+number unless --runs is given.
+
+Usage:
+    $ python expect_engine.py                   # compare against the baseline
+    $ python expect_engine.py --save            # record a new baseline
+    $ python expect_engine.py -k exact --size 8
+    $ python expect_engine.py --recording ~/logs/20181015T101200_session.jsonl
+
+Exit status is 1 when a case got slower or bigger than the tolerance allows,
+has no baseline, or matched a different number of prompts than the stream
+holds, 2 when there is no baseline file.  expect_engine_baseline.json is
+committed next to this script for the built-in cases; the cases of a
+recording need a baseline of their own, saved with --save --baseline FILE.
+'''
+import argparse
+import json
+import os
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+package_path = os.path.dirname(this_dir)
+
+PROMPT = '[root@node-01 ~]# '
+
+# Patterns the updaters wait for, none of them shows up in the stream
+DECOYS = (
+    'Update Complete', 'WARNING', 'Successfully', 'completed', 'Rebooting.',
+    'configuration is loaded', 'Power cycle is required', 'Done',
+)
+RE_DECOYS = (
+    r'Update\s+Complete', r'WARNING:\s*Must', r'Finished\s+\w+\s+Successfully',
+    r'Error\s+\d{3}', r'ExitCode\s*=\s*\d+', r'[Ff]lash\s+update\s+failed',
+    r'Power\s+\w+\s+required', r'Unable to reach host \S+',
+)
+
+# Runs per case when recording a baseline
+RUNS = 10
+
+# name: (matching, patterns, chunk, searchwindowsize, source)
+CASES = [
+    ('exact-1p-2k',       'exact', 1,  2000,  None, 'memory'),
+    ('exact-8p-2k',       'exact', 8,  2000,  None, 'memory'),
+    ('exact-32p-2k',      'exact', 32, 2000,  None, 'memory'),
+    ('exact-1p-64',       'exact', 1,  64,    None, 'memory'),
+    ('exact-1p-64k',      'exact', 1,  65536, None, 'memory'),
+    ('exact-8p-2k-w200',  'exact', 8,  2000,  200,  'memory'),
+    ('re-1p-2k',          're',    1,  2000,  None, 'memory'),
+    ('re-8p-2k',          're',    8,  2000,  None, 'memory'),
+    ('re-32p-2k',         're',    32, 2000,  None, 'memory'),
+    ('re-1p-64',          're',    1,  64,    None, 'memory'),
+    ('re-8p-2k-w2000',    're',    8,  2000,  2000, 'memory'),
+    ('cat-exact-8p-2k',   'exact', 8,  2000,  None, 'cat'),
+    ('cat-re-8p-2k',      're',    8,  2000,  None, 'cat'),
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the throughput of the pexpect expect engine')
+    parser.add_argument(
+        '-n', '--runs', type=int, default=None,
+        help='runs per case, the best is used (default: the runs of the '
+             'baseline, {} with --save)'.format(RUNS))
+    parser.add_argument(
+        '--size', type=float, default=2,
+        help='megabytes pushed through each case')
+    parser.add_argument(
+        '-k', '--keyword', default=None,
+        help='only run the cases whose name matches this regular expression')
+    parser.add_argument(
+        '--recording', action='append', default=[],
+        help='session recording (lib/recording.py) to add cases for')
+    parser.add_argument(
+        '--baseline', default=os.path.join(this_dir, 'expect_engine_baseline.json'),
+        help='baseline file to compare against or save to')
+    parser.add_argument(
+        '--save', action='store_true',
+        help='save the measured numbers as the new baseline')
+    parser.add_argument(
+        '--tolerance', type=float, default=0.4,
+        help='allowed slowdown and memory growth as a ratio of the baseline')
+    parser.add_argument(
+        '--slack-kb', type=int, default=2048,
+        help='allowed memory growth in KB on top of the ratio')
+    parser.add_argument(
+        '--python', default=sys.executable,
+        help='interpreter to run the cases with')
+    parser.add_argument(
+        '--run-case', default=None, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+''' ------------------------------- Streams ---------------------------------'''
+def synthetic_chunks(size, chunk, seed=0):
+    '''Return (chunks, prompts) of about size bytes of command outputs.
+
+    Most outputs are a few lines, every 16th is a long one as a flash
+    progress log.
+    '''
+    rand = random.Random(seed)
+    words = ['Handle', '0x0002,', 'DMI', 'type', '2,', 'Manufacturer:',
+             'Supermicro', 'Product', 'Name:', 'X11DPT-B', 'Version:', '1.01',
+             'Reading', 'BIOS', 'flash', '.....', '(100%)', 'enp94s0f0',
+             'bus-info:', '0000:5e:00.0', 'firmware-version:', '0x80000aee']
+    outputs = []
+    total = prompts = 0
+    while total < size:
+        lines = rand.randint(200, 400) if prompts % 16 == 15 else rand.randint(5, 40)
+        text = ''.join(' '.join(rand.choice(words) for _ in range(rand.randint(3, 10))) + '\r\n'
+                       for _ in range(lines)) + PROMPT
+        outputs.append(text)
+        total += len(text)
+        prompts += 1
+    stream = ''.join(outputs).encode('latin-1')
+    return [stream[i:i + chunk] for i in range(0, len(stream), chunk)], prompts
+
+
+def recorded_chunks(path, size):
+    '''Return (chunks, prompts, prompt) of a recording repeated to size bytes.'''
+    sys.path.insert(0, package_path)
+    sys.path.insert(0, os.path.join(package_path, 'packages'))
+    from lib import recording
+
+    header, events = recording.load(path)
+    prompt = None
+    reads = []
+    for t, kind, data in events:
+        if kind == recording.MARK and data.get('name') == 'login':
+            prompt = data.get('prompt')
+            # Match from the first command on
+            reads = []
+        elif kind == recording.READ:
+            reads.append(data.encode(header.get('encoding') or 'latin-1'))
+    if not prompt or not reads:
+        raise ValueError('{} has no login mark or no output'.format(path))
+    prompt = prompt.encode(header.get('encoding') or 'latin-1')
+    once = sum(len(r) for r in reads)
+    chunks = reads * max(1, int(size // max(once, 1)))
+    return chunks, b''.join(chunks).count(prompt), prompt
+
+
+''' ------------------------------- Spawns ----------------------------------'''
+def memory_spawn(chunks, maxread, searchwindowsize):
+    from pexpect.exceptions import EOF
+    from pexpect.spawnbase import SpawnBase
+
+    class MemorySpawn(SpawnBase):
+        '''Returns the chunks one read at a time, then EOF.'''
+
+        def __init__(self):
+            super(MemorySpawn, self).__init__(
+                timeout=30, maxread=maxread, searchwindowsize=searchwindowsize)
+            self.delayafterread = None
+            self.chunks = chunks
+            self.index = 0
+            self.rest = b''
+
+        def read_nonblocking(self, size=1, timeout=None):
+            if not self.rest:
+                if self.index >= len(self.chunks):
+                    self.flag_eof = True
+                    raise EOF('End of the stream')
+                self.rest = self.chunks[self.index]
+                self.index += 1
+            s, self.rest = self.rest[:size], self.rest[size:]
+            s = self._decoder.decode(s, final=False)
+            self._log(s, 'read')
+            return s
+
+    return MemorySpawn()
+
+
+def cat_spawn(chunks, maxread, searchwindowsize):
+    from pexpect.popen_spawn import PopenSpawn
+
+    fd, path = tempfile.mkstemp(prefix='expect_engine')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(b''.join(chunks))
+    spawn = PopenSpawn(['cat', path], maxread=maxread,
+                       searchwindowsize=searchwindowsize)
+    spawn.delayafterread = None
+    spawn.scratch = path
+    return spawn
+
+
+''' -------------------------------- Cases ----------------------------------'''
+def rss_kb():
+    '''Return the current resident set size in KB.'''
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize() // 1024
+
+
+def run_case(spec):
+    '''Run one case in this interpreter, return its numbers.'''
+    sys.path.insert(0, os.path.join(package_path, 'packages'))
+    from pexpect.exceptions import EOF
+
+    size = int(spec['size'] * 1024 * 1024)
+    if spec.get('recording'):
+        chunks, prompts, prompt = recorded_chunks(spec['recording'], size)
+    else:
+        chunks, prompts = synthetic_chunks(size, spec['chunk'])
+        prompt = PROMPT.encode('latin-1')
+    total = sum(len(c) for c in chunks)
+
+    if spec['matching'] == 'exact':
+        decoys = [d.encode('latin-1') for d in DECOYS]
+        target = prompt
+    else:
+        decoys = [d.encode('latin-1') for d in RE_DECOYS]
+        target = re.escape(prompt)
+    patterns = [decoys[i % len(decoys)] + (b'' if i < len(decoys) else
+                                           str(i).encode('latin-1'))
+                for i in range(spec['patterns'] - 1)] + [target]
+
+    factory = cat_spawn if spec['source'] == 'cat' else memory_spawn
+    spawn = factory(chunks, spec['chunk'], spec['window'])
+    expect = spawn.expect_exact if spec['matching'] == 'exact' else spawn.expect
+
+    start_kb = rss_kb()
+    latencies = []
+    matches = 0
+    started = last = time.time()
+    try:
+        while True:
+            expect(patterns, timeout=None)
+            now = time.time()
+            latencies.append(now - last)
+            last = now
+            matches += 1
+    except EOF:
+        pass
+    elapsed = time.time() - started
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if getattr(spawn, 'scratch', None):
+        os.remove(spawn.scratch)
+
+    return {
+        'mb_s': total / elapsed / 1024 / 1024,
+        'p50_us': percentile(latencies, 0.5) * 1e6 if latencies else 0,
+        'p99_us': percentile(latencies, 0.99) * 1e6 if latencies else 0,
+        'peak_kb': max(peak_kb - start_kb, 0),
+        'matches': matches, 'expected': prompts, 'bytes': total,
+    }
+
+
+def measure(python, spec, runs):
+    '''Return the best numbers of runs of spec, each in a fresh process, and
+    the median of their memory growth.'''
+    results = []
+    for _ in range(runs):
+        output = subprocess.check_output(
+            [python, os.path.abspath(__file__), '--run-case', json.dumps(spec)])
+        results.append(json.loads(output.decode()))
+    merged = dict(results[0])
+    merged['mb_s'] = max(r['mb_s'] for r in results)
+    merged['p50_us'] = min(r['p50_us'] for r in results)
+    merged['p99_us'] = min(r['p99_us'] for r in results)
+    merged['peak_kb'] = median([r['peak_kb'] for r in results])
+    return merged
+
+
+def compare(name, result, baseline, tolerance, slack_kb):
+    '''Return the failures of result against baseline, only the number of
+    matches is checked when baseline is None.'''
+    failures = []
+    if result['matches'] != result['expected']:
+        failures.append('matched {} of {} prompts'.format(
+            result['matches'], result['expected']))
+    if baseline is None:
+        return failures
+    if name not in baseline:
+        failures.append('no baseline, record one with --save')
+        return failures
+    base = baseline[name]
+    if result['mb_s'] < base['mb_s'] * (1 - tolerance):
+        failures.append('{:.2f} MB/s below {:.2f}'.format(
+            result['mb_s'], base['mb_s'] * (1 - tolerance)))
+    if result['p99_us'] > base['p99_us'] * (1 + tolerance) + 100:
+        failures.append('p99 {:.0f}us over {:.0f}us'.format(
+            result['p99_us'], base['p99_us'] * (1 + tolerance) + 100))
+    if result['peak_kb'] > base['peak_kb'] * (1 + tolerance) + slack_kb:
+        failures.append('grew {}KB over {:.0f}KB'.format(
+            result['peak_kb'], base['peak_kb'] * (1 + tolerance) + slack_kb))
+    return failures
+
+
+def main():
+    args = parse_args()
+    if args.run_case:
+        print(json.dumps(run_case(json.loads(args.run_case))))
+        return
+
+    specs = []
+    for name, matching, patterns, chunk, window, source in CASES:
+        specs.append((name, {'matching': matching, 'patterns': patterns,
+                             'chunk': chunk, 'window': window,
+                             'source': source, 'size': args.size}))
+    for path in args.recording:
+        label = os.path.splitext(os.path.basename(path))[0]
+        for matching, patterns in (('exact', 1), ('exact', 8), ('re', 8)):
+            specs.append(('rec-{}-{}-{}p'.format(label, matching, patterns), {
+                'matching': matching, 'patterns': patterns, 'chunk': 2000,
+                'window': None, 'source': 'memory', 'size': args.size,
+                'recording': os.path.abspath(os.path.expanduser(path))}))
+    if args.keyword:
+        specs = [(name, spec) for name, spec in specs
+                 if re.search(args.keyword, name)]
+
+    baseline = {}
+    runs = args.runs or RUNS
+    if not args.save:
+        if not os.path.exists(args.baseline):
+            print('No baseline {}, record one with --save'.format(args.baseline))
+            sys.exit(2)
+        with open(args.baseline) as f:
+            saved = json.load(f)
+        baseline = saved['cases']
+        runs = args.runs or saved['runs']
+
+    results = {}
+    failed = False
+    print('{:<22} {:>9} {:>9} {:>10} {:>10} {:>9}  {}'.format(
+        'case', 'MB/s', 'baseline', 'p50', 'p99', 'peak', 'status'))
+    for name, spec in specs:
+        result = measure(args.python, spec, runs)
+        results[name] = result
+        failures = compare(name, result, None if args.save else baseline,
+                           args.tolerance, args.slack_kb)
+        failed = failed or bool(failures)
+        print('{:<22} {:>9.2f} {:>9} {:>8.0f}us {:>8.0f}us {:>7}KB  {}'.format(
+            name, result['mb_s'],
+            '{:.2f}'.format(baseline[name]['mb_s']) if name in baseline else '-',
+            result['p50_us'], result['p99_us'], result['peak_kb'],
+            'FAIL ' + '; '.join(failures) if failures else 'ok'))
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump({'runs': runs, 'cases': results}, f, indent=4,
+                      sort_keys=True, separators=(',', ': '))
+            f.write('\n')
+        print('Baseline saved to {}'.format(args.baseline))
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
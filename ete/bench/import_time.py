@@ -0,0 +1,159 @@
+#!/usr/local/bin/python2.7
+
+'''
+Program Name: import_time.py
+
+Cold start benchmark of the update_*_fw.py scripts.  Every script is run with
+--help in a fresh interpreter several times and the median wall time is
+compared against a stored baseline.  The run also fails if any of the heavy
+vendored packages (pexpect, ptyprocess, requests, xmltodict) got imported
+just to print the help.
+
+Usage:
+    $ python import_time.py                 # compare against the baseline
+    $ python import_time.py --save          # record a new baseline
+    $ python import_time.py -n 20 --tolerance 0.5
+
+Exit status is 1 when a script regressed by more than the tolerance (ratio
+of the baseline plus --slack seconds), has no baseline or loaded a heavy
+module, 2 when there is no baseline file.  import_time_baseline.json is
+committed next to this script; re-record it with --save on the reference
+machine when the updaters change on purpose.
+'''
+import argparse
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+package_path = os.path.dirname(this_dir)
+fw_update_path = os.path.join(package_path, 'fw_update')
+
+# Runs the script's --help in-process and reports the heavy modules it loaded
+PROBE = '''
+import os, runpy, sys
+script = sys.argv[1]
+os.chdir(sys.argv[2])
+sys.argv = [script, '--help']
+sys.path.insert(0, os.path.dirname(script))
+stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+try:
+    runpy.run_path(script, run_name='__main__')
+except SystemExit:
+    pass
+sys.stdout = stdout
+heavy = ('pexpect', 'ptyprocess', 'requests', 'xmltodict')
+print(' '.join(name for name in heavy if name in sys.modules))
+'''
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the cold start of the firmware updaters')
+    parser.add_argument(
+        '-n', '--runs', type=int, default=10,
+        help='runs per script, the median is used')
+    parser.add_argument(
+        '--baseline', default=os.path.join(this_dir, 'import_time_baseline.json'),
+        help='baseline file to compare against or save to')
+    parser.add_argument(
+        '--save', action='store_true',
+        help='save the measured times as the new baseline')
+    parser.add_argument(
+        '--tolerance', type=float, default=0.25,
+        help='allowed slowdown as a ratio of the baseline')
+    parser.add_argument(
+        '--slack', type=float, default=0.02,
+        help='allowed slowdown in seconds on top of the ratio')
+    parser.add_argument(
+        '--python', default=sys.executable,
+        help='interpreter to run the updaters with')
+    return parser.parse_args()
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def time_script(python, script, runs, scratch):
+    '''Return (median seconds, heavy modules loaded) of script --help.'''
+    devnull = open(os.devnull, 'w')
+    times = []
+    for _ in range(runs):
+        start = time.time()
+        subprocess.check_call([python, script, '--help'], stdout=devnull,
+                              stderr=devnull, cwd=scratch)
+        times.append(time.time() - start)
+    heavy = subprocess.check_output([python, '-c', PROBE, script, scratch])
+    return median(times), heavy.decode().split()
+
+
+def main():
+    args = parse_args()
+    scripts = sorted(glob.glob(os.path.join(fw_update_path, 'update_*_fw.py')))
+
+    # The updaters create their debug log in the working directory
+    scratch = tempfile.mkdtemp(prefix='import_time')
+
+    baseline = {}
+    if not args.save:
+        if not os.path.exists(args.baseline):
+            print('No baseline {}, record one with --save'.format(args.baseline))
+            sys.exit(2)
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = {}
+    failed = False
+    print('{:<22} {:>10} {:>10}  {}'.format('script', 'median', 'baseline', 'status'))
+    for script in scripts:
+        name = os.path.basename(script)
+        try:
+            elapsed, heavy = time_script(args.python, script, args.runs, scratch)
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+            os.makedirs(scratch)
+        results[name] = elapsed
+
+        status = 'ok'
+        if heavy:
+            status = 'FAIL loaded {}'.format(', '.join(heavy))
+            failed = True
+        elif name in baseline:
+            limit = baseline[name] * (1 + args.tolerance) + args.slack
+            if elapsed > limit:
+                status = 'FAIL slower than {:.3f}s'.format(limit)
+                failed = True
+        elif not args.save:
+            status = 'FAIL no baseline, record one with --save'
+            failed = True
+        print('{:<22} {:>9.3f}s {:>10}  {}'.format(
+            name, elapsed,
+            '{:.3f}s'.format(baseline[name]) if name in baseline else '-',
+            status))
+
+    shutil.rmtree(scratch, ignore_errors=True)
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(dict((name, round(elapsed, 4))
+                           for name, elapsed in results.items()),
+                      f, indent=4, sort_keys=True, separators=(',', ': '))
+            f.write('\n')
+        print('Baseline saved to {}'.format(args.baseline))
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+#!/usr/local/bin/python2.7
+
+"""
+Program Name: check_fw_compliance.py
+
+This utility audits the BMC and BIOS firmware of a fleet out-of-band. The \
+firmware inventory of every BMC is crawled concurrently over Redfish and each \
+component is checked against "fw_config.py" with the same rules the updaters \
+apply before an update (preferred, acceptable, conflict). Nothing is flashed.
+With --ipmi the BMCs are asked over IPMI (ipmitool -I lanplus) instead, for \
+BMCs without Redfish; only the BMC firmware is known that way. With --ssh \
+the hosts are the nodes themselves: the versions are read in-band, logged \
+into the host OS, on a pool of worker processes.
+
+Prerequisites:
+    - This module is tested on Python 2.7.15 and is compatible with python \
+      2.7 or later.
+
+Usage:
+    $ ./check_fw_compliance.py -h
+    usage: check_fw_compliance.py [-h] [-f HOSTS_FILE] [-j JSON] \
+            [--bmc-username BMC_USERNAME] [--bmc-password BMC_PASSWORD] \
+            [--workers WORKERS] [--etag-cache ETAG_CACHE] [--no-expand] \
+            [-c COMPONENT [COMPONENT ...]] [--ipmi] \
+            [--credentials-file CREDENTIALS_FILE] \
+            [--credentials-cache CREDENTIALS_CACHE] [--ssh] \
+            [--username USERNAME] [--password PASSWORD] \
+            [--processes PROCESSES] [host [host ...]]
+
+    positional arguments:
+      host                  BMC IP, host:port or URL, the node IP with --ssh
+
+    optional arguments:
+      -h, --help            displays the help message, then exit
+      -f, --hosts-file      file with one BMC per line
+      -j, --json            save the inventory and verdicts to this json file
+      --bmc-username        BMC username
+      --bmc-password        BMC password
+      --workers             number of BMCs crawled at once
+      --etag-cache          file keeping the ETags between sweeps
+      --no-expand           do not ask for the inventory members with $expand
+      -c, --components      components to audit, default BMC and BIOS
+      --ipmi                query the BMCs over IPMI instead of Redfish
+      --credentials-file    file with more 'username password' lines to try
+      --credentials-cache   file keeping the credentials each BMC accepted
+      --ssh                 read the versions in-band over SSH to the nodes
+      --username            node username for --ssh
+      --password            node password for --ssh
+      --processes           worker processes for --ssh, default one per CPU
+
+Examples:
+    Audits two BMCs:
+        $python check_fw_compliance.py 192.168.3.123 192.168.3.124
+
+    Audits every BMC listed in bmcs.txt, reusing the ETags of the last sweep \
+    and saving the result:
+        $./check_fw_compliance.py -f bmcs.txt --etag-cache=~/.fw_etags.json \
+            -j compliance.json
+
+    Takes a BMC firmware census over IPMI, trying a second account on the \
+    BMCs refusing the first and remembering which one each BMC accepted:
+        $./check_fw_compliance.py -f bmcs.txt --ipmi -c BMC \
+            --credentials-file=~/.bmc_accounts \
+            --credentials-cache=~/.cache/fw_update/ipmi_credentials.json
+
+    Audits the nodes listed in nodes.txt in-band, logged into their OS, on 8 \
+    worker processes:
+        $./check_fw_compliance.py -f nodes.txt --ssh --processes=8
+
+The exit status is 0 if every component is compliant, 1 otherwise.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+
+# Import your package (if any) below
+import import_me_first
+
+from lib import lazy
+import fw_policy
+
+# Only the backend of the chosen mode is imported
+ipmi_collector = lazy.lazy_import('lib.ipmi_collector')
+redfish_crawler = lazy.lazy_import('lib.redfish_crawler')
+ssh_collector = lazy.lazy_import('lib.ssh_collector')
+
+# Number of BMCs queried at once
+WORKERS = 32
+
+logging.basicConfig(filename="debug_fw_compliance.log", level=logging.DEBUG)
+
+def parse_args():
+    ''' This function creates a parser object and adds the arguments and
+        information regarding the argument to the parser object. It then
+        returns the parsed arguments
+    '''
+    parser = argparse.ArgumentParser(
+        description='This parser gets all input options to audit the fleet')
+
+    # Add arguments
+    parser.add_argument(
+        'hosts', nargs='*', metavar='host',
+        help='BMC IP, host:port or URL, the node IP with --ssh')
+    parser.add_argument(
+        '-f', '--hosts-file', required=False,
+        help='File with one BMC per line', default=None)
+    parser.add_argument(
+        '-j', '--json', required=False,
+        help='Save the inventory and verdicts to this json file', default=None)
+    parser.add_argument(
+        '--bmc-username', required=False,
+        help='BMC username', default='ADMIN')
+    parser.add_argument(
+        '--bmc-password', required=False,
+        help='BMC password', default='ADMIN')
+    parser.add_argument(
+        '--workers', type=int, required=False,
+        help='Number of BMCs crawled at once',
+        default=WORKERS)
+    parser.add_argument(
+        '--etag-cache', required=False,
+        help='File keeping the ETags between sweeps so unchanged resources '
+             'are not transferred again', default=None)
+    parser.add_argument(
+        '--no-expand', action='store_true',
+        help='Do not ask for the inventory members with $expand')
+    parser.add_argument(
+        '-c', '--components', nargs='+', required=False,
+        help='Components to audit', default=['BMC', 'BIOS'])
+    parser.add_argument(
+        '--ipmi', action='store_true',
+        help='Query the BMCs over IPMI (ipmitool -I lanplus) instead of Redfish')
+    parser.add_argument(
+        '--credentials-file', required=False,
+        help="File with more 'username password' lines to try with --ipmi",
+        default=None)
+    parser.add_argument(
+        '--credentials-cache', required=False,
+        help='File keeping the credentials each BMC accepted with --ipmi',
+        default=None)
+    parser.add_argument(
+        '--ssh', action='store_true',
+        help='Read the versions in-band over SSH to the nodes instead')
+    parser.add_argument(
+        '--username', required=False,
+
+        # Default username for the PXE server
+        help='Node username for --ssh', default='root')
+    parser.add_argument(
+        '--password', required=False,
+
+        # Default password for the PXE server
+        help='Node password for --ssh', default='nutanix/4u')
+    parser.add_argument(
+        '--processes', type=int, required=False,
+        help='Worker processes for --ssh, one per CPU by default',
+        default=None)
+
+    args = parser.parse_args()
+
+    return args
+
+''' ------------------------------ read_hosts -------------------------------'''
+def read_hosts(args):
+    ''' This function returns the BMCs given on the command line and in the
+        hosts file, without duplicates
+    '''
+    hosts = list(args.hosts)
+    if args.hosts_file:
+        with open(os.path.expanduser(args.hosts_file)) as f:
+            for line in f:
+                line = line.split('#', 1)[0].strip()
+                if line:
+                    hosts.append(line)
+
+    seen = set()
+    return [h for h in hosts if not (h in seen or seen.add(h))]
+
+''' ------------------------------ audit ------------------------------------'''
+def audit(records, components, component_version):
+    ''' This function checks every component of the crawled records against
+        the firmware policy and returns the list of verdicts. The version of a
+        component is read with the component_version of the backend
+    '''
+    verdicts = []
+    for record in records:
+        for component in components:
+            if record['error']:
+                verdict = {'component': component, 'part_number': None,
+                           'version': None, 'preferred': None, 'file': None,
+                           'status': 'error'}
+            else:
+                verdict = fw_policy.evaluate(component, record['model'],
+                        component_version(record, component))
+            verdict['host'] = record['host']
+            verdicts.append(verdict)
+    return verdicts
+
+''' ------------------------------ read_credentials -------------------------'''
+def read_credentials(args):
+    ''' This function returns the (username, password) to try with --ipmi,
+        the BMC username first
+    '''
+    credentials = [(args.bmc_username, args.bmc_password)]
+    if args.credentials_file:
+        with open(os.path.expanduser(args.credentials_file)) as f:
+            for line in f:
+                fields = line.strip().split(None, 1)
+                if len(fields) == 2 and not fields[0].startswith('#'):
+                    credentials.append(tuple(fields))
+    return credentials
+
+'''--------------------------------------------------------------------------'''
+def main():
+    args = parse_args()
+    hosts = read_hosts(args)
+    if not hosts:
+        logging.error("No BMC to audit")
+        print("No BMC to audit, give hosts or --hosts-file")
+        sys.exit(1)
+
+    if args.ssh:
+        records = ssh_collector.collect(hosts, args.username, args.password,
+                components=[c.upper() for c in args.components],
+                workers=args.processes)
+        component_version = ssh_collector.component_version
+    elif args.ipmi:
+        cache = ipmi_collector.load_credentials(args.credentials_cache)
+        records = ipmi_collector.collect(hosts, read_credentials(args),
+                workers=args.workers, cache=cache)
+        ipmi_collector.save_credentials(args.credentials_cache, cache)
+        component_version = ipmi_collector.component_version
+    else:
+        etags = redfish_crawler.load_etags(args.etag_cache)
+        records = redfish_crawler.crawl(hosts, args.bmc_username,
+                args.bmc_password, workers=args.workers, etags=etags,
+                expand=not args.no_expand)
+        redfish_crawler.save_etags(args.etag_cache, etags)
+        component_version = redfish_crawler.component_version
+
+    components = [c.upper() for c in args.components]
+    if args.ssh and set(components) - set(ssh_collector.READERS):
+        logging.warning("Auditing only %s over SSH, not %s" %(
+                sorted(ssh_collector.READERS), components))
+        components = [c for c in components if c in ssh_collector.READERS]
+    elif args.ipmi and components != ['BMC']:
+        # IPMI reports the BMC firmware only
+        logging.warning("Auditing only the BMC over IPMI, not %s" %components)
+        components = ['BMC']
+    verdicts = audit(records, components, component_version)
+
+    row = '{:<28} {:<12} {:<6} {:<14} {:<14} {}'
+    print(row.format('host', 'model', 'comp', 'version', 'preferred', 'status'))
+    for v in verdicts:
+        print(row.format(v['host'], v['part_number'] or '-', v['component'],
+                v['version'] or '-', v['preferred'] or '-', v['status']))
+
+    failed = [v for v in verdicts if not fw_policy.is_compliant(v)]
+    errors = [r for r in records if r['error']]
+    print("\n{0} BMCs, {1} components, {2} not compliant, {3} unreachable".format(
+            len(records), len(verdicts), len(failed), len(errors)))
+    for record in errors:
+        print("*** {0}: {1}".format(record['host'], record['error']))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'inventory': records, 'verdicts': verdicts}, f,
+                    indent=4, sort_keys=True)
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
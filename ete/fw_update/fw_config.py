@@ -208,6 +208,18 @@ BIOS_FW_ACCEPTABLE = {
     "X10DRU-i+":       ["4.0"],
 }
 
+"""
+BIOS settings baseline: sumtool BIOS config XML holding the settings to
+enforce with --bios-cfg. Only the settings that differ are changed.
+"""
+BIOS_CFG_PROFILES = dict([
+    ("X11DPT-B",                                  "%s/bios/X11DPT-B/bios_cfg.xml" %IMGS_PATH),
+    ("X11DPU",                                    "%s/bios/X11DPU/bios_cfg.xml" %IMGS_PATH),
+    ("X10SRW",                                    "%s/bios/X10SRW/bios_cfg.xml" %IMGS_PATH),
+    ("X10DRT-P",                                  "%s/bios/X10DRT-P/bios_cfg.xml" %IMGS_PATH),
+    ("X10DRU-i+",                                 "%s/bios/X10DRU-i+/bios_cfg.xml" %IMGS_PATH),
+])
+
 
 """ ----------------------- HBA LIST --------------------------"""
 
@@ -337,3 +349,31 @@ NIC_CHIPSET = {
     "INTC" : ["15d9:0920", "8086:000c", "15b3:0003", "15d9:0848", "15d9:0875", "15d9:0870", "15d9:085D", "15d9:0874"],
     "MLX"  : ["15b3:0003"],
 }
+
+""" -------------------- Firmware version rules ---------------------"""
+# The check_update_process of the updaters and the audit of fw_policy.py both
+# decide with these, so a compliance report cannot disagree with an update.
+
+def fw_table(component, name):
+    """ Return the xxx_FW_<name> table of component, eg. ('BMC', 'PREFER').
+    """
+    return globals()['%s_FW_%s' %(component.upper(), name)]
+
+def fw_prefer(component, part_number):
+    """ Return the preferred version of part_number and the file to update
+        with. Raises KeyError if the part or its file is not supported.
+    """
+    prefer_version = fw_table(component, 'PREFER')[part_number]
+    return (prefer_version,
+            fw_table(component, 'FILES')[(part_number, prefer_version)])
+
+def fw_acceptable(component, part_number, fw_version):
+    """ Return True if fw_version is in the acceptable list of part_number.
+    """
+    return fw_version in fw_table(component, 'ACCEPTABLE')[part_number]
+
+def fw_conflict(component, part_number, fw_version, prefer_version):
+    """ Return True if fw_version conflicts with an update to prefer_version.
+    """
+    return fw_version in fw_table(component, 'CONFLICT')[(part_number,
+            prefer_version)]
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+"""
+Program name:	fw_policy.py
+Description :
+    Firmware policy checks against the fw_config tables, without touching the
+    node.  evaluate() runs the same checks as check_update_process of the
+    updaters, in the same order and with the same fw_config rules:
+        - The version is the preferred one               -> PREFERRED
+        - The version is in the acceptable list          -> ACCEPTABLE
+        - The version conflicts with the preferred one   -> CONFLICT
+        - Otherwise the component requires the update    -> UPDATE
+    A part number missing from the tables the updaters read is UNSUPPORTED.
+
+    It lets inventories collected elsewhere (eg. the Redfish inventory crawl
+    of check_fw_compliance.py) be audited with the same rules the updaters
+    apply before flashing.
+"""
+
+import fw_config
+
+
+PREFERRED   = 'preferred'
+ACCEPTABLE  = 'acceptable'
+UPDATE      = 'update'
+CONFLICT    = 'conflict'
+UNSUPPORTED = 'unsupported'
+
+# Statuses that do not require an update
+COMPLIANT = (PREFERRED, ACCEPTABLE)
+
+
+def evaluate(component, part_number, fw_version):
+    """ Return a dict with the policy status of fw_version on part_number,
+        the preferred version and the file to update with.
+    """
+    result = {
+        'component':   component,
+        'part_number': part_number,
+        'version':     fw_version,
+        'preferred':   None,
+        'file':        None,
+    }
+
+    try:
+        result['preferred'] = fw_config.fw_table(component, 'PREFER').get(
+                part_number)
+        result['preferred'], result['file'] = fw_config.fw_prefer(component,
+                part_number)
+        if fw_version == result['preferred']:
+            result['status'] = PREFERRED
+        elif fw_config.fw_acceptable(component, part_number, fw_version):
+            result['status'] = ACCEPTABLE
+        elif fw_config.fw_conflict(component, part_number, fw_version,
+                result['preferred']):
+            result['status'] = CONFLICT
+        else:
+            result['status'] = UPDATE
+    except KeyError:
+        # The updaters stop on the same missing table entries
+        result['status'] = UNSUPPORTED
+    return result
+
+
+def is_compliant(result):
+    """ Return True if the evaluate() result does not require an update.
+    """
+    return result['status'] in COMPLIANT
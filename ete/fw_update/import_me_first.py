@@ -8,8 +8,5 @@ sys.path.insert(0, package_path)
 
 from lib import util
 
-util.add_python_packages('{0}'.format(package_path))
-util.add_python_packages('{0}/packages'.format(package_path))
-
-import argparse
-from pexpect.exceptions import TIMEOUT
+util.add_python_packages(package_path)
+util.add_python_packages(os.path.join(package_path, 'packages'))
@@ -0,0 +1,222 @@
+#!/usr/local/bin/python2.7
+
+"""
+Program Name: rollout_fw.py
+
+This utility rolls the firmware updates out to a fleet in waves. A canary \
+node is updated first, then batches growing after every clean wave, each \
+running the updater scripts of the components on its nodes concurrently. A \
+wave holds at most --max-per-rack nodes of one rack and --max-per-pdu nodes \
+of one PDU. The rollout slows down when a wave has failures and halts when \
+the failure budget is spent, leaving the remaining nodes untouched.
+
+Prerequisites:
+    - This module is tested on Python 2.7.15 and is compatible with python \
+      2.7 or later.
+
+Usage:
+    $ ./rollout_fw.py -h
+    usage: rollout_fw.py [-h] -f INVENTORY [-c COMPONENTS [COMPONENTS ...]] \
+            [--username USERNAME] [--password PASSWORD] [--canary CANARY] \
+            [--growth GROWTH] [--max-batch MAX_BATCH] \
+            [--max-per-rack MAX_PER_RACK] [--max-per-pdu MAX_PER_PDU] \
+            [--max-failures MAX_FAILURES] \
+            [--max-failure-rate MAX_FAILURE_RATE] [--pause PAUSE] \
+            [--timeout TIMEOUT] [--log-dir LOG_DIR] [-j JSON] \
+            [--updater-args UPDATER_ARGS] [--journal JOURNAL]
+
+    optional arguments:
+      -h, --help            displays the help message, then exit
+      -f, --inventory       file with one node per line: host [rack=R] [pdu=P]
+      -c, --components      components to update in order, default BMC BIOS
+      --username            node username
+      --password            node password
+      --canary              nodes in the first wave
+      --growth              factor the batch grows by after a clean wave
+      --max-batch           largest wave
+      --max-per-rack        nodes of one rack in a wave
+      --max-per-pdu         nodes of one PDU in a wave
+      --max-failures        failed nodes tolerated before halting
+      --max-failure-rate    failed fraction tolerated before halting
+      --pause               seconds to wait between waves
+      --timeout             seconds an updater may run
+      --log-dir             directory of the updater outputs, one per host
+      -j, --json            save the rollout summary to this json file
+      --updater-args        extra arguments passed to every updater
+      --journal             SQLite journal of the rollout, to resume it
+
+Examples:
+    Updates BMC then BIOS on the nodes of rack12.txt, at most 4 nodes of a \
+    rack at once, halting after 3 failed nodes:
+        $./rollout_fw.py -f rack12.txt --max-per-rack=4 --max-failures=3
+
+    Updates the NICs with a canary of 2 nodes and records the phase timings:
+        $./rollout_fw.py -f rack12.txt -c NIC --canary=2 \
+            --updater-args="--timing-db=/var/lib/fw_update/timings.db"
+
+    Updates every component of each node in a single session, rebooting \
+    the node once:
+        $./rollout_fw.py -f rack12.txt -c ALL
+
+    Journals the rollout; running the same command again after a crash \
+    skips the components already updated:
+        $./rollout_fw.py -f rack12.txt --journal=~/rack12_rollout.db
+
+The exit status is 0 if every node was updated, 1 otherwise.
+"""
+import argparse
+import json
+import logging
+import shlex
+import sys
+
+# Import your package (if any) below
+import import_me_first
+
+from lib import journal, rollout
+
+logging.basicConfig(filename="debug_rollout_fw.log", level=logging.DEBUG)
+
+# Options left out of the journal, --updater-args may carry BMC passwords
+SECRET_OPTIONS = ('password', 'updater_args')
+
+def parse_args():
+    ''' This function creates a parser object and adds the arguments and
+        information regarding the argument to the parser object. It then
+        returns the parsed arguments
+    '''
+    parser = argparse.ArgumentParser(
+        description='This parser gets all input options to roll out the updates')
+
+    # Add arguments
+    parser.add_argument(
+        '-f', '--inventory', required=True,
+        help='File with one node per line: host [rack=R] [pdu=P]')
+    parser.add_argument(
+        '-c', '--components', nargs='+', required=False,
+        help='Components to update, in order', default=['BMC', 'BIOS'])
+    parser.add_argument(
+        '--username', required=False,
+
+        # Default username for the PXE server
+        help='username', default='root')
+    parser.add_argument(
+        '--password', required=False,
+
+        # Default password for the PXE server
+        help='password', default='nutanix/4u')
+    parser.add_argument(
+        '--canary', type=int, required=False,
+        help='Nodes in the first wave', default=1)
+    parser.add_argument(
+        '--growth', type=int, required=False,
+        help='Factor the batch grows by after a clean wave', default=2)
+    parser.add_argument(
+        '--max-batch', type=int, required=False,
+        help='Largest wave', default=32)
+    parser.add_argument(
+        '--max-per-rack', type=int, required=False,
+        help='Nodes of one rack in a wave', default=None)
+    parser.add_argument(
+        '--max-per-pdu', type=int, required=False,
+        help='Nodes of one PDU in a wave', default=None)
+    parser.add_argument(
+        '--max-failures', type=int, required=False,
+        help='Failed nodes tolerated before halting', default=None)
+    parser.add_argument(
+        '--max-failure-rate', type=float, required=False,
+        help='Failed fraction of the nodes tolerated before halting',
+        default=0.1)
+    parser.add_argument(
+        '--pause', type=float, required=False,
+        help='Seconds to wait between waves', default=0)
+    parser.add_argument(
+        '--timeout', type=int, required=False,
+        help='Seconds an updater may run', default=3600)
+    parser.add_argument(
+        '--log-dir', required=False,
+        help='Directory of the updater outputs, one per host',
+        default='~/logs/rollout')
+    parser.add_argument(
+        '-j', '--json', required=False,
+        help='Save the rollout summary to this json file', default=None)
+    parser.add_argument(
+        '--updater-args', required=False,
+        help='Extra arguments passed to every updater', default='')
+    parser.add_argument(
+        '--journal', required=False,
+        help='SQLite journal of the rollout; a rollout restarted with the '
+             'same journal resumes where it stopped', default=None)
+
+    args = parser.parse_args()
+
+    return args
+
+'''--------------------------------------------------------------------------'''
+def main():
+    args = parse_args()
+    components = [c.upper() for c in args.components]
+    unknown = [c for c in components if c not in rollout.SCRIPTS]
+    if unknown:
+        print("No updater for {0}".format(', '.join(unknown)))
+        sys.exit(1)
+
+    nodes = rollout.load_inventory(args.inventory)
+    run_journal = None
+    if args.journal:
+        run_journal = journal.Journal(args.journal, note=journal_note(args))
+    runner = rollout.ScriptRunner(args.username, args.password,
+            extra_args=shlex.split(args.updater_args), timeout=args.timeout,
+            log_dir=args.log_dir)
+    controller = rollout.Rollout(nodes, components, runner,
+            canary=args.canary, growth=args.growth, max_batch=args.max_batch,
+            max_per_rack=args.max_per_rack, max_per_pdu=args.max_per_pdu,
+            max_failures=args.max_failures,
+            max_failure_rate=args.max_failure_rate, pause=args.pause,
+            on_result=print_result, journal=run_journal)
+    try:
+        summary = controller.run()
+    finally:
+        if run_journal:
+            run_journal.close()
+
+    print("\nRollout {0}{1}: {2} waves, {3} updated, {4} failed, {5} skipped".format(
+            summary['state'],
+            ' ({0})'.format(summary['reason']) if summary['reason'] else '',
+            len(summary['waves']), len(summary['succeeded']),
+            len(summary['failed']), len(summary['skipped'])))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=4, sort_keys=True)
+
+    sys.exit(0 if not summary['failed'] and not summary['skipped'] else 1)
+
+''' ------------------------------ journal_note -----------------------------'''
+def journal_note(args):
+    ''' This function returns the options of the rollout to note in the
+        journal, the secret ones are left out as the journal is kept as the
+        audit trail
+    '''
+    options = []
+    for name, value in sorted(vars(args).items()):
+        if name in SECRET_OPTIONS or value is None:
+            continue
+        if isinstance(value, list):
+            value = ' '.join(value)
+        options.append('--{0}={1}'.format(name.replace('_', '-'), value))
+    return ' '.join(options)
+
+''' ------------------------------ print_result -----------------------------'''
+def print_result(result):
+    ''' This function prints the outcome of one node as soon as it is done
+    '''
+    if result['status'] == rollout.SUCCESS:
+        print("{0:<28} {1}".format(result['host'], result['status']))
+    else:
+        outcome = result['components'][result['failed_component']]
+        print("{0:<28} {1} {2} {3}".format(result['host'], result['status'],
+                result['failed_component'], outcome.get('detail', '')))
+
+if __name__ == '__main__':
+    main()
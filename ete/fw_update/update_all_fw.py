@@ -0,0 +1,525 @@
+#!/usr/local/bin/python2.7
+
+'''
+Program Name: update_all_fw.py
+
+This utility checks and updates the firmware of every component of a node \
+in one session: HBA, MLX, NIC, BIOS, BMC and MCU. Running the six updater \
+scripts one after the other starts six interpreters and logs in, reads the \
+FRU and the inventory six times; here the node is logged into once and \
+the components are checked from one inventory.
+
+The outdated components are flashed with the preferred firmware of \
+"fw_config.py" in a safe order:
+    - HBA, MLX and NIC first, the BIOS update then runs on the updated \
+      devices,
+    - the BIOS before the BMC, sumtool flashes the BIOS through the BMC,
+    - the BMC, cold reset without waiting for it, the reboot wait covers it,
+    - the MCU last, it needs the BMC back and resets the power of the node.
+
+The node is then rebooted once if any of the flashed components only \
+becomes current after a reboot, logged into again, and every component is \
+checked again to verify the update.
+
+Prerequisites:
+    - This module is tested on Python 2.7.15 and is compatible with python \
+      2.7 or later.
+
+Usage:
+    $ ./update_all_fw.py -h
+    usage: update_all_fw.py [-h] [-l LOG] [-j JSON] [--username USERNAME] \
+            [--password PASSWORD] [--ip IP] \
+            [-c COMPONENTS [COMPONENTS ...]] [--check-only] \
+            [--reboot-timeout REBOOT_TIMEOUT] [--reboot-grace REBOOT_GRACE] \
+            [--bmc-timeout BMC_TIMEOUT] [--timing-db TIMING_DB] \
+            [--trace TRACE] [--metrics-dir METRICS_DIR]
+
+    optional arguments:
+      -h, --help            displays the help message, then exit
+      -l, --log             name for the log file to be saved as
+      -j, --json            save the result of every component to this file
+      --username            username for remote login
+      --password            password for remote login
+      --ip                  IP of the node to update
+      -c, --components      components to update, default all of them; they \
+                            are flashed in the safe order whatever the order \
+                            given
+      --check-only          report the outdated components, flash nothing
+      --reboot-timeout      seconds the node may take to come back
+      --reboot-grace        seconds to wait after the reboot before logging \
+                            in again
+      --bmc-timeout         seconds the BMC may take to come back after its \
+                            cold reset
+
+Examples:
+    Updates every outdated component of the remote node 192.168.2.123:
+        $python update_all_fw.py --ip=192.168.2.123
+        or
+        $./update_all_fw.py --ip=192.168.2.123
+
+    Lists the outdated components without flashing them:
+        $./update_all_fw.py --ip=192.168.2.123 --check-only
+
+    Updates the BIOS and the BMC only and saves the result:
+        $./update_all_fw.py --ip=192.168.2.123 -c BIOS BMC -j=node_sn.json
+
+The exit status is 0 if every component is current, 1 otherwise.
+'''
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+# Include the project package into the system path to allow import
+package_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, package_path)
+
+# Import your package (if any) below
+import import_me_first
+
+# Set up before the updaters are imported, their basicConfig is then a no-op
+logging.basicConfig(filename="debug_all_fw.log", level=logging.DEBUG)
+
+from lib import inventory, lazy, metrics, parsers, telemetry, timing_db, tracing
+import fw_config
+import update_bios_fw as bios
+import update_bmc_fw as bmc
+import update_hba_fw as hba
+import update_mcu_fw as mcu
+import update_nic_fw as nic
+
+# Heavy modules are imported on first use to keep --help and dry runs fast
+pexpect = lazy.lazy_import('pexpect')
+connection = lazy.lazy_import('lib.connection')
+
+this_filename = os.path.basename(__file__).split('.')[0]
+
+# Order the components are flashed in, see the module docstring
+COMPONENTS = ('HBA', 'MLX', 'NIC', 'BIOS', 'BMC', 'MCU')
+
+# Components whose new firmware only runs after a reboot of the node
+ACTIVATE_ON_REBOOT = ('MLX', 'NIC', 'BIOS', 'MCU')
+
+# Seconds between the login attempts after a reboot and between the BMC
+# polls after its cold reset
+REBOOT_POLL = 10
+BMC_POLL = 5
+
+# Results of a component
+CURRENT, UPDATED, OUTDATED, FAILED, ABSENT = (
+    'current', 'updated', 'outdated', 'failed', 'absent')
+
+
+class UpdateError(Exception):
+    pass
+
+
+def parse_args():
+    ''' This function creates a parser object and adds the arguments and
+        information regarding the argument to the parser object. It then
+        returns the parsed arguments
+    '''
+    parser = argparse.ArgumentParser(
+        description='This parser gets all input options to update all the '
+                    'components of a node')
+
+    # Add arguments
+    parser.add_argument(
+        '-l', '--log', help='Specify the log filename to be saved as',
+        default='{0}.log'.format(os.path.basename(__file__).split('.')[0]))
+    parser.add_argument(
+        '-j', '--json', required=False,
+        help='Save the result of every component to this json file',
+        default=None)
+    parser.add_argument(
+        '--username', required=False,
+
+        # Default username for the PXE server
+        help='username', default='root')
+    parser.add_argument(
+        '--password', required=False,
+
+        # Default password for the PXE server
+        help='password', default='nutanix/4u')
+    parser.add_argument(
+        '--ip', required=False,
+        help='Destination IP to update', default='localhost')
+    parser.add_argument(
+        '-c', '--components', nargs='+', choices=COMPONENTS,
+        help='Components to update, default all of them',
+        default=list(COMPONENTS))
+    parser.add_argument(
+        '--check-only', action='store_true',
+        help='Report the outdated components without flashing them')
+    parser.add_argument(
+        '--reboot-timeout', type=float, required=False,
+        help='Seconds the node may take to come back after the reboot',
+        default=900)
+    parser.add_argument(
+        '--reboot-grace', type=float, required=False,
+        help='Seconds to wait after the reboot before logging in again',
+        default=30)
+    parser.add_argument(
+        '--bmc-timeout', type=float, required=False,
+        help='Seconds the BMC may take to come back after its cold reset',
+        default=300)
+    telemetry.add_run_args(parser)
+
+    args = parser.parse_args()
+
+    return args
+
+''' ------------------------------ Session ----------------------------------'''
+def login(args, ping_before_connect=False):
+    ''' This function opens the session to the node and returns it
+    '''
+    conn = connection.for_host(args.ip, logfile=sys.stdout,
+            static_logpath='~/logs/{0}'.format(this_filename))
+    conn.login(args.ip, args.username, args.password,
+               auto_prompt_reset=False, remove_known_hosts=True,
+               ping_before_connect=ping_before_connect)
+    return conn
+
+def reboot(conn, args):
+    ''' This function reboots the node and returns a new session once the node
+        is back up. The old session is closed.
+    '''
+    if conn.isalive():
+        logging.info("Rebooting %s to activate the new firmware" %args.ip)
+        conn.sendline('reboot')
+        try:
+            conn.expect([pexpect.EOF, pexpect.TIMEOUT], timeout=60)
+        finally:
+            conn.close()
+    else:
+        # The MCU update reset the power of the node already
+        conn.close()
+
+    with timing_db.phase('reboot_wait'):
+        # The node keeps answering for a while after the reboot command
+        time.sleep(args.reboot_grace)
+        deadline = time.time() + args.reboot_timeout
+        while True:
+            try:
+                with timing_db.phase('login'):
+                    return login(args, ping_before_connect=True)
+            except connection.ExceptionPxssh:
+                if time.time() >= deadline:
+                    raise UpdateError("%s did not come back within %s seconds "
+                            "after the reboot" %(args.ip, args.reboot_timeout))
+                logging.debug("%s is not up yet" %args.ip)
+                time.sleep(REBOOT_POLL)
+
+def wait_for_bmc(conn, timeout):
+    ''' This function waits for the BMC to answer after its cold reset and
+        returns its version
+    '''
+    deadline = time.time() + timeout
+    with timing_db.phase('reboot_wait', component='BMC'):
+        while True:
+            conn.sendline('/usr/bin/ipmicfg-linux.x86_64 -ver', conn.PROMPT)
+            version = parsers.ipmicfg_ver(conn.output or '')['version']
+            if version:
+                return version
+            if time.time() >= deadline:
+                raise UpdateError("The BMC did not come back within %s "
+                        "seconds after its cold reset" %timeout)
+            time.sleep(BMC_POLL)
+
+''' ------------------------------ Checks -----------------------------------'''
+# Each check gets the outputs of the QUERIES of its component and returns
+# the devices of the component found on the node, a dict per device with its
+# part number, firmware version, whether it requires an update, the file to
+# flash and the function flashing it.
+
+# Read-only queries of the checks, all run in one batch
+QUERIES = {
+    'HBA': ("%s/sas3flash -listall" %fw_config.CMD_PATH,
+            "%s/sas3flash -list" %fw_config.CMD_PATH),
+    'MLX': ("%s/mlxup -query" %fw_config.CMD_PATH,),
+    'BMC': ('/usr/bin/ipmicfg-linux.x86_64 -ver',),
+    'MCU': ('/usr/bin/ipmicfg-linux.x86_64 -tp info',),
+}
+
+# Seconds the batch of queries may take
+QUERY_TIMEOUT = 120
+
+def check_hba(conn, outputs):
+    ''' This function checks the HBA controllers
+    '''
+    devices = []
+    controllers = parsers.sas3flash_listall(outputs[0])
+    if controllers:
+        board = parsers.sas3flash_list(outputs[1]).get('Board Name')
+        if board != "LSI3008-IT":
+            raise UpdateError("The current fw update won't accept IR "
+                    "firmware %s" %board)
+    for ctrl_num, controller in enumerate(controllers):
+        part_number, version = controller['controller'], controller['fw_version']
+        required, file_name = hba.check_update_process(conn, ctrl_num,
+                part_number, version)
+        devices.append({
+            'device': 'controller %s' %ctrl_num,
+            'part_number': part_number, 'version': version,
+            'required': required,
+            'file_name': file_name,
+            'flash': lambda conn, ctrl_num=ctrl_num, file_name=file_name:
+                hba.do_fw_update(conn, ctrl_num, file_name),
+        })
+    return devices
+
+def check_mlx(conn, outputs):
+    ''' This function checks the Mellanox cards. They are checked against the
+        NIC firmware list as update_nic_fw.py does, so a card already
+        current is not flashed again
+    '''
+    devices = []
+    for card in parsers.mlxup_query(outputs[0]):
+        part_number = card.get('Part Number', '')
+        if not part_number.upper().startswith('MCX'):
+            continue
+        version = card['versions'].get('FW')
+        required, file_name = nic.check_update_process(conn, part_number,
+                version)
+        devices.append({
+            'device': card.get('PCI Device Name') or part_number,
+            'part_number': part_number, 'version': version,
+            'required': required, 'file_name': file_name,
+            'flash': lambda conn, file_name=file_name:
+                nic.do_mlx_fw_update(conn, file_name),
+        })
+    return devices
+
+def check_nic(conn, outputs):
+    ''' This function checks the NIC of every interface
+    '''
+    devices = []
+    for port in nic.get_enp_interface(conn):
+        part_number = nic.get_sub_system_from_eth(conn, port)
+        if part_number in fw_config.NIC_CHIPSET["INTC"]:
+            do_fw_update = nic.do_intc_fw_update
+        elif part_number in fw_config.NIC_CHIPSET["MLX"]:
+            do_fw_update = nic.do_mlx_fw_update
+        else:
+            logging.warning("Chipset %s of %s is not supported"
+                    %(part_number, port))
+            continue
+        version = nic.get_fw_from_eth(conn, port)
+        required, file_name = nic.check_update_process(conn, part_number,
+                version)
+        devices.append({
+            'device': port, 'part_number': part_number, 'version': version,
+            'required': required, 'file_name': file_name,
+            'flash': lambda conn, file_name=file_name, do_fw_update=do_fw_update:
+                do_fw_update(conn, file_name),
+        })
+    return devices
+
+def check_bios(conn, outputs):
+    ''' This function checks the BIOS of the mother board
+    '''
+    part_number = bios.get_part_info(conn)
+    version = bios.get_part_version(conn)
+    required, file_name = bios.check_update_process(conn, part_number, version)
+    return [{
+        'device': 'BIOS', 'part_number': part_number, 'version': version,
+        'required': required, 'file_name': file_name,
+        'flash': bios.do_fw_update,
+    }]
+
+def check_bmc(conn, outputs):
+    ''' This function checks the BMC of the mother board
+    '''
+    part_number = bmc.get_part_info(conn)
+    version = parsers.ipmicfg_ver(outputs[0])['version']
+    required, file_name = bmc.check_update_process(conn, part_number, version)
+    return [{
+        'device': 'BMC', 'part_number': part_number, 'version': version,
+        'required': required, 'file_name': file_name,
+        # The reboot of the node or wait_for_bmc() waits for the BMC
+        'flash': lambda conn, file_name=file_name:
+            bmc.do_fw_update(conn, file_name, reset_wait=0),
+    }]
+
+def check_mcu(conn, outputs):
+    ''' This function checks the MCU of the backplane, if there is one
+    '''
+    info = parsers.ipmicfg_tp_info(outputs[0])
+    if not info['part_number']:
+        return []
+    required, file_name = mcu.check_update_process(conn, info['part_number'],
+            info['version'])
+    return [{
+        'device': 'backplane', 'part_number': info['part_number'],
+        'version': info['version'], 'required': required,
+        'file_name': file_name, 'flash': flash_mcu,
+    }]
+
+def flash_mcu(conn, file_name):
+    ''' This function flashes the MCU. The update resets the power of the
+        node, the session drops with it
+    '''
+    try:
+        mcu.do_fw_update(conn, file_name)
+    except pexpect.EOF:
+        logging.debug("The MCU update reset the power of the node")
+
+CHECKS = {
+    'HBA': check_hba, 'MLX': check_mlx, 'NIC': check_nic,
+    'BIOS': check_bios, 'BMC': check_bmc, 'MCU': check_mcu,
+}
+
+def check_components(conn, components, phase='inventory'):
+    ''' This function checks the components from one inventory of the node.
+        It returns the devices of each component, or the error that stopped
+        its check. The time taken is recorded as phase.
+    '''
+    inventory.get(conn, refresh=True)
+    cmds = [cmd for component in components for cmd in QUERIES.get(component, ())]
+    with timing_db.phase(phase):
+        results = iter(conn.run_batch(cmds, timeout=QUERY_TIMEOUT))
+    checked = {}
+    for component in components:
+        outputs = [next(results).output or '' for _ in QUERIES.get(component, ())]
+        try:
+            with timing_db.phase(phase, component=component):
+                checked[component] = CHECKS[component](conn, outputs)
+        except (SystemExit, KeyError, UpdateError), e:
+            # The updaters exit on an unsupported part or a conflict
+            logging.error("%s check failed: %r" %(component, e))
+            checked[component] = e
+    return checked
+
+''' ------------------------------ Update -----------------------------------'''
+def flash_components(conn, args, checked):
+    ''' This function flashes the devices requiring an update in the order of
+        COMPONENTS. It returns the session, a new one if the node had to
+        reboot in the middle of a flash, and the flashed components. It stops
+        at the first flash that fails.
+    '''
+    flashed = []
+    files = set()
+    bmc_reset = False
+    for component in COMPONENTS:
+        devices = checked.get(component)
+        if isinstance(devices, Exception) or not devices:
+            continue
+        for device in devices:
+            if not device['required'] or device['file_name'] in files:
+                continue
+            if component == 'MCU' and bmc_reset:
+                # ipmicfg talks to the BMC
+                wait_for_bmc(conn, args.bmc_timeout)
+            print("Updating %s %s %s to %s" %(component, device['device'],
+                    device['version'], device['file_name']))
+            try:
+                with tracing.span(component, cat='component'):
+                    # The updaters record the flash, reset and reboot phases
+                    with timing_db.component(component):
+                        if device['flash'](conn, device['file_name']):
+                            # The BIOS flash rebooted the node to finish
+                            conn = reboot(conn, args)
+                            if device['flash'](conn, device['file_name']):
+                                raise UpdateError("The BIOS flash did not "
+                                        "complete after the reboot")
+            except (SystemExit, UpdateError), e:
+                logging.error("%s flash of %s failed: %r" %(component,
+                        device['device'], e))
+                raise UpdateError("%s flash of %s failed" %(component,
+                        device['device']))
+            files.add(device['file_name'])
+            flashed.append(component)
+            bmc_reset = bmc_reset or component == 'BMC'
+    return conn, flashed
+
+def summarize(checked, verified, flashed):
+    ''' This function returns the result of every component from the checks
+        before and after the update
+    '''
+    summary = {}
+    for component in COMPONENTS:
+        before, after = checked.get(component), verified.get(component)
+        if before is None:
+            continue
+        if isinstance(before, Exception) or isinstance(after, Exception):
+            error = before if isinstance(before, Exception) else after
+            summary[component] = {'result': FAILED, 'error': repr(error)}
+            continue
+        if not before:
+            summary[component] = {'result': ABSENT}
+            continue
+        outdated = [d for d in after if d['required']]
+        if outdated:
+            result = FAILED if component in flashed else OUTDATED
+        else:
+            result = UPDATED if component in flashed else CURRENT
+        summary[component] = {
+            'result': result,
+            'devices': [{'device': b['device'], 'part_number': b['part_number'],
+                         'before': b['version'], 'after': a['version']}
+                        for b, a in zip(before, after)],
+        }
+    return summary
+
+'''-------------------------------------------------------------------------'''
+def main():
+    args = parse_args()
+    components = [c for c in COMPONENTS if c in args.components]
+    summary = {}
+
+    with open(args.log, 'wb') as log, telemetry.run_context(args, args.ip, 'ALL'):
+        conn = None
+        try:
+            started = time.time()
+
+            with timing_db.phase('login'):
+                conn = login(args)
+            checked = check_components(conn, components)
+            timing_db.set_model(inventory.get(conn).get('board_name'))
+
+            flashed = []
+            if not args.check_only:
+                conn, flashed = flash_components(conn, args, checked)
+
+            if any(c in ACTIVATE_ON_REBOOT for c in flashed):
+                conn = reboot(conn, args)
+            if 'BMC' in flashed:
+                wait_for_bmc(conn, args.bmc_timeout)
+            verified = (check_components(conn, components, phase='verify')
+                        if flashed else checked)
+
+            summary = summarize(checked, verified, flashed)
+            for component in components:
+                print("%-5s %s" %(component, summary[component]['result']))
+            print("Update of %s completed in %.0f seconds" %(args.ip,
+                    time.time() - started))
+
+            if all(s['result'] in (CURRENT, UPDATED, ABSENT)
+                   for s in summary.values()):
+                metrics.set_result('success')
+            else:
+                exit(1)
+
+        except pexpect.TIMEOUT:
+            if conn is not None and conn.output:
+                print('{0}'.format(conn.output))
+            metrics.set_result('timeout')
+            print('*** Timeout occurred for {0}!'.format(args.ip))
+            exit(1)
+        except (UpdateError, connection.ExceptionPxssh), e:
+            logging.error(e)
+            print('*** Update of {0} failed: {1}'.format(args.ip, e))
+            exit(1)
+        finally:
+            if args.json and summary:
+                with open(args.json, 'w') as f:
+                    json.dump(summary, f, indent=4, sort_keys=True)
+            time.sleep(.1)
+            if conn is not None and conn.isalive():
+                conn.logout()
+
+if __name__ == '__main__':
+    main()
@@ -65,6 +65,27 @@ Examples:
         or
         ./update_bios_fwupdate.py --json=node_sn.json
 
+    Updates the BIOS out-of-band through the Redfish service of the BMC \
+    192.168.3.123, the host OS does not need to be up:
+        python update_bios_fw.py --redfish=192.168.3.123 --bmc-password=ADMIN
+        or
+        ./update_bios_fw.py --redfish=https://192.168.3.123
+
+    Updates the BIOS and watches the SOL console of the BMC 192.168.3.123 \
+    from this host to tell when the node is back from a reboot, instead of \
+    sleeping:
+        python update_bios_fw.py --ip=192.168.2.123 --bmc-ip=192.168.3.123
+        or
+        ./update_bios_fw.py --ip=192.168.2.123 --bmc-ip=192.168.3.123
+
+    Updates the BIOS and enforces the BIOS settings of the board's profile \
+    in "fw_config.py", only the settings that differ are changed. After an \
+    update the node is rebooted into the new BIOS before its settings are \
+    read, and rebooted again when settings changed so they take effect:
+        python update_bios_fw.py --ip=192.168.2.123 --bios-cfg
+        or
+        ./update_bios_fw.py --ip=192.168.2.123 --bios-cfg=golden.xml
+
 '''
 
 import json
@@ -82,16 +103,25 @@ sys.path.insert(0, package_path)
 # Import your package (if any) below
 import import_me_first
 
-from pexpect.exceptions import TIMEOUT
-from lib.connection import Connection
 from lib.dec import time_elapsed
+from lib import inventory, lazy, metrics, parsers, telemetry, timing_db, tracing
 import fw_config as BIOS
 
+# Heavy modules are imported on first use to keep --help and dry runs fast
+pexpect = lazy.lazy_import('pexpect')
+connection = lazy.lazy_import('lib.connection')
+bios_cfg = lazy.lazy_import('lib.bios_cfg')
+redfish = lazy.lazy_import('lib.redfish')
+sol = lazy.lazy_import('lib.sol')
+
 logging.basicConfig(filename="debug_bios_fw.log", level=logging.DEBUG)
 #logging.basicConfig(level=logging.DEBUG)
 
 this_filename = os.path.basename(__file__).split('.')[0]
 
+# Seconds to wait for a rebooting node when its SOL console is not watched
+REBOOT_WAIT = 820
+
 def parse_args():
     ''' This function creates a parser object and adds the arguments and
         information regrading the argument to the parser object. It then
@@ -118,6 +148,26 @@ def parse_args():
     parser.add_argument(
         '-v', '--version', type=str,
         help='firmware version to update', required=False, nargs='+')
+    telemetry.add_run_args(parser)
+    parser.add_argument(
+        '--bios-cfg', required=False, nargs='?', const='', metavar='PROFILE',
+        help='Enforce the BIOS settings of this golden profile, or of the '
+             'BIOS_CFG_PROFILES entry of the board when no file is given',
+        default=None)
+    parser.add_argument(
+        '--redfish', required=False, metavar='BMC',
+        help='Update out-of-band through the Redfish service of this BMC '
+             '(IP, host:port or URL) instead of over SSH', default=None)
+    parser.add_argument(
+        '--bmc-ip', required=False,
+        help='BMC of the node, its SOL console is watched from this host to '
+             'tell when a reboot is over instead of sleeping', default=None)
+    parser.add_argument(
+        '--bmc-username', required=False,
+        help='BMC username for --redfish and --bmc-ip', default='ADMIN')
+    parser.add_argument(
+        '--bmc-password', required=False,
+        help='BMC password for --redfish and --bmc-ip', default='ADMIN')
 
     args = parser.parse_args()
 
@@ -133,10 +183,7 @@ def get_fru_info(conn, verbose=False):
     # Get FRU info if it does not exist
     conn.sendline('ipmitool fru', conn.PROMPT)
     if conn.output:
-        for line in conn.output.split('\n')[1:]:
-            if ' : ' in line:
-                k, v = line.split(' : ', 1)
-                fru[k.strip()] = v.strip()
+        fru = parsers.fru(conn.output)
     else:
         logging.error('ERROR: ipmitool fru command returns nothing!')
         sys.exit(1)
@@ -152,13 +199,7 @@ def get_part_info(conn, verbose=False):
     ''' This function gets and returns the part number of the BIOS
     '''
 
-    conn.sendline('dmidecode -t baseboard', conn.PROMPT)
-    if conn.output:
-        baseboard_obj = re.search(r'[P][r][o][d]\w+\s+[N]\w+[:]\s+[a-zA-z0-9]+[.-]\w+', conn.output, re.I|re.M)
-        bios_baseboard = baseboard_obj.group()
-        if bios_baseboard:
-            baseboard_obj = re.search(r'[a-zA-Z0-9]+[.-]\w+', bios_baseboard)
-            bios_baseboard = baseboard_obj.group()
+    bios_baseboard = inventory.dmi(conn, 'board_name')
 
     if verbose:
         logging.debug(json.dumps(bios_baseboard, indent=4))
@@ -170,13 +211,7 @@ def get_part_info(conn, verbose=False):
 def get_part_version(conn, verbose=False):
     ''' This function gets and returns the BIOS's version
     '''
-    conn.sendline('dmidecode -t bios', conn.PROMPT)
-    if conn.output:
-        bios_obj = re.search(r'[V][e][r]\w+\:\s+\w+\S+', conn.output, re.I|re.M)
-        bios_version = bios_obj.group()
-        if bios_version:
-            bios_obj = re.search(r'\w+\d+\S+', bios_version)
-            bios_version = bios_obj.group()
+    bios_version = inventory.dmi(conn, 'bios_version')
 
     if verbose:
         logging.debug(json.dumps(bios_version, indent=4))
@@ -191,7 +226,7 @@ def is_fw_acceptable(conn, bios_baseboard, bios_version, verbose=False):
         returns True
     '''
 
-    if (bios_version in BIOS.BIOS_FW_ACCEPTABLE[bios_baseboard]):
+    if BIOS.fw_acceptable('BIOS', bios_baseboard, bios_version):
         logging.debug("bios firmware Version: %s is acceptable" %bios_version)
         return True
     else:
@@ -207,7 +242,7 @@ def is_update_conflict(conn, bios_baseboard, bios_version, prefer_bios_version,
         update to the preferred one. If the update causes a conflict, return
         True
     '''
-    if (bios_version in BIOS.BIOS_FW_CONFLICT[(bios_baseboard, prefer_bios_version)]):
+    if BIOS.fw_conflict('BIOS', bios_baseboard, bios_version, prefer_bios_version):
         logging.error("FAIL:BIOS:UPDATE:Detected="+str(bios_version)+":Couldn't update to the prefer version")
         logging.debug("bios version updated from version: % to cersion: % will be conflicted" %(bios_version, prefer_bios_version))
         return True
@@ -226,9 +261,8 @@ def is_reboot_action(conn, bios_update_msg, verbose=False):
     reboot_action = re.search(r'Manual steps are required',msg)
     if reboot_action:
         logging.debug("Soft reboot required before the FDT update")
-        logging.debug("wait 320 seconds to reboot")
+        # The caller waits for the node to come back with wait_for_reboot
         conn.sendline('reboot -f', "Rebooting.")
-        time.sleep(320)
         return True
     else:
         logging.debug("UUT update completed !")
@@ -237,6 +271,7 @@ def is_reboot_action(conn, bios_update_msg, verbose=False):
 
 """ ----------------------------- do_fw_update ------------------------------"""
 #@time_elapsed
+@tracing.traced()
 def do_fw_update(conn, file_name):
     """ This function gets the BIOS file name and does the update.
     """
@@ -258,7 +293,8 @@ def do_fw_update(conn, file_name):
     # WARNING:Must power cycle or restart the system
     #CMD = "%s/sumtool -c UpdateBios --file " %BIOS.CMD_PATH
     CMD = "/usr/bin/sumtool -c UpdateBios --file "
-    conn.sendline(CMD +file_name, "WARNING", timeout=800)
+    with timing_db.phase('flash'):
+        conn.sendline(CMD +file_name, "WARNING", timeout=800)
     """
     # Applied for remote
     if is_reboot_action(conn, conn.output):
@@ -292,9 +328,8 @@ def check_update_process(conn, part_number, fw_version):
 
     try:
         # Check the preferred version from the list
-        prefer_bios_version = BIOS.BIOS_FW_PREFER[part_number]
+        prefer_bios_version, file_name = BIOS.fw_prefer('BIOS', part_number)
         logging.debug("expect_ver %s" %(prefer_bios_version))
-        file_name           = BIOS.BIOS_FW_FILES[(part_number, prefer_bios_version)]
         logging.debug(file_name)
     except KeyError, e:
         logging.error("The version %s is not supported" %part_number)
@@ -336,16 +371,17 @@ def check_update_process(conn, part_number, fw_version):
 
 '''------------------------ check_support_process ---------------------------'''
 
-def check_support_process(conn, model, version):
+def check_support_process(conn, model, version, uut_part_number=None):
     """ This function checks if the forced update option is available. If the
-        option is supported, it returns True and the file name to update.
+        option is supported, it returns True and the file name to update. The
+        on-board part is read over conn unless uut_part_number is given.
     """
     # Check the version support
     version = str(version)[2:-2]
 
     try:
         update_part_number = (BIOS.fw[model]["BIOS"])
-        uut_part_number    = get_part_info(conn)
+        uut_part_number    = uut_part_number or get_part_info(conn)
         file_name          = BIOS.BIOS_FW_FILES[(update_part_number, version)]
     except KeyError, e:
         logging.error("The version %s is not supported" %version)
@@ -358,20 +394,178 @@ def check_support_process(conn, model, version):
 
     return (True, file_name)
 
+''' ---------------------------- wait_for_reboot ----------------------------'''
+def wait_for_reboot(args, seconds=REBOOT_WAIT):
+    """ This function waits for the node to come back after a reboot. With
+        --bmc-ip the SOL console of the node is watched from this host and the
+        wait ends as soon as the OS login prompt shows, otherwise it sleeps.
+    """
+    with timing_db.phase('reboot_wait'):
+        if not args.bmc_ip:
+            logging.debug("wait %d seconds for the reboot" %seconds)
+            time.sleep(seconds)
+            return
+
+        stand = connection.for_host('localhost',
+                static_logpath='~/logs/{0}'.format(this_filename))
+        stand.login('localhost')
+        try:
+            elapsed = sol.wait_for_reboot(stand, args.bmc_ip,
+                    args.bmc_username, args.bmc_password, timeout=seconds)
+            logging.debug("The node rebooted in %d seconds" %elapsed)
+        except (pexpect.TIMEOUT, sol.SolError), e:
+            logging.error("The node did not come back: %s" %e)
+            print('*** {0} did not come back after the reboot'.format(args.ip))
+            exit(1)
+        finally:
+            stand.logout()
+
+''' ------------------------------- relogin ---------------------------------'''
+def relogin(args):
+    """ This function waits for the node to come back after a reboot and
+        returns a new session to it.
+    """
+    wait_for_reboot(args)
+    conn = connection.for_host(args.ip, logfile=sys.stdout,
+            static_logpath='~/logs/{0}'.format(this_filename))
+    with timing_db.phase('login'):
+        conn.login(args.ip, args.username, args.password, args.model,
+                auto_prompt_reset=False, remove_known_hosts=True,
+                ping_before_connect=True)
+    return conn
+
+''' ---------------------------- apply_bios_cfg -----------------------------'''
+#@time_elapsed
+@tracing.traced()
+def apply_bios_cfg(conn, part_number, profile, dry_run=False):
+    """ This function enforces the BIOS settings of the golden profile. Only
+        the settings that differ are changed, in one ChangeBiosCfg call. It
+        returns True if settings changed and the node requires a reboot. With
+        dry_run nothing is changed, it returns True if settings differ.
+    """
+    if not profile:
+        try:
+            profile = BIOS.BIOS_CFG_PROFILES[part_number]
+        except KeyError, e:
+            logging.error("No BIOS config profile for %s" %part_number)
+            exit(1)
+
+    logging.debug("Enforcing BIOS config profile %s" %profile)
+    try:
+        with timing_db.phase('configure'):
+            changes = bios_cfg.enforce(conn, profile, dry_run=dry_run)
+    except bios_cfg.BiosCfgError, e:
+        logging.error("BIOS config failed: %s" %e)
+        exit(1)
+
+    if changes and dry_run:
+        logging.debug("%d BIOS settings differ from the profile" %len(changes))
+        return True
+    elif changes:
+        logging.debug("%d BIOS settings changed. The node is required to be "
+                "re-booted for the settings to take effect." %len(changes))
+        print("BIOS settings changed: %d" %len(changes))
+        return True
+    else:
+        logging.debug("BIOS settings match the profile")
+        return False
+
+''' --------------------------- enforce_bios_cfg ----------------------------'''
+def enforce_bios_cfg(conn, args, part_number):
+    """ This function enforces the BIOS settings of the profile. If settings
+        changed, the node is rebooted for them to take effect and they are
+        read again, the script fails if they still differ from the profile.
+        It returns the session to the node, a new one after a reboot.
+    """
+    if not apply_bios_cfg(conn, part_number, args.bios_cfg):
+        return conn
+
+    logging.debug("Reboot for the BIOS settings to take effect")
+    conn.sendline('reboot -f', "Rebooting.")
+    conn = relogin(args)
+    if apply_bios_cfg(conn, part_number, args.bios_cfg, dry_run=True):
+        logging.error("The BIOS settings did not take effect after the reboot")
+        print('*** BIOS settings of {0} differ from the profile after the '
+              'reboot'.format(args.ip))
+        conn.logout()
+        exit(1)
+    print("BIOS settings applied")
+    return conn
+
+''' ------------------------ do_redfish_update ------------------------------'''
+@tracing.traced()
+def do_redfish_update(client, file_name):
+    """ This function streams the BIOS file to the Redfish UpdateService of
+        the BMC and waits for the update task to complete.
+    """
+    logging.debug("Update file location %s " %(file_name))
+    with timing_db.phase('transfer'):
+        task = client.update_firmware(file_name)
+    with timing_db.phase('flash'):
+        client.wait_task(task, timeout=800)
+    logging.debug("BIOS flash is successful !!!. The node is required " +
+            "to be re-booted for the firmware update to take effect.")
+
+''' ------------------------ BIOS Redfish Process ---------------------------'''
+def redfish_process(args):
+    """ This function does the BIOS update out-of-band through the BMC's
+        Redfish service, the host OS does not need to be up.
+    """
+    client = redfish.RedfishClient(args.redfish, args.bmc_username,
+            args.bmc_password)
+    if args.bios_cfg is not None:
+        logging.warning("--bios-cfg needs the SSH session, ignored with --redfish")
+    try:
+        with timing_db.phase('inventory'):
+            part_number = client.board_model()
+            fw_version  = client.firmware_version('BIOS')
+        timing_db.set_model(part_number)
+        logging.debug("Redfish reports %s BIOS version %s" %(part_number,
+                fw_version))
+
+        if args.model:
+            if not args.version:
+                logging.error("Missing option -v <version>")
+                exit(1)
+            (ret_status, ret_file) = check_support_process(None, args.model,
+                    args.version, uut_part_number=part_number)
+        else:
+            (ret_status, ret_file) = check_update_process(None, part_number,
+                    fw_version)
+
+        if ret_status:
+            do_redfish_update(client, ret_file)
+        else:
+            logging.debug("BIOS does not require an update")
+    except redfish.RedfishError, e:
+        logging.error("Redfish update failed: %s" %e)
+        print('*** Redfish update failed for {0}: {1}'.format(args.redfish, e))
+        exit(1)
+
 ''' -------------------------------- Main -----------------------------------'''
 
 def main():
     model, version = "", ""
     args = parse_args()
 
-    with open(args.log, 'wb') as log:
+    host = args.redfish or args.ip
+    with open(args.log, 'wb') as log, telemetry.run_context(args, host, 'BIOS'):
         try:
             is_logged_in = False
-            conn = Connection(logfile=sys.stdout,
+
+            if args.redfish:
+                # Out-of-band update, no SSH session to the host OS
+                redfish_process(args)
+                metrics.set_result('success')
+                print("BIOS update successful!")
+                exit(0)
+
+            conn = connection.for_host(args.ip, logfile=sys.stdout,
                     static_logpath='~/logs/{0}'.format(this_filename))
-            is_logged_in = conn.login(args.ip, args.username, args.password,
-                    args.model, auto_prompt_reset=False,
-                    remove_known_hosts=True, ping_before_connect=False)
+            with timing_db.phase('login'):
+                is_logged_in = conn.login(args.ip, args.username,
+                        args.password, args.model, auto_prompt_reset=False,
+                        remove_known_hosts=True, ping_before_connect=False)
 
             if args.model:
                 # Update with options -m and -v
@@ -383,15 +577,9 @@ def main():
                         if do_fw_update(conn, ret_file):
                             # Redo the update after boot up
                             is_logged_in = False
-                            conn = Connection(logfile=sys.stdout,
-                                    static_logpath='~/logs/{0}'.format(this_filename))
-                            is_logged_in = conn.login(args.ip, args.username,
-                                        args.password, args.model,
-                                        auto_prompt_reset=False,
-                                        remove_known_hosts=True,
-                                        ping_before_connect=True)
+                            conn = relogin(args)
+                            is_logged_in = True
                             print("Files will be updated after reboot")
-                            time.sleep(500)
                             if do_fw_update(conn, ret_file):
                                 logging.error("Update process is bad")
                                 exit(1)
@@ -400,29 +588,26 @@ def main():
                         else:
                             # Update finished
                             print("Update completed!")
+                    part_number = BIOS.fw[args.model]["BIOS"]
                 else:
                     logging.error("Missing option -v <version>")
                     exit(1)
 
             else:
                 # Default update: The script checks the component part number, current firmware
-                part_number  = get_part_info(conn)
-                fw_version   = get_part_version(conn)
+                with timing_db.phase('inventory'):
+                    part_number  = get_part_info(conn)
+                    fw_version   = get_part_version(conn)
+                timing_db.set_model(part_number)
                 (ret_status, ret_file) =  check_update_process(conn,
                         part_number, fw_version)
                 if ret_status:
                     if do_fw_update(conn, ret_file):
                         is_logged_in = False
-                        conn = Connection(logfile=sys.stdout,
-                                static_logpath='~/logs/{0}'.format(this_filename))
-                        is_logged_in = conn.login(args.ip, args.username,
-                                args.password, args.model,
-                                auto_prompt_reset=False,
-                                remove_known_hosts=True,
-                                ping_before_connect=True)
+                        conn = relogin(args)
+                        is_logged_in = True
                         print("update files after reboot")
-                        time.sleep(500)
-                        if update_process(conn, ret_file):
+                        if do_fw_update(conn, ret_file):
                             logging.error("Update process is bad")
                             exit(1)
                         else:
@@ -431,15 +616,31 @@ def main():
                         # Update finished
                         logging.debug("Update completed!")
                 else:
+                    if args.bios_cfg is not None:
+                        is_logged_in = False
+                        conn = enforce_bios_cfg(conn, args, part_number)
+                        is_logged_in = True
+                    metrics.set_result('success')
                     logging.debug("BIOS does not require an update")
                     exit(0)
 
+            if args.bios_cfg is not None:
+                # The first boot of the new BIOS may reset the settings, they
+                # are read and enforced once the node runs it
+                logging.debug("Reboot into the new BIOS before the config")
+                conn.sendline('reboot -f', "Rebooting.")
+                is_logged_in = False
+                conn = relogin(args)
+                conn = enforce_bios_cfg(conn, args, part_number)
+                is_logged_in = True
+            metrics.set_result('success')
             print("BIOS update successful!")
             exit(0)
 
-        except TIMEOUT:
+        except pexpect.TIMEOUT:
             if conn.output:
                 print('{0}'.format(conn.output))
+            metrics.set_result('timeout')
             print('*** Timeout occurred for {0}!'.format(args.ip))
         finally:
             time.sleep(.1)
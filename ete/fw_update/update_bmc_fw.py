@@ -68,11 +68,16 @@ Examples:
         or
         $./update_bmc_fw.py --json=node_sn.json
 
+    Updates the BMC out-of-band through the Redfish service of the BMC \
+    192.168.3.123, the host OS does not need to be up:
+        $python update_bmc_fw.py --redfish=192.168.3.123 --bmc-password=ADMIN
+        or
+        $./update_bmc_fw.py --redfish=https://192.168.3.123
+
 """
 import argparse
 import json
 import os
-import re
 import sys
 import time
 import logging
@@ -80,11 +85,15 @@ import logging
 # Import your package (if any) below
 import import_me_first
 
-from pexpect.exceptions import TIMEOUT
-from lib.connection import Connection
 from lib.dec import time_elapsed
+from lib import inventory, lazy, metrics, parsers, telemetry, timing_db, tracing
 import fw_config as BMC
 
+# Heavy modules are imported on first use to keep --help and dry runs fast
+pexpect = lazy.lazy_import('pexpect')
+connection = lazy.lazy_import('lib.connection')
+redfish = lazy.lazy_import('lib.redfish')
+
 logging.basicConfig(filename="debug_bmc_fw.log", level=logging.DEBUG)
 #logging.basicConfig(level=logging.DEBUG)
 
@@ -121,6 +130,17 @@ def parse_args():
     parser.add_argument(
         '-v', '--version', type=str,
         help='firmware version to update', required=False, nargs='+')
+    telemetry.add_run_args(parser)
+    parser.add_argument(
+        '--redfish', required=False, metavar='BMC',
+        help='Update out-of-band through the Redfish service of this BMC '
+             '(IP, host:port or URL) instead of over SSH', default=None)
+    parser.add_argument(
+        '--bmc-username', required=False,
+        help='BMC username for --redfish', default='ADMIN')
+    parser.add_argument(
+        '--bmc-password', required=False,
+        help='BMC password for --redfish', default='ADMIN')
 
     args = parser.parse_args()
 
@@ -134,10 +154,7 @@ def get_fru_info(conn, verbose=False):
     # Get FRU info if it does not exist
     conn.sendline('ipmitool fru', conn.PROMPT)
     if conn.output:
-        for line in conn.output.split('\n')[1:]:
-            if ' : ' in line:
-                k, v = line.split(' : ', 1)
-                fru[k.strip()] = v.strip()
+        fru = parsers.fru(conn.output)
     else:
         logging.error('ERROR: ipmitool fru command returns nothing!')
         sys.exit(1)
@@ -154,14 +171,7 @@ def get_part_info(conn, verbose=False):
         board management controller
     '''
 
-    conn.sendline('dmidecode -t baseboard', conn.PROMPT)
-    if conn.output:
-        baseboard = re.search(r'[P][r][o]\S+\s+\S+\s+\S+', conn.output,
-                re.I|re.M)
-        bmc_baseboard = baseboard.group()
-        if bmc_baseboard:
-            baseboard_obj = re.search(r'\w+\d+\w+[-]\w+', bmc_baseboard)
-            bmc_baseboard = baseboard_obj.group()
+    bmc_baseboard = inventory.dmi(conn, 'board_name')
     if verbose:
         logging.debug(json.dumps(bmc_baseboard, indent=4))
     return bmc_baseboard
@@ -177,15 +187,8 @@ def get_part_version(conn, verbose=False):
     conn.sendline(CMD, conn.PROMPT)
     if conn.output:
         logging.debug(conn.output)
-        bmc_obj = re.search(r'[V][e][r]\w+[:]\s+(.+)\d+', conn.output,
-                re.I|re.M)
-        logging.debug(bmc_obj.group())
-        bmc_version = bmc_obj.group()
-        if bmc_version:
-            bmc_obj = re.search(r'\d+[-.](.+)\d+', bmc_version)
-            logging.debug(bmc_obj.group())
-            bmc_version = bmc_obj.group()
-            logging.debug("BMC version: %s" %bmc_version)
+        bmc_version = parsers.ipmicfg_ver(conn.output)['version']
+        logging.debug("BMC version: %s" %bmc_version)
     if verbose:
         logging.debug(json.dumps(bmc_version, indent=4))
     return bmc_version
@@ -197,7 +200,7 @@ def is_fw_acceptable(conn, bmc_baseboard, bmc_version, verbose=False):
         If the firmware is in the list of acceptable firmwares, it returns True.
     '''
 
-    if (bmc_version in BMC.BMC_FW_ACCEPTABLE[bmc_baseboard]):
+    if BMC.fw_acceptable('BMC', bmc_baseboard, bmc_version):
         logging.debug("BMC firmware version: %s is acceptable" %bmc_version)
         # TESTING - Commend out return to ignore the firmware acceptable check
         return True
@@ -213,8 +216,7 @@ def is_update_conflict(conn, bmc_baseboard, bmc_version, prefer_bmc_version,
         when we update to the preferred one. If the update causes a conflict,
         return True
     '''
-    if (bmc_version in BMC.BMC_FW_CONFLICT[(bmc_baseboard,
-            prefer_bmc_version)]):
+    if BMC.fw_conflict('BMC', bmc_baseboard, bmc_version, prefer_bmc_version):
         logging.error("FAIL:BMC:UPDATE:Detected=" + str(bmc_version) +
                 ":Couldn't update to the preferred version")
         logging.debug("BMC version updated from Version: % to Version: % " +
@@ -237,21 +239,27 @@ def bmc_set_to_default(conn):
 
 ''' -------------------------- BMC Cold Reboot ------------------------------'''
 #@time_elapsed
-def bmc_set_cold_reboot(conn):
+def bmc_set_cold_reboot(conn, wait=120):
     """
-    This function sets the BMC to cold reboot
+    This function sets the BMC to cold reboot, then waits wait seconds for
+    the BMC to boot up
     """
     # Cold reboot BMC
     conn.sendline('/usr/bin/ipmitool bmc reset cold', conn.PROMPT, timeout=10)
     logging.debug("Console ouput %s " %conn.output)
-    logging.debug("Wait 2 minutes for the system boot up")
+    if not wait:
+        return
+    logging.debug("Wait %s seconds for the system boot up" %wait)
 
-    time.sleep(120)
+    with timing_db.phase('reboot_wait'):
+        time.sleep(wait)
 
 ''' ------------------------ do_fw_update -----------------------------------'''
 #@time_elapsed
-def do_fw_update(conn, file_name):
-    """This function gets the bmc file name and performs the update.
+@tracing.traced()
+def do_fw_update(conn, file_name, reset_wait=120):
+    """This function gets the bmc file name and performs the update. The BMC
+    is then cold reset and given reset_wait seconds to come back.
     """
     logging.debug("Update file location %s " %(file_name))
     logging.debug("Warning, the update process takes 3 minutes to complete. " +
@@ -272,9 +280,11 @@ def do_fw_update(conn, file_name):
     # Update Complete, Please wait for BMC reboot, about 1 or 2 mins
     # CMD = "%s/sumtool -c UpdateBmc --file " %BMC.CMD_PATH
     CMD = "/usr/bin/sumtool -c UpdateBmc --file "
-    conn.sendline(CMD +file_name+ ' --overwrite_cfg --overwrite_sdr', "Update Complete", timeout=2000)
-    logging.debug("The node is required to be re-booted for the firmware " +
-            "update to take effect.")
+    with timing_db.phase('flash'):
+        conn.sendline(CMD +file_name+ ' --overwrite_cfg --overwrite_sdr',
+                "Update Complete", timeout=2000)
+    logging.debug("The node is required to be re-booted for the " +
+            "firmware update to take effect.")
 
     # Checking BMC status Done
     conn.sendline('', conn.PROMPT, timeout=200)
@@ -282,7 +292,7 @@ def do_fw_update(conn, file_name):
     bmc_set_to_default(conn)
 
     logging.debug("The node will reboot automatically within 120 seconds.")
-    bmc_set_cold_reboot(conn)
+    bmc_set_cold_reboot(conn, wait=reset_wait)
 
 ''' --------------------------- BMC Update Process --------------------------'''
 #@time_elapsed
@@ -293,9 +303,8 @@ def check_update_process(conn, part_number, fw_version):
     """
 
     try:
-        prefer_bmc_version = BMC.BMC_FW_PREFER[part_number]
+        prefer_bmc_version, file_name = BMC.fw_prefer('BMC', part_number)
         logging.debug("expect_ver %s" %(prefer_bmc_version))
-        file_name = BMC.BMC_FW_FILES[(part_number, prefer_bmc_version)]
         logging.debug(file_name)
     except KeyError, e:
         logging.error("The version %s is not supported" %part_number)
@@ -330,16 +339,17 @@ def check_update_process(conn, part_number, fw_version):
     return(True, file_name)
 
 '''--------------------------------------------------------------------------'''
-def check_support_process(conn, model, version):
+def check_support_process(conn, model, version, uut_part_number=None):
     """ This function checks if the forced update option is available. If the
-        option is supported, it returns True and the file name to update.
+        option is supported, it returns True and the file name to update. The
+        on-board part is read over conn unless uut_part_number is given.
     """
     # Check the version support
     version = str(version)[2:-2]
 
     try:
         update_part_number = (BMC.fw[model]["BMC"])
-        uut_part_number    = get_part_info(conn)
+        uut_part_number    = uut_part_number or get_part_info(conn)
         file_name          = BMC.BMC_FW_FILES[(update_part_number, version)]
     except KeyError, e:
         logging.error("The version %s is not supported" %version)
@@ -353,19 +363,91 @@ def check_support_process(conn, model, version):
 
     return (True, file_name)
 
+''' ------------------------ do_redfish_update ------------------------------'''
+@tracing.traced()
+def do_redfish_update(client, file_name, fw_version, expect_version):
+    """This function streams the bmc file to the Redfish UpdateService of the
+       BMC, waits for the BMC to come back after its reset and checks it runs
+       expect_version. fw_version is the version before the update.
+    """
+    logging.debug("Update file location %s " %(file_name))
+    with timing_db.phase('transfer'):
+        task = client.update_firmware(file_name)
+    with timing_db.phase('flash'):
+        client.wait_task(task, timeout=2000)
+    logging.debug("The node update is completed.")
+
+    logging.debug("Wait for the BMC to reset")
+    with timing_db.phase('reboot_wait'):
+        client.wait_reset('BMC', previous=fw_version, timeout=600)
+
+    with timing_db.phase('verify'):
+        version = client.firmware_version('BMC')
+    if version != expect_version:
+        raise redfish.RedfishError("The BMC runs %s after the update, "
+                "expected %s" %(version, expect_version))
+    logging.debug("The BMC runs %s" %version)
+
+''' ------------------------ BMC Redfish Process ----------------------------'''
+def redfish_process(args):
+    """ This function does the BMC update out-of-band through the BMC's Redfish
+        service, the host OS does not need to be up.
+    """
+    client = redfish.RedfishClient(args.redfish, args.bmc_username,
+            args.bmc_password)
+    try:
+        with timing_db.phase('inventory'):
+            part_number = client.board_model()
+            fw_version  = client.firmware_version('BMC')
+        timing_db.set_model(part_number)
+        logging.debug("Redfish reports %s BMC version %s" %(part_number,
+                fw_version))
+
+        if args.model:
+            if not args.version:
+                logging.error("The option -v <version> required")
+                sys.exit(1)
+            (ret_status, ret_file) = check_support_process(None, args.model,
+                    args.version, uut_part_number=part_number)
+            expect_version = str(args.version)[2:-2]
+        else:
+            (ret_status, ret_file) = check_update_process(None, part_number,
+                    fw_version)
+            expect_version = BMC.fw_prefer('BMC', part_number)[0]
+
+        if ret_status:
+            do_redfish_update(client, ret_file, fw_version, expect_version)
+        else:
+            logging.debug("Current firmware does not require an update!")
+    except redfish.RedfishError, e:
+        logging.error("Redfish update failed: %s" %e)
+        print('*** Redfish update failed for {0}: {1}'.format(args.redfish, e))
+        sys.exit(1)
+
 '''--------------------------------------------------------------------------'''
 def main():
     model, version = "", ""
     args = parse_args()
 
-    with open(args.log, 'wb') as log:
+    host = args.redfish or args.ip
+    with open(args.log, 'wb') as log, telemetry.run_context(args, host, 'BMC'):
         try:
             is_logged_in = False
-            conn = Connection(logfile=sys.stdout, static_logpath =
+
+            if args.redfish:
+                # Out-of-band update, no SSH session to the host OS
+                redfish_process(args)
+                metrics.set_result('success')
+                print("BMC update successful!")
+                exit(0)
+
+            conn = connection.for_host(args.ip, logfile=sys.stdout, static_logpath =
                     '~/logs/{0}'.format(this_filename))
-            is_logged_in = conn.login(args.ip, args.username, args.password,
-                           auto_prompt_reset=False, remove_known_hosts=True,
-                           ping_before_connect=False)
+            with timing_db.phase('login'):
+                is_logged_in = conn.login(args.ip, args.username,
+                               args.password, auto_prompt_reset=False,
+                               remove_known_hosts=True,
+                               ping_before_connect=False)
 
             if args.model:
                 # Update by force with model and version
@@ -379,8 +461,10 @@ def main():
                     sys.exit(1)
             else:
                 # Update detected items to the node and save to json
-                part_number = get_part_info(conn)
-                fw_version  = get_part_version(conn)
+                with timing_db.phase('inventory'):
+                    part_number = get_part_info(conn)
+                    fw_version  = get_part_version(conn)
+                timing_db.set_model(part_number)
                 (ret_status, ret_file) = check_update_process(conn, part_number,
                         fw_version)
                 if ret_status:
@@ -390,12 +474,14 @@ def main():
                             "update!")
                 print("Update Completed!")
 
+            metrics.set_result('success')
             print("BMC update successful!")
             exit(0)
 
-        except TIMEOUT:
+        except pexpect.TIMEOUT:
             if conn.output:
                 print('{0}'.format(conn.output))
+            metrics.set_result('timeout')
             print('*** Timeout occurred for {0}!'.format(args.ip))
         finally:
             time.sleep(.1)
@@ -87,11 +87,14 @@ import logging
 # Test framework import
 import import_me_first
 
-from pexpect.exceptions import TIMEOUT
-from lib.connection import Connection
 from lib.dec import time_elapsed
+from lib import lazy, metrics, parsers, telemetry, timing_db, tracing
 import fw_config as HBA
 
+# Heavy modules are imported on first use to keep --help and dry runs fast
+pexpect = lazy.lazy_import('pexpect')
+connection = lazy.lazy_import('lib.connection')
+
 logging.basicConfig(filename="debug_hba_fw.log", level=logging.DEBUG)
 #logging.basicConfig(level=logging.DEBUG)
 
@@ -133,6 +136,7 @@ def parse_args():
     parser.add_argument(
         '-v', '--version', type=str, 
         help='firmware version to update', required=False, nargs='+')
+    telemetry.add_run_args(parser)
 
     args = parser.parse_args()
 
@@ -148,10 +152,7 @@ def get_fru_info(conn, verbose=False):
     # Get FRU info if it does not exist
     conn.sendline('ipmitool fru', conn.PROMPT)
     if conn.output:
-        for line in conn.output.split('\n')[1:]:
-            if ' : ' in line:
-                k, v = line.split(' : ', 1)
-                fru[k.strip()] = v.strip()
+        fru = parsers.fru(conn.output)
     else:
         logging.error('ERROR: ipmitool fru command returns nothing!')
         sys.exit(1)
@@ -173,29 +174,19 @@ def get_hba_model(conn, verbose=False):
     # Command should be in the PXE but it is not 
     CMD = "%s/sas3flash -listall" %HBA.CMD_PATH
     conn.sendline(CMD, conn.PROMPT)
-    hba_model = re.findall(r'\d\s+\w+\d+[0-9$]', conn.output)
-    if hba_model:
-        for i in hba_model:
-            hba = re.findall(r'\w+\d+[0-9$]', i)
-            hba = str(hba)[2:-2]
-            hba_model_list.append(hba)
+    for hba in parsers.sas3flash_listall(conn.output):
+        hba_model_list.append(hba['controller'])
 
     # Check if the current model flashed with IR
     CMD = "%s/sas3flash -list" %HBA.CMD_PATH
     conn.sendline(CMD, conn.PROMPT)
     if conn.output:
         logging.debug("conn.output %s " %conn.output)
-        hba_obj = re.search(r'Board Name\s+[:]\s+\w+[-]\w+', 
-                conn.output, re.I|re.M)
-        hba = hba_obj.group()
-        logging.debug(hba)
-        if hba:
-            hba_obj = re.search(r'\w+\d+[-]\w+', hba)
-            hba_model = hba_obj.group()
-            logging.debug(hba_model)
-            if hba_model != "LSI3008-IT":
-                logging.error("The current fw update won't accept IR firmware")
-                exit(1)
+        hba_model = parsers.sas3flash_list(conn.output).get('Board Name')
+        logging.debug(hba_model)
+        if hba_model != "LSI3008-IT":
+            logging.error("The current fw update won't accept IR firmware")
+            exit(1)
 
     if verbose:
         logging.debug(json.dumps(hba_model_list, indent=4))
@@ -215,13 +206,10 @@ def get_hba_version(conn, verbose=False):
     # Command should be in the PXE but it is not 
     CMD = "%s/sas3flash -listall" %HBA.CMD_PATH
     conn.sendline(CMD, conn.PROMPT)
-    hba_version = re.findall(r'\SAS\d{4}\W\w\d\W\s+\d+\.\d+\.\d+\.\d+', 
-            conn.output)
+    hba_version = parsers.sas3flash_listall(conn.output)
     logging.debug(hba_version)
-    if hba_version:
-        for i in hba_version:
-            version = re.findall(r'\d+\.\d+\.\d+\.\d+', i)
-            hba_version_list.append(version)
+    for hba in hba_version:
+        hba_version_list.append([hba['fw_version']])
 
     if verbose:
         logging.debug(json.dumps(hba_version_list, indent=4))
@@ -236,7 +224,7 @@ def is_fw_acceptable(conn, hba_ctrl, hba_version, verbose=False):
        returns True.  
     '''
 
-    if (hba_version in HBA.HBA_FW_ACCEPTABLE[hba_ctrl]):
+    if HBA.fw_acceptable('HBA', hba_ctrl, hba_version):
         logging.debug("HBA firmware version: %s is acceptable" %hba_version)
 
         return True
@@ -254,7 +242,7 @@ def is_update_conflict(conn, hba_ctrl, hba_version, prefer_hba_version,
         if we update to the preferred one. If the update causes a conflict, it 
         returns True
     '''
-    if (hba_version in HBA.HBA_FW_CONFLICT[(hba_ctrl, prefer_hba_version)]):
+    if HBA.fw_conflict('HBA', hba_ctrl, hba_version, prefer_hba_version):
         logging.debug("HBA version update from version: % to version: % " + 
                 "will cause a conflict" %(hba_version, prefer_hba_version))
         return True
@@ -264,6 +252,7 @@ def is_update_conflict(conn, hba_ctrl, hba_version, prefer_hba_version,
 
 ''' ----------------------------- update_process ---------------------------'''
 @time_elapsed
+@tracing.traced()
 def do_fw_update(conn, ctrl_num, file_name):
     '''The HBA update flashes 3 different files:
         Step1: sas3flash -c ctrl_num -f 3008IT.ROM
@@ -272,31 +261,32 @@ def do_fw_update(conn, ctrl_num, file_name):
     '''
     logging.debug("update ctrl %s file %s " %(ctrl_num, file_name))
 
-    # Update the HBA file 3008IT.ROM
-    CMD="%s/sas3flash -c "%HBA.CMD_PATH+str(ctrl_num) +' -f '
-    conn.sendline(CMD +file_name, "Successfully", timeout=60)
+    with timing_db.phase('flash'):
+        # Update the HBA file 3008IT.ROM
+        CMD="%s/sas3flash -c "%HBA.CMD_PATH+str(ctrl_num) +' -f '
+        conn.sendline(CMD +file_name, "Successfully", timeout=60)
 
-    # Clear the buffer
-    conn.sendline(' ', conn.PROMPT)
-    logging.debug("HBA flashed %s  %  successful !!!. " %(ctrl_num, file_name))
+        # Clear the buffer
+        conn.sendline(' ', conn.PROMPT)
+        logging.debug("HBA flashed %s  %  successful !!!. " %(ctrl_num, file_name))
 
-    # Update the HBA BIOS mptsas3.rom
-    CMD="%s/sas3flash -c "%HBA.CMD_PATH+str(ctrl_num) +' -b '
-    path = re.search(r'(.+)[.][0]+\/', file_name)
-    file_name = path.group()+'mptsas3.rom'
-    conn.sendline(CMD +file_name, "Successfully", timeout=40)
+        # Update the HBA BIOS mptsas3.rom
+        CMD="%s/sas3flash -c "%HBA.CMD_PATH+str(ctrl_num) +' -b '
+        path = re.search(r'(.+)[.][0]+\/', file_name)
+        file_name = path.group()+'mptsas3.rom'
+        conn.sendline(CMD +file_name, "Successfully", timeout=40)
 
-    # Clear the buffer
-    conn.sendline(' ', conn.PROMPT)
-    logging.debug("HBA flashed %s  %  successful !!!. " %(ctrl_num, file_name))
+        # Clear the buffer
+        conn.sendline(' ', conn.PROMPT)
+        logging.debug("HBA flashed %s  %  successful !!!. " %(ctrl_num, file_name))
 
-    # Update the HBA file mpt3x64.rom
-    file_name = path.group()+'mpt3x64.rom'
-    conn.sendline(CMD +file_name, "Successfully", timeout=30)
+        # Update the HBA file mpt3x64.rom
+        file_name = path.group()+'mpt3x64.rom'
+        conn.sendline(CMD +file_name, "Successfully", timeout=30)
 
-    # Clear the buffer
-    conn.sendline(' ', conn.PROMPT)
-    logging.debug("HBA flashed %s  %  successful !!!. " %(ctrl_num, file_name))
+        # Clear the buffer
+        conn.sendline(' ', conn.PROMPT)
+        logging.debug("HBA flashed %s  %  successful !!!. " %(ctrl_num, file_name))
 
 
 ''' --------------------------- HBA Update Process -------------------------'''
@@ -308,11 +298,10 @@ def check_update_process(conn, ctrl_num, part_number, fw_version):
     '''
 
     try:
-        prefer_hba_version = HBA.HBA_FW_PREFER[part_number]
+        prefer_hba_version, file_name = HBA.fw_prefer('HBA', part_number)
         logging.debug("prefer version %s" %prefer_hba_version)
-        file_name = HBA.HBA_FW_FILES[(part_number, prefer_hba_version)]
     except KeyError, e:
-        logging.error("The version %s is not supported" %prefer_hba_version)
+        logging.error("The version %s is not supported" %part_number)
         exit(1)
 
     #First check for the same preferred firmware
@@ -320,7 +309,7 @@ def check_update_process(conn, ctrl_num, part_number, fw_version):
         logging.debug("Version match")
         logging.info("Current HBA version "+fw_version+" is matched ")
         # TESTING - Commend out the return to force update
-        #return (False, file_name) 
+        return (False, file_name)
     else:
         logging.debug("Version mismatch. Next, checking version in the \
                        acceptable list")
@@ -330,7 +319,7 @@ def check_update_process(conn, ctrl_num, part_number, fw_version):
         logging.debug("Version is acceptable")
         logging.info("Current HBA version "+fw_version+" is acceptable")
         # TESTING - Commend out the return to force update
-        #return (False, file_name)
+        return (False, file_name)
     else:
         logging.debug("Version is not acceptable. An update is required")
         logging.info("Current HBA version "+fw_version+" is outdated \
@@ -377,14 +366,17 @@ def main():
     model, version = "", ""
     args = parse_args()
 
-    with open(args.log, 'wb') as log:
+    with open(args.log, 'wb') as log, telemetry.run_context(args, args.ip, 'HBA'):
         try:
             is_logged_in = False
-            conn = Connection(logfile=sys.stdout, 
+            conn = connection.for_host(args.ip, logfile=sys.stdout, 
                     static_logpath='~/logs/{0}'.format(this_filename))
-            is_logged_in = conn.login(args.ip, args.username, args.password,\
-                                      args.model, auto_prompt_reset=False,  \
-                                      remove_known_hosts=True, ping_before_connect=False)
+            with timing_db.phase('login'):
+                is_logged_in = conn.login(args.ip, args.username,
+                                          args.password, args.model,
+                                          auto_prompt_reset=False,
+                                          remove_known_hosts=True,
+                                          ping_before_connect=False)
 
             # Check if the option to force update is selected
             if args.model:
@@ -404,8 +396,11 @@ def main():
                 # Update by default
                 hba_number = []
                 hba_firmware = []
-                hba_numbers  = get_hba_model(conn)
-                hba_firmware = get_hba_version(conn)
+                with timing_db.phase('inventory'):
+                    hba_numbers  = get_hba_model(conn)
+                    hba_firmware = get_hba_version(conn)
+                if hba_numbers:
+                    timing_db.set_model(hba_numbers[0])
 
                 print(hba_numbers, hba_firmware)
                 for i in range(len(hba_numbers)):
@@ -420,11 +415,13 @@ def main():
                          logging.debug("Current firmware port %s does not \
                                         require an update!" %i)
        
+            metrics.set_result('success')
             print("HBA Update successful!")
             exit(0)
-        except TIMEOUT:
+        except pexpect.TIMEOUT:
             if conn.output:
                 print('{0}'.format(conn.output))
+            metrics.set_result('timeout')
             print('*** Timeout occurred for {0}!'.format(args.ip))
         finally:
             time.sleep(.1)
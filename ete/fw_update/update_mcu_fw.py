@@ -73,7 +73,6 @@ Examples:
 '''
 import json
 import os
-import re
 import sys
 import time
 import argparse
@@ -82,11 +81,14 @@ import logging
 # Import your package (if any) below
 import import_me_first
 
-from pexpect.exceptions import TIMEOUT
-from lib.connection import Connection
 from lib.dec import time_elapsed
+from lib import lazy, metrics, parsers, telemetry, timing_db, tracing
 import fw_config as MCU
 
+# Heavy modules are imported on first use to keep --help and dry runs fast
+pexpect = lazy.lazy_import('pexpect')
+connection = lazy.lazy_import('lib.connection')
+
 logging.basicConfig(filename="debug_mcu_fw.log", level=logging.DEBUG)
 #logging.basicConfig(level=logging.DEBUG)
 
@@ -124,6 +126,7 @@ def parse_args():
     parser.add_argument(
         '-v', '--version', type=str,
         help='firmware version to update', required=False, nargs='+')
+    telemetry.add_run_args(parser)
 
     args = parser.parse_args()
 
@@ -138,10 +141,7 @@ def get_fru_info(conn, verbose=False):
     # Get FRU info if it does not exist
     conn.sendline('ipmitool fru', conn.PROMPT)
     if conn.output:
-        for line in conn.output.split('\n')[1:]:
-            if ' : ' in line:
-                k, v = line.split(' : ', 1)
-                fru[k.strip()] = v.strip()
+        fru = parsers.fru(conn.output)
     else:
         logging.debug('ERROR: ipmitool fru command returns nothing!')
         sys.exit(-1)
@@ -158,8 +158,7 @@ def get_part_info(conn, verbose=False):
 
     conn.sendline('/usr/bin/ipmicfg-linux.x86_64 -tp info', conn.PROMPT)
     if conn.output:
-        mcu_info = re.search(r'[B][P][N]\S+', conn.output, re.I|re.M)
-        mcu_info = mcu_info.group()
+        mcu_info = parsers.ipmicfg_tp_info(conn.output)['part_number']
 
     if verbose:
         logging.debug(json.dumps(mcu_info, indent=4))
@@ -176,14 +175,8 @@ def get_part_version(conn, verbose=False):
     conn.sendline('/usr/bin/ipmicfg-linux.x86_64 -tp info', conn.PROMPT)
     if conn.output:
         logging.debug(conn.output)
-        mcu_version = re.search(r'[M][C][U]\s+(.+)', conn.output)
-        logging.debug(mcu_version.group())
-        mcu_version = mcu_version.group()
-        if mcu_version:
-            mcu_obj = re.search(r'\d+[.]\d+', mcu_version)
-            logging.debug(mcu_obj.group())
-            mcu_version = mcu_obj.group()
-            logging.debug("MCU version: %s" %mcu_version)
+        mcu_version = parsers.ipmicfg_tp_info(conn.output)['version']
+        logging.debug("MCU version: %s" %mcu_version)
 
     if verbose:
         logging.debug(json.dumps(mcu_version, indent=4))
@@ -198,7 +191,7 @@ def is_fw_acceptable(conn, mcu_info, mcu_version, verbose=False):
        returns True.
     '''
 
-    if (mcu_version in MCU.MCU_FW_ACCEPTABLE[mcu_info]):
+    if MCU.fw_acceptable('MCU', mcu_info, mcu_version):
         logging.debug("mcu firmware Version: %s is acceptable" %mcu_version)
         # TESTING
         #return True
@@ -215,7 +208,7 @@ def is_update_conflict(conn, mcu_info, mcu_version, prefer_mcu_version,
        if we update to the preferred one. If the update causes a conflict, it 
        returns True.
     '''
-    if (mcu_version in MCU.MCU_FW_CONFLICT[(mcu_info, prefer_mcu_version)]):
+    if MCU.fw_conflict('MCU', mcu_info, mcu_version, prefer_mcu_version):
         logging.error("FAIL:MCU:UPDATE:Detected="+str(mcu_version)+":Couldn't\
                 update to the preferred version")
         logging.debug("MCU version update from Version: % to Version: % " + 
@@ -227,6 +220,7 @@ def is_update_conflict(conn, mcu_info, mcu_version, prefer_mcu_version,
 
 """ ----------------------------- do_fw_update --------------------------------------"""
 #@time_elapsed
+@tracing.traced()
 def do_fw_update(conn, file_name):
     '''Get the MCU file name and performs the update.
     '''
@@ -248,8 +242,9 @@ def do_fw_update(conn, file_name):
     CMD = "/bin/ipmicfg -tp mcuupdate %s" %file_name
     logging.debug("Warning, the update will reset the power and all nodes will reboot")
     logging.debug("Please do not turn off the power!")
-    conn.sendline(CMD, "....", timeout=100)
-    conn.sendline(' ', "....", timeout=20)
+    with timing_db.phase('flash'):
+        conn.sendline(CMD, "....", timeout=100)
+        conn.sendline(' ', "....", timeout=20)
 
 ''' --------------------------- MCU Update Process for default -------------------------'''
 #@time_elapsed
@@ -259,10 +254,8 @@ def check_update_process(conn, part_number, fw_version):
        return True. The function also returns the file name to update.
     '''
 
-    prefer_mcu_version = MCU.MCU_FW_PREFER[part_number]
+    prefer_mcu_version, file_name = MCU.fw_prefer('MCU', part_number)
     logging.debug("expect_ver %s" %(prefer_mcu_version))
-
-    file_name = MCU.MCU_FW_FILES[(part_number, prefer_mcu_version)]
     logging.debug(file_name)
 
     # First check for the same preferred firmware
@@ -324,14 +317,15 @@ def main():
     model, version =  "", ""
     args = parse_args()
     
-    with open(args.log, 'wb') as log:
+    with open(args.log, 'wb') as log, telemetry.run_context(args, args.ip, 'MCU'):
         try:
             is_logged_in = False
-            conn = Connection(logfile=sys.stdout, 
+            conn = connection.for_host(args.ip, logfile=sys.stdout, 
                               static_logpath='~/logs/{0}'.format(this_filename))
-            is_logged_in = conn.login(args.ip, args.username, args.password, \
-                                      auto_prompt_reset=False, remove_known_hosts=True, 
-                                      ping_before_connect=False)
+            with timing_db.phase('login'):
+                is_logged_in = conn.login(args.ip, args.username, args.password,
+                                          auto_prompt_reset=False, remove_known_hosts=True,
+                                          ping_before_connect=False)
 
             if args.model:
                 # Update by force with model and version
@@ -345,20 +339,24 @@ def main():
                    exit(1)
             else:
                 # Update by default
-                part_number = get_part_info(conn)
-                fw_version  = get_part_version(conn)
+                with timing_db.phase('inventory'):
+                    part_number = get_part_info(conn)
+                    fw_version  = get_part_version(conn)
+                timing_db.set_model(part_number)
                 (ret_status, ret_file) = check_update_process(conn, part_number, fw_version) 
                 if ret_status:
                     do_fw_update(conn, ret_file)
                 else:
                     logging.debug("Current firmware does not require an update!")
 
+            metrics.set_result('success')
             print("MCU Update Successful!")
             exit(0)
 
-        except TIMEOUT:
+        except pexpect.TIMEOUT:
             if conn.output:
                 print('{0}'.format(conn.output))
+            metrics.set_result('timeout')
             print('*** Timeout occurred for {0}!'.format(args.ip))
         finally:
             time.sleep(.1)
@@ -66,11 +66,14 @@ import logging
 # Test framework import
 import import_me_first
 
-from pexpect.exceptions import TIMEOUT
-from lib.connection import Connection
 from lib.dec import time_elapsed
+from lib import lazy, metrics, parsers, telemetry, timing_db, tracing
 import fw_config as NIC
 
+# Heavy modules are imported on first use to keep --help and dry runs fast
+pexpect = lazy.lazy_import('pexpect')
+connection = lazy.lazy_import('lib.connection')
+
 #logging.basicConfig(filename="debug_mlx_fw.log", level=logging.DEBUG)
 logging.basicConfig(level=logging.DEBUG)
 
@@ -102,6 +105,7 @@ def parse_args():
     parser.add_argument(
         '-v', '--version', type=str,
         help='firmware version to update', required=False, nargs='+')
+    telemetry.add_run_args(parser)
 
     args = parser.parse_args()
 
@@ -114,10 +118,7 @@ def get_fru_info(conn, verbose=False):
     # Get FRU info if it does not exist
     conn.sendline('ipmitool fru', conn.PROMPT)
     if conn.output:
-        for line in conn.output.split('\n')[1:]:
-            if ' : ' in line:
-                k, v = line.split(' : ', 1)
-                fru[k.strip()] = v.strip()
+        fru = parsers.fru(conn.output)
     else:
         print('ERROR: ipmitool fru command returns nothing!')
         sys.exit(1)
@@ -135,13 +136,14 @@ def get_mlx_part_number(conn, verbose=False):
     conn.sendline(CMD, conn.PROMPT)
     if conn.output:
         print(conn.output)
-        mlx_detect = re.search(r'MCX(.+)\S+', conn.output, re.I|re.M)
+        mlx_detect = [device for device in parsers.mlxup_query(conn.output)
+                      if device.get('Part Number', '').upper().startswith('MCX')]
         if mlx_detect:
             logging.debug("Mellanox card detected")
         else:
             logging.error("No Mellanox card detected")
             exit(1)
-        mlx_part_number = mlx_detect.group()
+        mlx_part_number = mlx_detect[0]['Part Number']
 
     if verbose:
         logging.debug(json.dumps(mlx_part_number, indent=4))
@@ -156,13 +158,8 @@ def get_mlx_version(conn, verbose=False):
     conn.sendline(CMD, conn.PROMPT)
     if conn.output:
         logging.debug(conn.output)
-        mlx_obj = re.search(r'[F][W]\s+\d+[.]\d+[.]\d+', conn.output, re.I|re.M)
-        logging.debug(mlx_obj.group())
-        mlx_version = mlx_obj.group()
-        if mlx_version:
-            mlx_obj = re.search(r'\d+[.]\d+[.]\d+', mlx_version)
-            logging.debug(mlx_obj.group())
-            mlx_version = mlx_obj.group()
+        mlx_version = parsers.mlxup_query(conn.output)[0]['versions']['FW']
+        logging.debug(mlx_version)
 
     if verbose:
         logging.debug(json.dumps(mlx_version, indent=4))
@@ -175,7 +172,7 @@ def is_fw_acceptable(conn, mlx_part_number, mlx_version, verbose=False):
     '''Check if the mlx reading from the baseboard is acceptable.
        if the firmware is in the list of acceptible, it returns True  '''
 
-    if (mlx_version in NIC.NIC_FW_ACCEPTABLE[mlx_part_number]):
+    if NIC.fw_acceptable('NIC', mlx_part_number, mlx_version):
         logging.debug("mlx firmware Version: %s is acceptable" %mlx_version)
         return True
     else:
@@ -189,7 +186,7 @@ def is_update_conflict(conn, mlx_part_number, mlx_version, prefer_mlx_version, v
     Check if the mlx version on the board will be conflicted if we update to the prefer one.
     if the update conflict, it return True
     '''
-    if (mlx_version in NIC.NIC_FW_CONFLICT[(mlx_part_number, prefer_mlx_version)]):
+    if NIC.fw_conflict('NIC', mlx_part_number, mlx_version, prefer_mlx_version):
         logging.debug("mlx version update from Version: % to Version: % will be conflicted" %(mlx_version, prefer_mlx_version))
         return True
     else:
@@ -198,6 +195,7 @@ def is_update_conflict(conn, mlx_part_number, mlx_version, prefer_mlx_version, v
 
 """ ----------------------------- do_fw_update --------------------------------------"""
 @time_elapsed
+@tracing.traced()
 def do_fw_update(conn, file_name):
     '''
     Get the mlx file name and do the update.
@@ -226,7 +224,8 @@ def do_fw_update(conn, file_name):
     logging.debug("...")
 
     # Update Complete, Please wait for MLX reboot, about 1 or 2 mins
-    conn.sendline(CMD + file_name + OPTS, "#", timeout=200)
+    with timing_db.phase('flash'):
+        conn.sendline(CMD + file_name + OPTS, "#", timeout=200)
     print(conn.output)
     success = re.search(r'Done', conn.output, re.I|re.M)
     if success:
@@ -248,10 +247,8 @@ def check_update_process(conn, part_number, fw_version):
 
     logging.debug(part_number)
     print(len(part_number))
-    prefer_mlx_version = NIC.NIC_FW_PREFER[part_number]
+    prefer_mlx_version, file_name = NIC.fw_prefer('NIC', part_number)
     logging.debug("expect_ver %s" %(prefer_mlx_version))
-
-    file_name = NIC.NIC_FW_FILES[(part_number, prefer_mlx_version)]
     logging.debug(file_name)
 
     # First check for the same prefer firmware
@@ -314,12 +311,13 @@ def main():
     model, version = "", ""
     args = parse_args()
     
-    with open(args.log, 'wb') as log:
+    with open(args.log, 'wb') as log, telemetry.run_context(args, args.ip, 'MLX'):
         try:
             is_logged_in = False
-            conn = Connection(logfile=sys.stdout, static_logpath='~/logs/{0}'.format(this_filename))
-            is_logged_in = conn.login(args.ip, args.username, args.password, 
-                           auto_prompt_reset=False, remove_known_hosts=True, ping_before_connect=False)
+            conn = connection.for_host(args.ip, logfile=sys.stdout, static_logpath='~/logs/{0}'.format(this_filename))
+            with timing_db.phase('login'):
+                is_logged_in = conn.login(args.ip, args.username, args.password,
+                               auto_prompt_reset=False, remove_known_hosts=True, ping_before_connect=False)
 
             if args.model:
                 # Update by force with model and version/file
@@ -332,18 +330,22 @@ def main():
                             do_fw_update(conn, ret_file)
             else:
                 # Update detected items to the node and save to json
-                part_number = get_mlx_part_number(conn)
-                fw_version  = get_mlx_version(conn)
+                with timing_db.phase('inventory'):
+                    part_number = get_mlx_part_number(conn)
+                    fw_version  = get_mlx_version(conn)
+                timing_db.set_model(part_number)
                 (ret_status, ret_file) = check_update_process(conn, part_number, fw_version)
                 if ret_status:
                     do_fw_update(conn, ret_file)
                 else:
                     logging.debug("Current firmware not requird update!")
 
+            metrics.set_result('success')
             print("MLX Update Successful!")
-        except TIMEOUT:
+        except pexpect.TIMEOUT:
             if conn.output:
                 print('{0}'.format(conn.output))
+            metrics.set_result('timeout')
             print('*** Timeout occurred for {0}!'.format(ip))
         finally:
             time.sleep(.1)
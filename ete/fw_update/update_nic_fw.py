@@ -78,11 +78,14 @@ import logging
 # Import your package (if any) below
 import import_me_first
 
-from pexpect.exceptions import TIMEOUT
-from lib.connection import Connection
 from lib.dec import time_elapsed
+from lib import inventory, lazy, metrics, parsers, telemetry, timing_db, tracing
 import fw_config as NIC
 
+# Heavy modules are imported on first use to keep --help and dry runs fast
+pexpect = lazy.lazy_import('pexpect')
+connection = lazy.lazy_import('lib.connection')
+
 #logging.basicConfig(filename="debug_nic_fw.log", level=logging.DEBUG)
 #logging.basicConfig(level=logging.DEBUG)
 
@@ -123,6 +126,7 @@ def parse_args():
     parser.add_argument(
         '-v', '--version', type=str,
         help='firmware version to update', required=False, nargs='+')
+    telemetry.add_run_args(parser)
     args = parser.parse_args()
     return args
 
@@ -135,10 +139,7 @@ def get_fru_info(conn, verbose=False):
     # Get FRU info if it does not exist
     conn.sendline('ipmitool fru', conn.PROMPT)
     if conn.output:
-        for line in conn.output.split('\n')[1:]:
-            if ' : ' in line:
-                k, v = line.split(' : ', 1)
-                fru[k.strip()] = v.strip()
+        fru = parsers.fru(conn.output)
     else:
         logging.error('ERROR: ipmitool fru command returns nothing!')
         sys.exit(1)
@@ -170,29 +171,13 @@ def get_enp_interface(conn, verbose=False):
 def get_sub_system_from_eth(conn, dev, verbose=False):
     """ This function finds Subsystem that is SUBVENDOR:SUBDEVICE
     """
-    cmd='ethtool -i %s | grep -i bus | grep -Po "[0-9a-f]+\:[0-9a-f]+\.[0-9a-f]+"' %dev
-    conn.sendline(cmd, conn.PROMPT)
-    if conn.output:
-        logging.debug("conn output %s " %conn.output)
-        bus = re.search(r'[0-9a-f]+\:\w+\.\d+', conn.output)
-        bus = bus.group()
-
-    if verbose:
-        logging.debug(json.dumps(bus, indent=4))
-
-    cmd="lspci -s %s -vn" %bus
-    conn.sendline(cmd, conn.PROMPT)
-    if conn.output:
-       logging.debug("conn output %s " %conn.output)
-       sub_system = re.search(r'\Subsystem:\s+[0-9a-f]{4}\:[0-9a-f]{4}',
-               conn.output)
-       sub_system = re.search(r'[0-9a-f]+\:[0-9a-f]{4}', sub_system.group())
-       logging.debug("subsys %s " %sub_system.group())
+    sub_system = inventory.nic_subsystem(conn, dev)
+    logging.debug("subsys %s " %sub_system)
 
     if verbose:
         logging.debug(json.dumps(sub_system, indent=4))
 
-    return sub_system.group()
+    return sub_system
 
 '''----------------------------- GET DEVICE FIRMWARE ------------------------'''
 
@@ -200,16 +185,16 @@ def get_sub_system_from_eth(conn, dev, verbose=False):
 def get_fw_from_eth(conn, dev, verbose=False):
     """ This function finds the firmware version for the device
     """
-    cmd="ethtool -i  %s | grep -i firmware | cut -d: -f2" %dev
+    cmd="ethtool -i %s" %dev
     conn.sendline(cmd, conn.PROMPT)
     if conn.output:
         logging.debug(conn.output)
-        fw = re.search(r'[0x]+\d+[0-9a-f]+', conn.output)
+        fw = parsers.ethtool_i(conn.output)['etrack']
 
     if verbose:
-        logging.debug(json.dumps(firmware, indent=4))
+        logging.debug(json.dumps(fw, indent=4))
 
-    return fw.group()
+    return fw
 
 ''' ------------------------- Check DEVICE FW Acceptable --------------------'''
 
@@ -220,7 +205,7 @@ def is_fw_acceptable(conn, nic_baseboard, nic_version, verbose=False):
         returns True.
     """
 
-    if (nic_version in NIC.NIC_FW_ACCEPTABLE[nic_baseboard]):
+    if NIC.fw_acceptable('NIC', nic_baseboard, nic_version):
         logging.info("NIC firmware version: %s is acceptable" %nic_version)
         return True
     else:
@@ -238,7 +223,7 @@ def is_update_conflict(conn, nic_part_number, nic_version, prefer_nic_version, v
         when we update to the preferred one. if the update causes a conflict,
         return True
     """
-    if (nic_version in NIC.NIC_FW_CONFLICT[(nic_part_number, prefer_nic_version)]):
+    if NIC.fw_conflict('NIC', nic_part_number, nic_version, prefer_nic_version):
         logging.error("FAIL:NIC:UPDATE:Detected=" + str(nic_version) +
                 ":Couldn't update to the prefer version")
         logging.debug("NIC version updated from version: % to version: % will"
@@ -284,6 +269,7 @@ Power Cycle is required to complete the update process.
 """
 '''--------------------------do_fw_update-------------------------'''
 #@time_elapsed
+@tracing.traced()
 def do_intc_fw_update(conn, file_name):
     ''' This function gets the nic file name and performs the update.
     '''
@@ -303,7 +289,8 @@ def do_intc_fw_update(conn, file_name):
     logging.debug("Path: %s file: %s" %(path, file_name))
     CMD = "%s/nvmupdate64e -a %s -u -sv -l -c %s " %(path, path, file_name)
     # Update Complete, Please wait for NIC reboot, about 1 or 2 mins
-    conn.sendline(CMD , conn.PROMPT, timeout=200)
+    with timing_db.phase('flash'):
+        conn.sendline(CMD , conn.PROMPT, timeout=200)
     if conn.output:
         logging.debug(conn.output)
         update = re.search('Power (.*) required', conn.output)
@@ -316,6 +303,7 @@ def do_intc_fw_update(conn, file_name):
             print("UUT does not required update!")
 
 @time_elapsed
+@tracing.traced()
 def do_mlx_fw_update(conn, file_name):
     '''
     Get the mlx file name and do the update.
@@ -337,7 +325,8 @@ def do_mlx_fw_update(conn, file_name):
     logging.debug("...")
 
     # Update Complete, Please wait for MLX reboot, about 1 or 2 mins
-    conn.sendline(CMD + file_name + OPTS, conn.PROMPT, timeout=200)
+    with timing_db.phase('flash'):
+        conn.sendline(CMD + file_name + OPTS, conn.PROMPT, timeout=200)
     print(conn.output)
     success = re.search(r'Done', conn.output, re.I|re.M)
     if success:
@@ -362,9 +351,8 @@ def check_update_process(conn, part_number, fw_version):
     """
 
     try:
-        prefer_nic_version = NIC.NIC_FW_PREFER[part_number]
+        prefer_nic_version, file_name = NIC.fw_prefer('NIC', part_number)
         logging.debug("preferred nic version: %s" %(prefer_nic_version))
-        file_name = NIC.NIC_FW_FILES[(part_number, prefer_nic_version)]
         logging.debug(file_name)
     except KeyError, e:
         logging.error("The version %s is not supported" %part_number)
@@ -439,15 +427,17 @@ def main():
     model, file, version = "", "", ""
     args = parse_args()
 
-    with open(args.log, 'wb') as log:
+    with open(args.log, 'wb') as log, telemetry.run_context(args, args.ip, 'NIC'):
         try:
             is_logged_in = False
-            conn = Connection(logfile=sys.stdout, static_logpath='~/logs/{0}'.format(this_filename))
-            is_logged_in = conn.login(args.ip, args.username, args.password,
-                           auto_prompt_reset=False, remove_known_hosts=True,
-                           ping_before_connect=False)
+            conn = connection.for_host(args.ip, logfile=sys.stdout, static_logpath='~/logs/{0}'.format(this_filename))
+            with timing_db.phase('login'):
+                is_logged_in = conn.login(args.ip, args.username, args.password,
+                               auto_prompt_reset=False, remove_known_hosts=True,
+                               ping_before_connect=False)
             eth_port = []
-            eth_port = get_enp_interface(conn)
+            with timing_db.phase('inventory'):
+                eth_port = get_enp_interface(conn)
             logging.debug(eth_port)
 
             # Check if the option to force update is selected
@@ -471,7 +461,9 @@ def main():
                 # Default - Check for SIOM on the chassis model
                 for i in eth_port:
                     print("\n\n++++++ START UPDATE %s ++++++\n\n" %i)
-                    part_number = get_sub_system_from_eth(conn, i)
+                    with timing_db.phase('inventory'):
+                        part_number = get_sub_system_from_eth(conn, i)
+                    timing_db.set_model(part_number)
                     if part_number in NIC.NIC_CHIPSET["INTC"]:
                         print("Intel chipset part %s, check the update " %part_number)
                         card_type = "INTC"
@@ -481,7 +473,8 @@ def main():
                     else:
                         print("ERROR: Not support chipset %s " %part_number)
                         break
-                    fw_version  = get_fw_from_eth(conn, i)
+                    with timing_db.phase('inventory'):
+                        fw_version  = get_fw_from_eth(conn, i)
                     (ret_status, ret_file) = check_update_process(conn,
                                              part_number, fw_version)
                     if ret_status:
@@ -497,11 +490,13 @@ def main():
                         logging.info("Part %s firmware %s does not require update!" %(part_number, fw_version))
                         print("Part %s firmware %s does not require update!" %(part_number, fw_version))
 
+            metrics.set_result('success')
             print("NIC update completed!")
 
-        except TIMEOUT:
+        except pexpect.TIMEOUT:
             if conn.output:
                 print('{0}'.format(conn.output))
+            metrics.set_result('timeout')
             print('*** Timeout occurred for {0}!'.format(args.ip))
         finally:
             time.sleep(.1)
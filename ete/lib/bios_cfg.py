@@ -0,0 +1,288 @@
+'''bios_cfg.py
+
+BIOS settings baseline: diff the current configuration against a golden
+profile and apply only what differs.
+
+The current configuration is read with sumtool GetCurrentBiosCfg, both it and
+the golden profile are sumtool BIOS configuration XML files:
+
+    <BiosCfg>
+      <Menu name="Advanced">
+        <Menu name="CPU Configuration">
+          <Setting name="Hyper-Threading [ALL]" selectedOption="Enable" type="Option"/>
+
+A profile only needs the settings to enforce.  The settings that differ are
+written to one delta file and applied with a single ChangeBiosCfg call; when
+nothing differs no change is made, so the node does not need a reboot.
+
+    changes = bios_cfg.enforce(conn, BIOS.BIOS_CFG_PROFILES[part_number])
+
+Parsed profiles are cached in memory and on disk, keyed by the profile path,
+size and modification time, so a fleet run parses each profile once.
+
+Prerequisites:
+    - This module is tested on Python 2.7.15 and is compatible with python
+      2.7 or later.
+'''
+import base64
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+
+import xmltodict
+
+from lib import xml_extract
+
+
+log = logging.getLogger(__name__)
+
+SUMTOOL = '/usr/bin/sumtool'
+REMOTE_CURRENT = '/tmp/bios_cfg_current.xml'
+REMOTE_DELTA = '/tmp/bios_cfg_delta.xml'
+CACHE_DIR = '~/.cache/fw_update/bios_cfg'
+
+# Setting attributes holding the value, by setting type
+VALUE_ATTRS = ('selectedOption', 'numericValue', 'checkedStatus')
+VALUE_ELEMENTS = ('StringValue',)
+
+# Characters per line when copying a file through the terminal, well below
+# the 4096 byte line limit of a canonical mode tty
+LINE_CHUNK = 1024
+
+
+class BiosCfgError(Exception):
+    pass
+
+
+''' ---------------------------- Parsing ------------------------------------'''
+def _setting_value(element):
+    '''Return (field, value) of a Setting element, or None if it has none.'''
+    for attr in VALUE_ATTRS:
+        if '@' + attr in element:
+            return '@' + attr, (element['@' + attr] or '').strip()
+    for name in VALUE_ELEMENTS:
+        if name in element:
+            value = element[name]
+            if isinstance(value, dict):
+                value = value.get('#text')
+            return name, (value or '').strip()
+    return None
+
+
+def parse_settings(xml_input):
+    '''Return the settings of a sumtool BIOS configuration XML.
+
+    The result is a list of dicts with the menu path, name, type, value
+    field (eg. '@selectedOption') and value of each setting, in document
+    order.  The document is streamed one top-level menu at a time.
+    '''
+    settings = []
+
+    def collect(ancestors, element):
+        if not isinstance(element, dict) or not element.get('@name'):
+            return True
+        value = _setting_value(element)
+        if value is None:
+            return True
+        menus = [attrs['name'] for name, attrs in ancestors[1:]
+                 if attrs and attrs.get('name')]
+        settings.append({
+            'menus': menus,
+            'name': element['@name'],
+            'type': element.get('@type', ''),
+            'field': value[0],
+            'value': value[1],
+        })
+        return True
+
+    xml_extract.find_all(xml_input, 'Setting', item_depth=2, callback=collect)
+    return settings
+
+
+def setting_key(setting):
+    '''Return the unique key of a setting, its menu path and name.'''
+    return '/'.join(setting['menus'] + [setting['name']])
+
+
+def by_key(settings):
+    return dict((setting_key(s), s) for s in settings)
+
+
+''' ---------------------------- Profiles -----------------------------------'''
+_profiles = {}
+
+
+def _cache_path(path):
+    name = hashlib.sha1(path.encode('utf-8')).hexdigest() + '.json'
+    return os.path.join(os.path.expanduser(CACHE_DIR), name)
+
+
+def load_profile(path, use_disk_cache=True):
+    '''Return the parsed settings of the golden profile at path.
+
+    The result is cached in memory and, unless use_disk_cache is False, in
+    CACHE_DIR for the next processes.  The caches are invalidated when the
+    size or modification time of the profile changes.
+    '''
+    path = os.path.abspath(os.path.expanduser(path))
+    if not os.path.isfile(path):
+        raise BiosCfgError('BIOS config profile {} not found'.format(path))
+    stat = os.stat(path)
+    stamp = [stat.st_size, stat.st_mtime]
+
+    cached = _profiles.get(path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+
+    cache_file = _cache_path(path)
+    if use_disk_cache and os.path.exists(cache_file):
+        try:
+            with open(cache_file) as f:
+                data = json.load(f)
+            if data.get('stamp') == stamp:
+                _profiles[path] = (stamp, data['settings'])
+                return data['settings']
+        except (IOError, ValueError, KeyError):
+            pass
+
+    with open(path, 'rb') as f:
+        settings = parse_settings(f)
+    log.debug('Parsed {} settings from {}'.format(len(settings), path))
+    _profiles[path] = (stamp, settings)
+
+    if use_disk_cache:
+        try:
+            _write_cache(cache_file, {'path': path, 'stamp': stamp,
+                                      'settings': settings})
+        except (IOError, OSError) as e:
+            log.debug('Cannot cache {}: {}'.format(path, e))
+    return settings
+
+
+def _write_cache(cache_file, data):
+    directory = os.path.dirname(cache_file)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.rename(tmp_path, cache_file)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+''' ------------------------------ Diff -------------------------------------'''
+def diff(current, golden):
+    '''Return (changes, missing) between the current and golden settings.
+
+    changes lists the golden settings whose value differs on the node, with
+    the current value under 'current'.  missing lists the golden settings
+    the node does not have, eg. a profile written for another BIOS version.
+    '''
+    current = by_key(current)
+    changes, missing = [], []
+    for setting in golden:
+        key = setting_key(setting)
+        on_node = current.get(key)
+        if on_node is None:
+            missing.append(setting)
+        elif on_node['value'] != setting['value']:
+            change = dict(setting)
+            change['current'] = on_node['value']
+            changes.append(change)
+    return changes, missing
+
+
+def delta_xml(changes):
+    '''Return the sumtool BIOS configuration XML setting only changes.'''
+    root = xmltodict.OrderedDict()
+    menus = {(): root}
+    for change in changes:
+        node = root
+        for depth in range(len(change['menus'])):
+            path = tuple(change['menus'][:depth + 1])
+            if path not in menus:
+                menu = xmltodict.OrderedDict([('@name', path[-1])])
+                node.setdefault('Menu', []).append(menu)
+                menus[path] = menu
+            node = menus[path]
+        setting = xmltodict.OrderedDict([('@name', change['name'])])
+        if change['field'].startswith('@'):
+            setting[change['field']] = change['value']
+        if change['type']:
+            setting['@type'] = change['type']
+        if not change['field'].startswith('@'):
+            setting[change['field']] = change['value']
+        node.setdefault('Setting', []).append(setting)
+    return xmltodict.unparse({'BiosCfg': root}, pretty=True)
+
+
+''' ----------------------------- On node -----------------------------------'''
+def _xml_of(output):
+    '''Strip the echoed command in front of the XML printed by cat.'''
+    start = output.find('<?xml')
+    if start == -1:
+        match = re.search(r'<BiosCfg\b', output)
+        start = match.start() if match else -1
+    if start == -1:
+        raise BiosCfgError('No BIOS configuration in the output')
+    return output[start:].replace('\r\n', '\n')
+
+
+def get_current(conn, remote_file=REMOTE_CURRENT):
+    '''Return the current settings of the node on conn.'''
+    conn.sendline('{} -c GetCurrentBiosCfg --file {} --overwrite'.format(
+        SUMTOOL, remote_file), conn.PROMPT, timeout=180)
+    conn.sendline('cat {}'.format(remote_file), conn.PROMPT, timeout=120)
+    return parse_settings(_xml_of(conn.output))
+
+
+def write_remote_file(conn, path, text):
+    '''Copy text to path on the node through the terminal.
+
+    The text is sent base64 encoded in short lines so neither the shell nor
+    the tty line discipline alter or truncate it.
+    '''
+    encoded = base64.b64encode(text.encode('utf-8')).decode('ascii')
+    conn.sendline('rm -f {0}.b64'.format(path), conn.PROMPT, timeout=10)
+    for i in range(0, len(encoded), LINE_CHUNK):
+        conn.sendline('echo {0} >> {1}.b64'.format(
+            encoded[i:i + LINE_CHUNK], path), conn.PROMPT, timeout=10)
+    conn.sendline('base64 -d {0}.b64 > {0} && rm -f {0}.b64 && echo written'.format(path),
+                  conn.PROMPT, timeout=10)
+    if 'written' not in conn.output.split('\n', 1)[-1]:
+        raise BiosCfgError('Could not write {}: {}'.format(path, conn.output))
+
+
+def apply_changes(conn, changes, remote_file=REMOTE_DELTA):
+    '''Apply changes with one ChangeBiosCfg call.'''
+    write_remote_file(conn, remote_file, delta_xml(changes))
+    conn.sendline('{} -c ChangeBiosCfg --file {}'.format(SUMTOOL, remote_file),
+                  conn.PROMPT, timeout=300)
+    if re.search(r'\b(ERROR|failed)\b', conn.output, re.I):
+        raise BiosCfgError('ChangeBiosCfg failed: {}'.format(conn.output))
+
+
+def enforce(conn, profile, dry_run=False):
+    '''Bring the node's BIOS settings to the golden profile.
+
+    Returns the list of changes, empty if the node already matches.  With
+    dry_run the changes are computed but not applied.
+    '''
+    golden = load_profile(profile)
+    changes, missing = diff(get_current(conn), golden)
+    for setting in missing:
+        log.warning('BIOS setting {} of the profile is not on the node'.format(
+            setting_key(setting)))
+    for change in changes:
+        log.debug('BIOS setting {}: {} -> {}'.format(
+            setting_key(change), change['current'], change['value']))
+    if changes and not dry_run:
+        apply_changes(conn, changes)
+    return changes
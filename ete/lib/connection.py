@@ -8,35 +8,119 @@ Please refer to the following link for documentation,
 
 https://pexpect.readthedocs.io/en/stable/
 
+Connection logs into a host over SSH.  LocalConnection runs a local shell
+behind the same login/sendline/output interface, with no SSH hop, and
+for_host() picks it for loopback targets, so an updater running on the node
+it updates (eg. a PXE-booted node, --ip localhost) needs neither sshd nor
+the login round trips:
+
+    conn = connection.for_host(args.ip, logfile=sys.stdout)
+    conn.login(args.ip, args.username, args.password, auto_prompt_reset=False)
+
+With FW_UPDATE_SIM_DIR set, a host simulated by sim/node.py gets a
+LocalConnection running the fake shell of the node instead.
+
+A session built with record=path (a .jsonl file or a directory), or with
+FW_UPDATE_RECORD_DIR set, is recorded with its timing by lib/recording.py.
+ReplayConnection plays such a recording back behind the same interface, so
+the parsing of the updaters can be run again on a production transcript:
+
+    conn = connection.ReplayConnection('~/logs/20181015T101200_session.jsonl')
+    conn.login()                           # skips the recorded login
+    update_bmc_fw.get_part_version(conn)
+
+run_batch() sends a list of read-only commands without waiting for the
+prompt in between and splits the output back per command, one round trip
+instead of one per command:
+
+    fru, bios = conn.run_batch(['ipmitool fru', 'dmidecode -t bios'])
+
 '''
+import collections
+import contextlib
 import datetime
+import getpass
 import os
 import re
 import sys
+import time
 
 from pexpect import pxssh, run
-from pexpect.exceptions import ExceptionPexpect, TIMEOUT
+from pexpect.exceptions import EOF, ExceptionPexpect, TIMEOUT
+from pexpect.pty_spawn import spawn
 from pexpect.pxssh import ExceptionPxssh
 
+from lib import metrics, recording, tracing
+
 PY3 = (sys.version_info[0] >= 3)
 text_type = str if PY3 else unicode
 
+# Names of the local host; addresses in 127.0.0.0/8 are local too
+LOCAL_HOSTS = ('', 'localhost', 'localhost.localdomain', 'localhost4',
+               'localhost6', '::1')
 
-class Connection(pxssh.pxssh):
-    def __init__(
-        self, timeout=30, maxread=2000, searchwindowsize=None,
-        logfile=None, cwd=None, env=None, ignore_sighup=True, echo=True,
-        options={}, encoding=None, codec_errors='strict', static_logpath=None,
-        verbose=None,
-    ):
-        '''
-        '''
-        super(Connection, self).__init__(
-            timeout=timeout, maxread=maxread,
-            searchwindowsize=searchwindowsize, logfile=logfile, cwd=cwd,
-            env=env, ignore_sighup=ignore_sighup, echo=echo, options=options,
-            encoding=encoding, codec_errors=codec_errors,
-        )
+# Prompt of the local shell, unlikely to show up in command output
+LOCAL_PROMPT = '[FW_UPDATE_LOCAL]# '
+
+# Directory of the simulated nodes, see sim/node.py
+SIM_DIR_ENV = 'FW_UPDATE_SIM_DIR'
+
+# Sentinels framing the commands of a batch, see run_batch().  printf builds
+# them from its arguments, so the echo of the command line never matches.
+BATCH_BEGIN = "printf '\\n%s:%d:BEGIN\\n' {token} {index}"
+BATCH_END = "printf '\\n%s:%d:END:%d\\n' {token} {index} $?"
+BATCH_DONE = "printf '\\n%s:DONE\\n' {token}"
+
+# Bytes of batch lines written at once.  The tty takes in 4095 bytes of
+# input at most; a write beyond blocks until the shell has read the lines,
+# and the shell blocks on its output if nothing reads it meanwhile.
+BATCH_CHUNK = 1024
+
+# Stands for a secret (the login password) in the traces and verbose output
+REDACTED = '<redacted>'
+
+# Result of a command of a batch; status is its exit status, None if the
+# command never completed, and output is as sendline() sets it, the command
+# followed by what it printed
+BatchResult = collections.namedtuple('BatchResult', 'command status output')
+
+
+def is_local(host):
+    '''Return True if host is the loopback address of this machine.'''
+    host = (host or '').strip().lower()
+    return host in LOCAL_HOSTS or host.startswith('127.')
+
+
+def sim_rcfile(host):
+    '''Return the rc file of the simulated node host, or None.'''
+    sim_dir = os.environ.get(SIM_DIR_ENV)
+    if not sim_dir or not host:
+        return None
+    rcfile = os.path.join(os.path.expanduser(sim_dir), host, 'rc')
+    return rcfile if os.path.isfile(rcfile) else None
+
+
+def for_host(host, local=None, **kwargs):
+    '''Return an unconnected session to host.
+
+    A LocalConnection for a loopback host or a simulated node, a Connection
+    otherwise.  local forces the choice.  kwargs go to the constructor,
+    login() is called by the caller as before.
+    '''
+    rcfile = sim_rcfile(host)
+    if rcfile and local is None:
+        return LocalConnection(rcfile=rcfile, **kwargs)
+    if local is None:
+        local = is_local(host)
+    return LocalConnection(**kwargs) if local else Connection(**kwargs)
+
+
+class _Session(object):
+    '''send/sendline with expected patterns and the static log, shared by
+    Connection and LocalConnection.  It must come before the pexpect class
+    in the bases.'''
+
+    def _init_session(self, logfile, static_logpath, verbose, record=None):
         # Create a static logfile path with set location for logs to be stored
         self._static_logfile = None
         if static_logpath:
@@ -47,9 +131,24 @@ class Connection(pxssh.pxssh):
                 os.makedirs(static_logpath)
             self._static_logfile = self.get_file_name_path(static_logpath)
 
+        # Record what is sent and read with the timing, to replay it later
+        self._recorder = None
+        if record is None:
+            record = os.environ.get(recording.RECORD_DIR_ENV)
+        if record:
+            record = os.path.expanduser(record)
+            if not record.endswith('.jsonl'):
+                if not os.path.exists(record):
+                    os.makedirs(record)
+                record = self.get_file_name_path(
+                    record, header='session_{}'.format(os.getpid()), extension='jsonl')
+            self._recorder = recording.Recorder(record, encoding=self.encoding)
+
         self.verbose = verbose
         self.full_buffer = None
         self.output = None
+        self._batches = 0
+        self._secrets = []
         self.logfile_read = logfile
         self.logfile = None
 
@@ -61,16 +160,53 @@ class Connection(pxssh.pxssh):
         function.  The purpose for _static_logfile is to keep a timestamped log
         independent from the logfile user specified.
         '''
-        super(Connection, self)._log(s, direction)
+        if direction == 'read' and self._secrets:
+            # The tty echoes the commands sent back
+            s = self._scrub(s)
+        super(_Session, self)._log(s, direction)
+        if self._recorder:
+            if direction == 'send' and self._is_secret(s):
+                self._recorder.redacted_send()
+            elif direction == 'send':
+                self._recorder.send(s)
+            else:
+                self._recorder.read(s)
+        if direction == 'read':
+            metrics.inc('fw_update_pty_read_bytes_total', len(s))
         if self._static_logfile and direction == 'read':
             with open(self._static_logfile, 'ab') as static_logfile:
                 static_logfile.write(s)
                 static_logfile.flush()
 
-    def _get_prompt(self, partial_prompt):
-        '''Get the prompt of the connected system.'''
-        self.send('\r', partial_prompt, timeout=3, attempt=3, regex=True)
-        return self.full_buffer.strip()
+    @contextlib.contextmanager
+    def _redacting(self, *secrets):
+        '''Keep secrets out of the recording, the trace and the verbose
+        output of what is sent within the with block.'''
+        self._secrets = [secret for secret in secrets if secret]
+        try:
+            yield
+        finally:
+            self._secrets = []
+
+    def _is_secret(self, s):
+        return any(secret in s for secret in self._secrets)
+
+    def _scrub(self, s):
+        for secret in self._secrets:
+            s = s.replace(secret, REDACTED)
+        return s
+
+    def _mark(self, name, **info):
+        '''Leave a mark in the recording of the session.'''
+        if self._recorder:
+            self._recorder.mark(name, **info)
+
+    def close(self, force=True):
+        if self._recorder:
+            self._recorder.mark('close')
+            self._recorder.close()
+            self._recorder = None
+        return super(_Session, self).close(force=force)
 
     def get_file_name_path(self, logpath, timestamp='', header='connection', extension='log'):
         '''Helper function to create a file name path with timestamp.
@@ -85,68 +221,6 @@ class Connection(pxssh.pxssh):
         full_path = os.path.join(logpath, file_name)
         return full_path
         
-    def login(
-        self, server, username, password='', terminal_type='ansi',
-        original_prompt=r'[#$]', login_timeout=10, port=None,
-        auto_prompt_reset=True, ssh_key=None, quiet=True,
-        sync_multiplier=1, check_local_ip=True, 
-        password_regex=r'(?i)(?:password:)|(?:passphrase for key)',
-        ssh_tunnels={}, spawn_local_ssh=True,
-        sync_original_prompt=True, ssh_config=None,
-        remove_known_hosts=False, ping_before_connect=True, attempt=3,
-    ):
-        '''Overrides login from parent class, add to find the prompt after the
-        ssh connection is established if auto_prompt_reset is set to False.
-        Otherwise, login() function set the ssh prompt to '[PEXPECT]$' by
-        default.
-        '''
-        is_logged_in = False
-        
-        # Retry specified attempts before raising exception
-        for i in xrange(attempt):
-            output = ''
-            pattern = ''
-            if ping_before_connect:
-                # Set ping command and expected pattern
-                cmd = 'ping -c4 {}'.format(server)
-                pattern = '4 received'
-                if self.verbose:
-                    if i == 0:
-                        print('{}/{} attempt :\t"{}"\tpattern="{}"'.format(i + 1, attempt, cmd.strip(), pattern))
-                    else:
-                        print('{}/{} attempts:\t"{}"\tpattern="{}"'.format(i + 1, attempt, cmd.strip(), pattern))
-                output = run(cmd, timeout=10)
-
-            # Ping to make sure host is reachable before establish ssh connection
-            if pattern in output:
-                if remove_known_hosts:
-                    run('rm {}'.format(os.path.expanduser('~/.ssh/known_hosts')), timeout=5)
-                try:
-                    is_logged_in = super(Connection, self).login(
-                        server, username, password=password, terminal_type=terminal_type,
-                        original_prompt=original_prompt, login_timeout=login_timeout, port=port,
-                        auto_prompt_reset=auto_prompt_reset, ssh_key=ssh_key, quiet=quiet,
-                        sync_multiplier=sync_multiplier, check_local_ip=check_local_ip,
-                        password_regex=password_regex,
-                        ssh_tunnels=ssh_tunnels, spawn_local_ssh=spawn_local_ssh,
-                        sync_original_prompt=sync_original_prompt,
-                    )
-                    # Get prompt upon login and set it as default prompt
-                    self.PROMPT = self._get_prompt(original_prompt)
-                except:
-                    if i + 1 >= attempt:
-                        if self.verbose:
-                            print('Unable to reach host {}, make sure host is reachable!'.format(server))
-                        raise pxssh.ExceptionPxssh('Unable to reach host {}, make sure host is reachable!'.format(server))
-                    continue
-                break
-            else:
-                if i + 1 >= attempt:
-                    if self.verbose:
-                        print('Unable to reach host {}, make sure host is reachable!'.format(server))
-                    raise pxssh.ExceptionPxssh('Unable to reach host {}, make sure host is reachable!'.format(server))
-        return is_logged_in
-        
     def send(self, s, pattern=[], timeout=-1, attempt=1, regex=False, verbose=False):
         '''Overrides send from parent class, added ability to include expected
         patterns, expected timeout, retry attempts, and matching with/without
@@ -185,53 +259,355 @@ class Connection(pxssh.pxssh):
 
         if attempt < 1:
             attempt = 1
+        shown = REDACTED if self._is_secret(s) else s
 
-        # Retry specified attempts before raising exception
-        for i in xrange(attempt):
-            if self.verbose:
-                if i == 0:
-                    print('{}/{} attempt :\t"{}"\tpattern="{}"'.format(i + 1, attempt, s.strip(), pattern))
-                else:
-                    print('{}/{} attempts:\t"{}"\tpattern="{}"'.format(i + 1, attempt, s.strip(), pattern))
-            super(Connection, self).send(s)
-            if pattern:
-                try:
-                    if regex:
-                        super(Connection, self).expect(pattern, timeout=timeout)
+        with tracing.span(shown, cat='command', pattern=pattern, timeout=timeout) as span:
+            # Retry specified attempts before raising exception
+            for i in xrange(attempt):
+                if self.verbose:
+                    if i == 0:
+                        print('{}/{} attempt :\t"{}"\tpattern="{}"'.format(i + 1, attempt, shown.strip(), pattern))
                     else:
-                        super(Connection, self).expect_exact(pattern, timeout=timeout)
-                    self.full_buffer = self.before + self.after + self.buffer
-
-                    # Get output from the command sent, stripping the command and the prompt.
-                    self.output = self.full_buffer.replace(self.PROMPT, '').strip()
-                    if verbose:
-                        print('s "{}"'.format(s))
-                        print('1 match "{}"'.format(self.match if isinstance(self.match, str) else self.match.group(0)))
-                        print('2 before "{}"'.format(self.before))
-                        print('3 after "{}"'.format(self.after))
-                        print('4 buffer "{}"'.format(self.buffer))
-                        print('5 output "{}"'.format(self.output))
-                        print('6 full_buffer "{}"'.format(self.full_buffer))
-                        print('7 prompt "{}"'.format(self.PROMPT))
-                    break
-                except TIMEOUT:
-                    self.full_buffer = self.buffer
-
-                    # Get output from the command sent, stripping the command and the prompt.
-                    self.output = self.full_buffer.replace(self.PROMPT, '').strip()
-                    if verbose:
-                        print('s "{}"'.format(s))
-                        print('1 buffer "{}"'.format(self.buffer))
-                        print('2 output "{}"'.format(self.output))
-                        print('3 full_buffer "{}"'.format(self.full_buffer))
-                        print('4 prompt "{}"'.format(self.PROMPT))
-                    if i + 1 >= attempt:
-                        if self.verbose:
-                            print('Raise TIMEOUT exception')
-                        raise TIMEOUT(ExceptionPexpect)
+                        print('{}/{} attempts:\t"{}"\tpattern="{}"'.format(i + 1, attempt, shown.strip(), pattern))
+                super(_Session, self).send(s)
+                metrics.inc('fw_update_commands_sent_total')
+                if pattern:
+                    try:
+                        if regex:
+                            super(_Session, self).expect(pattern, timeout=timeout)
+                        else:
+                            super(_Session, self).expect_exact(pattern, timeout=timeout)
+                        self.full_buffer = self.before + self.after + self.buffer
+
+                        # Get output from the command sent, stripping the command and the prompt.
+                        self.output = self.full_buffer.replace(self.PROMPT, '').strip()
+                        if verbose:
+                            print('s "{}"'.format(shown))
+                            print('1 match "{}"'.format(self.match if isinstance(self.match, str) else self.match.group(0)))
+                            print('2 before "{}"'.format(self.before))
+                            print('3 after "{}"'.format(self.after))
+                            print('4 buffer "{}"'.format(self.buffer))
+                            print('5 output "{}"'.format(self.output))
+                            print('6 full_buffer "{}"'.format(self.full_buffer))
+                            print('7 prompt "{}"'.format(self.PROMPT))
+                        break
+                    except TIMEOUT:
+                        metrics.inc('fw_update_expect_timeouts_total')
+                        self.full_buffer = self.buffer
+
+                        # Get output from the command sent, stripping the command and the prompt.
+                        self.output = self.full_buffer.replace(self.PROMPT, '').strip()
+                        if verbose:
+                            print('s "{}"'.format(shown))
+                            print('1 buffer "{}"'.format(self.buffer))
+                            print('2 output "{}"'.format(self.output))
+                            print('3 full_buffer "{}"'.format(self.full_buffer))
+                            print('4 prompt "{}"'.format(self.PROMPT))
+                        if i + 1 >= attempt:
+                            if self.verbose:
+                                print('Raise TIMEOUT exception')
+                            raise TIMEOUT(ExceptionPexpect)
+            span.set(attempts=i + 1, match_index=self.match_index)
         return self.match_index
 
     def sendline(self, s='', pattern=[], timeout=-1, attempt=1, regex=False, verbose=False):
         '''Send command and append line feed at the end.'''
         s = self._coerce_send_string(s)
         return self.send(s=s+self.linesep, pattern=pattern, timeout=timeout, attempt=attempt, regex=regex, verbose=verbose)
+
+    def run_batch(self, cmds, timeout=-1):
+        '''Run commands in one round trip and return their BatchResults.
+
+        sendline() waits for the prompt after every command, a round trip
+        each.  Here every command goes on one line between a begin and an
+        end sentinel, the end one carrying the exit status, and the lines
+        of all the commands are sent at once.  The shell runs them in turn
+        and the output stream is split back into one result per command:
+
+            results = conn.run_batch(['ipmitool fru', 'dmidecode -t bios'])
+            fru = parsers.fru(results[0].output)
+
+        The tty echoes the lines as they are written, before stty -echo
+        has run, so the echo of the whole batch is in the stream.  It does
+        not break the frames: the sentinels are printed by printf from a
+        format and the token as separate words, so the echoed command lines
+        never hold TOKEN:i:BEGIN or TOKEN:i:END, only the printed sentinels
+        do.  stty -echo only stops the echo of the lines the tty takes in
+        after it ran.  The commands read from /dev/null, a command reading
+        its input would eat the lines after it otherwise.
+
+        The lines are written in chunks of BATCH_CHUNK bytes, each one once
+        the shell started the last command of the chunk before, so the tty
+        input never fills up and the output is read as the batch runs.  A
+        command must be a single line that runs in { ...; }.  timeout is
+        for the whole batch; full_buffer is set to the output stream and
+        output to None.
+        '''
+        cmds = list(cmds)
+        self._batches += 1
+        token = 'FW_BATCH_{0}'.format(self._batches)
+        # Lines with the index of their command, None for the stty ones
+        lines = [('stty -echo 2>/dev/null', None)]
+        for index, cmd in enumerate(cmds):
+            lines.append(('{0}; {{ {1}; }} </dev/null; {2}'.format(
+                BATCH_BEGIN.format(token=token, index=index), cmd,
+                BATCH_END.format(token=token, index=index)), index))
+        lines.append(('stty echo 2>/dev/null; {0}'.format(
+            BATCH_DONE.format(token=token)), None))
+
+        chunks, size = [[]], 0
+        for line, index in lines:
+            if chunks[-1] and size + len(line) >= BATCH_CHUNK:
+                chunks.append([])
+                size = 0
+            chunks[-1].append((line, index))
+            size += len(line) + len(self.linesep)
+
+        if timeout == -1:
+            timeout = self.timeout
+        deadline = None if timeout is None else time.time() + timeout
+
+        def remaining():
+            if deadline is None:
+                return None
+            return max(deadline - time.time(), 0)
+
+        self.full_buffer = None
+        self.output = None
+        with tracing.span('batch of {0}'.format(len(cmds)), cat='command',
+                          commands=len(cmds), timeout=timeout):
+            metrics.inc('fw_update_commands_sent_total', len(cmds))
+            stream, started = [], None
+            try:
+                for chunk in chunks:
+                    super(_Session, self).send(self._coerce_send_string(
+                        ''.join(line + self.linesep for line, _ in chunk)))
+                    if started is not None:
+                        super(_Session, self).expect_exact(
+                            '{0}:{1}:BEGIN'.format(token, started),
+                            timeout=remaining())
+                        stream.append(self.before + self.after)
+                    indexes = [index for _, index in chunk if index is not None]
+                    started = indexes[-1] if indexes else None
+                super(_Session, self).expect_exact('{0}:DONE'.format(token), timeout=remaining())
+                stream.append(self.before)
+                stream = ''.join(stream)
+                super(_Session, self).expect_exact(self.PROMPT, timeout=remaining())
+            except TIMEOUT:
+                metrics.inc('fw_update_expect_timeouts_total')
+                self.full_buffer = self.buffer
+                raise
+
+        self.full_buffer = stream
+        frames = re.compile(
+            r'{0}:(\d+):BEGIN\r?\n(.*?)\r?\n{0}:\1:END:(\d+)'.format(re.escape(token)),
+            re.S)
+        results = [BatchResult(cmd, None, None) for cmd in cmds]
+        for match in frames.finditer(stream):
+            index = int(match.group(1))
+            if index < len(cmds):
+                results[index] = BatchResult(
+                    cmds[index], int(match.group(3)),
+                    '{0}\r\n{1}'.format(cmds[index], match.group(2)).strip())
+        return results
+
+
+class Connection(_Session, pxssh.pxssh):
+    def __init__(
+        self, timeout=30, maxread=2000, searchwindowsize=None,
+        logfile=None, cwd=None, env=None, ignore_sighup=True, echo=True,
+        options={}, encoding=None, codec_errors='strict', static_logpath=None,
+        verbose=None, record=None,
+    ):
+        '''
+        '''
+        super(Connection, self).__init__(
+            timeout=timeout, maxread=maxread,
+            searchwindowsize=searchwindowsize, logfile=logfile, cwd=cwd,
+            env=env, ignore_sighup=ignore_sighup, echo=echo, options=options,
+            encoding=encoding, codec_errors=codec_errors,
+        )
+        self._init_session(logfile, static_logpath, verbose, record)
+
+    def _get_prompt(self, partial_prompt):
+        '''Get the prompt of the connected system.'''
+        self.send('\r', partial_prompt, timeout=3, attempt=3, regex=True)
+        return self.full_buffer.strip()
+
+    def login(
+        self, server, username, password='', terminal_type='ansi',
+        original_prompt=r'[#$]', login_timeout=10, port=None,
+        auto_prompt_reset=True, ssh_key=None, quiet=True,
+        sync_multiplier=1, check_local_ip=True, 
+        password_regex=r'(?i)(?:password:)|(?:passphrase for key)',
+        ssh_tunnels={}, spawn_local_ssh=True,
+        sync_original_prompt=True, ssh_config=None,
+        remove_known_hosts=False, ping_before_connect=True, attempt=3,
+    ):
+        '''Overrides login from parent class, add to find the prompt after the
+        ssh connection is established if auto_prompt_reset is set to False.
+        Otherwise, login() function set the ssh prompt to '[PEXPECT]$' by
+        default.
+        '''
+        is_logged_in = False
+        
+        with tracing.span('login', cat='connection', server=server, username=username):
+            # Retry specified attempts before raising exception
+            for i in xrange(attempt):
+                output = ''
+                pattern = ''
+                if ping_before_connect:
+                    # Set ping command and expected pattern
+                    cmd = 'ping -c4 {}'.format(server)
+                    pattern = '4 received'
+                    if self.verbose:
+                        if i == 0:
+                            print('{}/{} attempt :\t"{}"\tpattern="{}"'.format(i + 1, attempt, cmd.strip(), pattern))
+                        else:
+                            print('{}/{} attempts:\t"{}"\tpattern="{}"'.format(i + 1, attempt, cmd.strip(), pattern))
+                    output = run(cmd, timeout=10)
+
+                # Ping to make sure host is reachable before establish ssh connection
+                if pattern in output:
+                    if remove_known_hosts:
+                        run('rm {}'.format(os.path.expanduser('~/.ssh/known_hosts')), timeout=5)
+                    try:
+                        with self._redacting(password):
+                            is_logged_in = super(Connection, self).login(
+                                server, username, password=password, terminal_type=terminal_type,
+                                original_prompt=original_prompt, login_timeout=login_timeout, port=port,
+                                auto_prompt_reset=auto_prompt_reset, ssh_key=ssh_key, quiet=quiet,
+                                sync_multiplier=sync_multiplier, check_local_ip=check_local_ip,
+                                password_regex=password_regex,
+                                ssh_tunnels=ssh_tunnels, spawn_local_ssh=spawn_local_ssh,
+                                sync_original_prompt=sync_original_prompt,
+                            )
+                        # Get prompt upon login and set it as default prompt
+                        self.PROMPT = self._get_prompt(original_prompt)
+                        self._mark('login', server=server, prompt=self.PROMPT)
+                    except:
+                        if i + 1 >= attempt:
+                            if self.verbose:
+                                print('Unable to reach host {}, make sure host is reachable!'.format(server))
+                            raise pxssh.ExceptionPxssh('Unable to reach host {}, make sure host is reachable!'.format(server))
+                        continue
+                    break
+                else:
+                    if i + 1 >= attempt:
+                        if self.verbose:
+                            print('Unable to reach host {}, make sure host is reachable!'.format(server))
+                        raise pxssh.ExceptionPxssh('Unable to reach host {}, make sure host is reachable!'.format(server))
+        return is_logged_in
+
+
+class LocalConnection(_Session, spawn):
+    '''A shell on this machine behind the Connection interface.
+
+    login() starts bash in a pty, with a fixed prompt and no rc files but
+    rcfile if given, as the current user; the server, credentials and SSH
+    options are accepted and ignored.  Commands are sent, echoed and matched
+    exactly as over SSH.
+    '''
+
+    def __init__(
+        self, timeout=30, maxread=2000, searchwindowsize=None,
+        logfile=None, cwd=None, env=None, ignore_sighup=True, echo=True,
+        options={}, encoding=None, codec_errors='strict', static_logpath=None,
+        verbose=None, shell='/bin/bash', rcfile=None, record=None,
+    ):
+        '''
+        '''
+        super(LocalConnection, self).__init__(
+            None, timeout=timeout, maxread=maxread,
+            searchwindowsize=searchwindowsize, logfile=logfile, cwd=cwd,
+            env=env, ignore_sighup=ignore_sighup, echo=echo,
+            encoding=encoding, codec_errors=codec_errors,
+        )
+        self._init_session(logfile, static_logpath, verbose, record)
+        self.shell = shell
+        self.rcfile = rcfile
+        self.PROMPT = LOCAL_PROMPT
+
+    def login(self, server='localhost', username=None, password='', *args, **kwargs):
+        '''Start the local shell and wait for its prompt.
+
+        Takes the arguments of Connection.login() so the callers do not
+        change.  login_timeout is honoured, the rest is ignored.
+        '''
+        login_timeout = kwargs.get('login_timeout', 10)
+        if username and username != getpass.getuser():
+            if self.verbose:
+                print('Running locally as {} instead of {}'.format(getpass.getuser(), username))
+        env = dict(os.environ if self.env is None else self.env)
+        # No readline so nothing but the command is echoed back
+        env.update(PS1=LOCAL_PROMPT, PS2='', PROMPT_COMMAND='', TERM='dumb')
+        self.env = env
+        self.command = None
+        self._spawn(self.shell, ['--norc', '--noprofile', '--noediting', '-i'])
+        try:
+            self.expect_exact(LOCAL_PROMPT, timeout=login_timeout)
+            if self.rcfile:
+                # Sourced rather than --rcfile, which also reads the system
+                # bashrc and its PS1
+                self.sendline('. {}'.format(self.rcfile))
+                self.expect_exact(LOCAL_PROMPT, timeout=login_timeout)
+        except (EOF, TIMEOUT):
+            # The rc file of a simulated node exits while the node is down
+            self.close()
+            raise ExceptionPxssh('Unable to reach host {}, make sure host is reachable!'.format(server))
+        self._mark('login', server=server, prompt=LOCAL_PROMPT)
+        return True
+
+    def logout(self):
+        '''Exit the shell and close the pty.'''
+        if not self.isalive():
+            self.close()
+            return
+        self.sendline('exit')
+        try:
+            self.expect(EOF, timeout=5)
+        except TIMEOUT:
+            pass
+        self.close()
+
+
+class ReplayConnection(_Session, recording.ReplaySpawn):
+    '''A recorded session behind the Connection interface.
+
+    login() skips what the recorded session did up to the end of its login
+    and takes the prompt it found, unless prompt is given.  speed and
+    strict are those of recording.ReplaySpawn.
+    '''
+
+    def __init__(
+        self, path, speed=1.0, strict=False, timeout=30, maxread=2000,
+        searchwindowsize=None, logfile=None, encoding=None,
+        codec_errors='strict', static_logpath=None, verbose=None, prompt=None,
+    ):
+        '''
+        '''
+        super(ReplayConnection, self).__init__(
+            path, speed=speed, strict=strict, timeout=timeout, maxread=maxread,
+            searchwindowsize=searchwindowsize, logfile=logfile,
+            encoding=encoding, codec_errors=codec_errors,
+        )
+        self._init_session(logfile, static_logpath, verbose, record=False)
+        self.PROMPT = prompt
+
+    def login(self, *args, **kwargs):
+        '''Skip the recorded login.
+
+        Takes the arguments of Connection.login() so the callers do not
+        change.
+        '''
+        marks = self.marks('login')
+        if marks:
+            index, info = marks[0]
+            self.skip_to(index + 1)
+            if self.PROMPT is None and info.get('prompt'):
+                prompt = info['prompt']
+                self.PROMPT = prompt if self.encoding else self._bytes(prompt)
+        return True
+
+    def logout(self):
+        self.close()
@@ -30,8 +30,6 @@ def time_elapsed(f, *args, **kwargs):
     '''
     print('>>> {}'.format(f.__name__))
     log.debug('>>> {}'.format(f.__name__))
-    args = [x for x in args]
-    kwargs = dict((k, v) for k, v in kwargs.items())
     start_time = time.time()
     status = f(*args, **kwargs)
     timer = time.time() - start_time
@@ -43,8 +41,6 @@ def time_elapsed(f, *args, **kwargs):
 
 @decorator.decorator
 def state_machine(f, *args, **kwargs):
-    args = [x for x in args]
-    kwargs = dict((k, v) for k, v in kwargs.items())
     status = f(*args, **kwargs)
     return status
 
@@ -0,0 +1,252 @@
+'''fleet.py
+
+Process-pool execution of per-host jobs for fleet runs.
+
+Scanning the output of hundreds of concurrent sessions with expect is
+regex-heavy, and under Python 2.7 threads spend that time waiting on the
+GIL.  Here the work runs in worker processes instead:
+
+    - every task is a (host, job) pair, job being called as job(conn, host)
+      on a logged in Connection to the host,
+    - the tasks of a host are kept together and the hosts are dealt out to
+      the workers, so each worker owns the sessions of its hosts and a host
+      with several jobs is logged into once,
+    - a worker that runs out of tasks steals the last host of the busiest
+      worker's share, all its tasks at once and only if that worker has not
+      started it, so slow hosts do not leave the other cores idle and a host
+      is never worked on by two workers,
+    - every task produces one compact Result record, streamed back to the
+      parent as soon as it is done.
+
+    def bmc_version(conn, host):
+        conn.sendline('ipmitool mc info', conn.PROMPT)
+        return re.search(r'Firmware Revision\s*:\s*(\S+)', conn.output).group(1)
+
+    for result in fleet.run([(host, bmc_version) for host in hosts],
+                            'root', 'nutanix/4u'):
+        print(result.host, result.status, result.value)
+
+Jobs and the connect function are sent to the workers by name, so they must
+be defined at module level (functools.partial of those is fine).  A job
+should return a small value: it is pickled back to the parent.
+
+check_fw_compliance.py --ssh runs its census on it (lib/ssh_collector.py).
+rollout_fw.py still runs the update_*_fw.py scripts as subprocesses.
+
+Prerequisites:
+    - This module is tested on Python 2.7.15 and is compatible with python
+      2.7 or later.
+'''
+import collections
+import logging
+import multiprocessing
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+log = logging.getLogger(__name__)
+
+# Sessions a worker keeps open, the least recently used one is closed first
+SESSIONS_PER_WORKER = 4
+
+# Result of one task; status is 'ok', 'error', 'timeout', 'connect' (the
+# login failed) or 'lost' (the worker died before reporting the task)
+Result = collections.namedtuple(
+    'Result', 'index host job status elapsed value error worker')
+
+
+def login(host, username, password):
+    '''Return a Connection logged in to host, the default connect function.'''
+    from lib import connection
+    conn = connection.for_host(host, static_logpath='~/logs/fleet/{0}'.format(host))
+    conn.login(host, username, password, auto_prompt_reset=False,
+               ping_before_connect=False)
+    return conn
+
+
+def job_name(job):
+    '''Return a readable name of a job, a function or a partial of one.'''
+    func = getattr(job, 'func', job)
+    return getattr(func, '__name__', repr(func))
+
+
+def partition(tasks, workers):
+    '''Deal the tasks out to workers, keeping the tasks of a host together.
+
+    Returns (order, bounds, starts): order lists the task indexes, worker w
+    owns order[bounds[w][0]:bounds[w][1]] and the tasks of a host are
+    contiguous in order, starts[i] being the position where the host of
+    order[i] begins.  Hosts are assigned biggest first to the least loaded
+    worker.
+    '''
+    by_host = collections.OrderedDict()
+    for index, task in enumerate(tasks):
+        by_host.setdefault(task[0], []).append(index)
+
+    shares = [[] for _ in range(workers)]
+    for indexes in sorted(by_host.values(), key=len, reverse=True):
+        min(shares, key=len).extend(indexes)
+
+    order, bounds, starts = [], [], []
+    for share in shares:
+        bounds.append((len(order), len(order) + len(share)))
+        for position, index in enumerate(share):
+            if position == 0 or tasks[index][0] != tasks[share[position - 1]][0]:
+                start = len(order)
+            order.append(index)
+            starts.append(start)
+    return order, bounds, starts
+
+
+class _Share(object):
+    '''The task shares of all workers, in shared memory.
+
+    A worker takes from the head of its own share.  When it is empty it
+    steals the host at the tail of the longest other share that has not been
+    started yet, all the tasks of that host becoming its new share.
+    '''
+
+    def __init__(self, order, bounds, starts):
+        self.order = order
+        self.starts = starts
+        self.lock = multiprocessing.Lock()
+        self.heads = multiprocessing.Array('i', [b[0] for b in bounds], lock=False)
+        self.tails = multiprocessing.Array('i', [b[1] for b in bounds], lock=False)
+
+    def next(self, worker):
+        '''Return (task index, stolen), or (None, False) when all is done.'''
+        with self.lock:
+            if self.heads[worker] < self.tails[worker]:
+                self.heads[worker] += 1
+                return self.order[self.heads[worker] - 1], False
+            # Only a host whose first task is still ahead of the head of its
+            # owner can move, a host being worked on stays with its session
+            victims = [w for w in range(len(self.heads))
+                       if self.tails[w] > self.heads[w] and
+                       self.starts[self.tails[w] - 1] >= self.heads[w]]
+            if not victims:
+                return None, False
+            victim = max(victims, key=lambda w: self.tails[w] - self.heads[w])
+            start = self.starts[self.tails[victim] - 1]
+            self.heads[worker], self.tails[worker] = start + 1, self.tails[victim]
+            self.tails[victim] = start
+            return self.order[start], True
+
+
+def _close(conn):
+    try:
+        conn.logout()
+    except Exception:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def _worker(worker, tasks, share, results, username, password, connect):
+    '''Run tasks until every share is empty, in a worker process.'''
+    from pexpect.exceptions import TIMEOUT
+
+    sessions = collections.OrderedDict()
+    refused = {}
+    try:
+        while True:
+            index, stolen = share.next(worker)
+            if index is None:
+                break
+            host, job = tasks[index][:2]
+            name = job_name(job)
+            started = time.time()
+
+            conn = sessions.pop(host, None)
+            if conn is None and host in refused:
+                results.put(Result(index, host, name, 'connect', 0.0, None,
+                                   refused[host], worker))
+                continue
+            if conn is None:
+                try:
+                    conn = connect(host, username, password)
+                except Exception as e:
+                    refused[host] = str(e) or e.__class__.__name__
+                    results.put(Result(index, host, name, 'connect',
+                                       time.time() - started, None,
+                                       refused[host], worker))
+                    continue
+            sessions[host] = conn
+            while len(sessions) > SESSIONS_PER_WORKER:
+                _close(sessions.popitem(last=False)[1])
+
+            status, value, error = 'ok', None, None
+            try:
+                value = job(conn, host)
+            except TIMEOUT as e:
+                status, error = 'timeout', str(e) or 'TIMEOUT'
+                # The session is in an unknown state, do not reuse it
+                _close(sessions.pop(host))
+            except Exception as e:
+                status, error = 'error', '{0}: {1}'.format(e.__class__.__name__, e)
+            if stolen:
+                log.debug('Worker {0} stole {1} {2}'.format(worker, host, name))
+            results.put(Result(index, host, name, status,
+                               time.time() - started, value, error, worker))
+    finally:
+        for conn in sessions.values():
+            _close(conn)
+
+
+def run(tasks, username, password, workers=None, connect=login):
+    '''Run tasks on worker processes and yield their Result records.
+
+    tasks is a list of (host, job).  The records are yielded in completion
+    order, one per task; index is the position of the task in tasks.
+    workers defaults to the number of CPUs.
+    '''
+    tasks = [tuple(task) for task in tasks]
+    if not tasks:
+        return
+    hosts = len(set(task[0] for task in tasks))
+    workers = max(1, min(workers or multiprocessing.cpu_count(), hosts))
+    share = _Share(*partition(tasks, workers))
+    results = multiprocessing.Queue()
+
+    processes = []
+    for worker in range(workers):
+        process = multiprocessing.Process(
+            target=_worker, name='fleet-worker-{0}'.format(worker),
+            args=(worker, tasks, share, results, username, password, connect))
+        process.daemon = True
+        process.start()
+        processes.append(process)
+
+    started = time.time()
+    pending = set(range(len(tasks)))
+    try:
+        while pending:
+            try:
+                result = results.get(timeout=1)
+            except queue.Empty:
+                if any(p.is_alive() for p in processes):
+                    continue
+                # Give the last records sent by the workers a moment to arrive
+                try:
+                    result = results.get(timeout=1)
+                except queue.Empty:
+                    break
+            pending.discard(result.index)
+            yield result
+        for index in sorted(pending):
+            host, job = tasks[index][:2]
+            log.error('Task {0} {1} was lost'.format(host, job_name(job)))
+            yield Result(index, host, job_name(job), 'lost', 0.0, None,
+                         'worker exited', None)
+    finally:
+        for process in processes:
+            if process.is_alive() and pending:
+                process.terminate()
+            process.join()
+        log.debug('Ran {0} tasks on {1} hosts with {2} workers in {3:.2f} seconds'.format(
+            len(tasks), hosts, workers, time.time() - started))
@@ -0,0 +1,133 @@
+'''inventory.py
+
+Inventory of a node read from sysfs in one command.
+
+The updaters used to spawn a tool per value: dmidecode -t baseboard for
+the board, dmidecode -t bios for the BIOS version, ethtool then lspci for
+the subsystem of every NIC port.  Here a single grep prints the DMI ids
+and the uevent of every network and PCI device:
+
+    grep -s -H . /sys/class/dmi/id/board_name ... \
+        /sys/class/net/*/device/uevent /sys/bus/pci/devices/*/uevent
+
+and the record of the node is built from that output:
+
+    {'board_name': 'X11DPT-B', 'bios_version': 'PB20.000', ...,
+     'nics': {'enp94s0f0': {'slot': '0000:5e:00.0', 'vendor': '8086',
+                            'device': '1563', 'subsystem': '15d9:0920',
+                            'class': '20000', 'driver': 'ixgbe'}, ...},
+     'pci': {'0000:5e:00.0': {...}, ...}}
+
+The record is read once per session.  A value missing from sysfs (an old
+kernel, a DMI table the kernel did not export) is read with the tool the
+updaters used before, only when it is asked for:
+
+    board = inventory.dmi(conn, 'board_name')
+    subsystem = inventory.nic_subsystem(conn, 'enp94s0f0')
+
+Prerequisites:
+    - This module is tested on Python 2.7.15 and is compatible with python
+      2.7 or later.
+'''
+import logging
+import weakref
+
+from lib import parsers
+
+
+log = logging.getLogger(__name__)
+
+DMI_DIR = '/sys/class/dmi/id'
+DMI_FIELDS = ('board_name', 'board_vendor', 'bios_version', 'bios_date',
+              'product_name')
+NET_UEVENTS = '/sys/class/net/*/device/uevent'
+PCI_UEVENTS = '/sys/bus/pci/devices/*/uevent'
+
+# dmidecode type, section and field of each DMI id, for the fallback
+DMIDECODE = {
+    'board_name': ('baseboard', 'Base Board Information', 'Product Name'),
+    'board_vendor': ('baseboard', 'Base Board Information', 'Manufacturer'),
+    'bios_version': ('bios', 'BIOS Information', 'Version'),
+    'bios_date': ('bios', 'BIOS Information', 'Release Date'),
+    'product_name': ('system', 'System Information', 'Product Name'),
+}
+
+# Inventory of each session, dropped with the session
+_inventories = weakref.WeakKeyDictionary()
+
+
+def command():
+    '''Return the command printing the sysfs files of the inventory.'''
+    paths = ['{0}/{1}'.format(DMI_DIR, field) for field in DMI_FIELDS]
+    return 'grep -s -H . {0} {1} {2}'.format(' '.join(paths), NET_UEVENTS,
+                                             PCI_UEVENTS)
+
+
+def _pci(lines):
+    '''Return the record of a PCI device from the lines of its uevent.'''
+    uevent = dict(line.split('=', 1) for line in lines if '=' in line)
+    pci_id = uevent.get('PCI_ID', '').lower().split(':')
+    return {
+        'slot': uevent.get('PCI_SLOT_NAME'),
+        'vendor': pci_id[0] if len(pci_id) == 2 else None,
+        'device': pci_id[1] if len(pci_id) == 2 else None,
+        'subsystem': uevent.get('PCI_SUBSYS_ID', '').lower() or None,
+        'class': uevent.get('PCI_CLASS'),
+        'driver': uevent.get('DRIVER'),
+    }
+
+
+def parse(output):
+    '''Return the inventory record of the output of command().'''
+    files = parsers.grep_h(output)
+    record = {'nics': {}, 'pci': {}}
+    for field in DMI_FIELDS:
+        lines = files.get('{0}/{1}'.format(DMI_DIR, field))
+        record[field] = (lines[0].strip() or None) if lines else None
+    for path, lines in files.items():
+        parts = path.split('/')
+        if path.startswith('/sys/class/net/') and parts[-2:] == ['device', 'uevent']:
+            record['nics'][parts[4]] = _pci(lines)
+        elif path.startswith('/sys/bus/pci/devices/') and parts[-1] == 'uevent':
+            device = _pci(lines)
+            record['pci'][device['slot'] or parts[5]] = device
+    return record
+
+
+def get(conn, refresh=False):
+    '''Return the inventory of the node of conn, read once per session.'''
+    record = None if refresh else _inventories.get(conn)
+    if record is None:
+        conn.sendline(command(), conn.PROMPT)
+        record = parse(conn.output or '')
+        log.debug('Inventory: {0} DMI ids, {1} NICs, {2} PCI devices'.format(
+            sum(1 for f in DMI_FIELDS if record[f]), len(record['nics']),
+            len(record['pci'])))
+        _inventories[conn] = record
+    return record
+
+
+def dmi(conn, field):
+    '''Return a DMI id of the node, from sysfs or else from dmidecode.'''
+    record = get(conn)
+    if record.get(field) is None:
+        kind, section, key = DMIDECODE[field]
+        log.debug('{0} is not in sysfs, reading it with dmidecode'.format(field))
+        conn.sendline('dmidecode -t {0}'.format(kind), conn.PROMPT)
+        record[field] = parsers.dmidecode(conn.output or '').get(section, {}).get(key)
+    return record[field]
+
+
+def nic_subsystem(conn, dev):
+    '''Return the SUBVENDOR:SUBDEVICE of a NIC port, from sysfs or else from
+    ethtool and lspci.
+    '''
+    nic = get(conn)['nics'].setdefault(dev, {'slot': None, 'subsystem': None})
+    if nic.get('subsystem') is None:
+        log.debug('{0} is not in sysfs, reading it with ethtool'.format(dev))
+        conn.sendline('ethtool -i {0}'.format(dev), conn.PROMPT)
+        nic['slot'] = parsers.ethtool_i(conn.output or '').get('bus-info')
+        conn.sendline('lspci -s {0} -vn'.format(nic['slot']), conn.PROMPT)
+        devices = parsers.lspci_vn(conn.output or '')
+        nic['subsystem'] = devices[0]['subsystem'] if devices else None
+    return nic['subsystem']
@@ -0,0 +1,226 @@
+'''ipmi_collector.py
+
+Out-of-band FRU and BMC firmware census of many BMCs over IPMI.
+
+The updaters read the FRU and the BMC version in-band, logged into the
+host OS one node at a time.  The collector asks the BMCs directly with
+ipmitool over the LAN (-I lanplus, RMCP+):
+
+    - one ipmitool per BMC runs 'mc info' and 'fru print 0' in exec mode, so
+      both come from a single RMCP+ session,
+    - the BMCs are queried concurrently from a bounded thread pool, each
+      worker waiting on its ipmitool process,
+    - the password is handed over in IPMI_PASSWORD (-E), never on a command
+      line other users can read,
+    - a BMC is tried with each of the credentials given, in order, and the
+      ones it accepted are cached in a file for the next sweeps, which go
+      straight to them instead of paying the failed logins again.
+
+    cache = ipmi_collector.load_credentials('~/.cache/fw_update/ipmi_credentials.json')
+    for record in ipmi_collector.collect(hosts, [('ADMIN', 'ADMIN')], cache=cache):
+        print(record['host'], record['model'], record['firmware'].get('BMC'))
+    ipmi_collector.save_credentials('~/.cache/fw_update/ipmi_credentials.json', cache)
+
+The records have the shape of the redfish_crawler records, so they can be
+audited with the same code.
+
+Prerequisites:
+    - This module is tested on Python 2.7.15 and is compatible with python
+      2.7 or later.
+    - ipmitool with lanplus support.
+'''
+import json
+import logging
+import os
+import re
+import subprocess
+import tempfile
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from lib import parsers
+
+
+log = logging.getLogger(__name__)
+
+# Concurrent BMCs
+WORKERS = 64
+
+# ipmitool session timeout (-N) and retries (-R), and the seconds after
+# which a BMC that still has not answered is given up on
+SESSION_TIMEOUT = 2
+RETRIES = 1
+DEADLINE = 30
+
+# Commands run in one session; mc info comes first, the FRU output begins
+# with its device description
+COMMANDS = ('mc info', 'fru print 0')
+FRU_START = re.compile(r'^FRU Device Description', re.M)
+
+# ipmitool errors meaning the BMC refused the credentials, as opposed to
+# not answering at all
+AUTH_ERROR = re.compile(
+    r'RAKP \d+ (HMAC|message) is invalid|unauthorized name|invalid user name|'
+    r'insufficient resources for session|Authentication type NONE not supported',
+    re.I)
+
+
+class IPMIError(Exception):
+    pass
+
+
+def load_credentials(path):
+    '''Return the credentials cache saved at path, or an empty one.'''
+    if not path:
+        return {}
+    path = os.path.expanduser(path)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except ValueError:
+        log.warning('Ignoring the corrupt credentials cache {}'.format(path))
+        return {}
+
+
+def save_credentials(path, cache):
+    '''Write the credentials cache to path atomically, readable by the owner
+    only.
+    '''
+    if not path:
+        return
+    path = os.path.expanduser(path)
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.ipmi', suffix='.tmp')
+    try:
+        os.chmod(tmp_path, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(cache, f)
+        os.rename(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _run(args, env, deadline):
+    '''Return (status, stdout, stderr) of args, killed after deadline seconds.'''
+    process = subprocess.Popen(args, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, env=env)
+    timer = threading.Timer(deadline, process.kill)
+    timer.start()
+    try:
+        stdout, stderr = process.communicate()
+    finally:
+        timer.cancel()
+    if not isinstance(stdout, str):
+        stdout, stderr = stdout.decode('utf-8', 'replace'), stderr.decode('utf-8', 'replace')
+    return process.returncode, stdout, stderr
+
+
+def query(host, username, password, script, ipmitool='ipmitool',
+          timeout=SESSION_TIMEOUT, retries=RETRIES, deadline=DEADLINE):
+    '''Return (mc info, fru) of one BMC, running script in exec mode.
+
+    Raises IPMIError, with auth set when the BMC refused the credentials.
+    '''
+    address, _, port = host.partition(':')
+    args = [ipmitool, '-I', 'lanplus', '-H', address, '-U', username, '-E',
+            '-N', str(timeout), '-R', str(retries)]
+    if port:
+        args += ['-p', port]
+    env = dict(os.environ, IPMI_PASSWORD=password)
+    status, stdout, stderr = _run(args + ['exec', script], env, deadline)
+    if status != 0 or not stdout.strip():
+        error = IPMIError((stderr.strip() or 'ipmitool exited with {}'.format(
+            status)).splitlines()[-1])
+        error.auth = bool(AUTH_ERROR.search(stderr))
+        raise error
+
+    # The parsers skip the echo of the command, as in a session's output
+    match = FRU_START.search(stdout)
+    split = match.start() if match else len(stdout)
+    mc = parsers.fru('mc info\n' + stdout[:split])
+    fru = parsers.fru('fru print 0\n' + stdout[split:])
+    return mc, fru
+
+
+def collect_host(host, credentials, script, cache=None, **options):
+    '''Return the record of one BMC.
+
+    The record has the host, the model (the board part number), the
+    firmware versions, the mc info and FRU fields, the user that logged in,
+    and the error if the BMC could not be read.  credentials are tried in
+    order, after the ones cached for host.
+    '''
+    started = time.time()
+    record = {'host': host, 'model': None, 'firmware': {}, 'names': {},
+              'mc': {}, 'fru': {}, 'user': None, 'error': None, 'attempts': 0}
+    cached = (cache or {}).get(host)
+    candidates = [tuple(cached)] if cached else []
+    candidates += [tuple(c) for c in credentials if tuple(c) not in candidates]
+
+    for username, password in candidates:
+        record['attempts'] += 1
+        try:
+            mc, fru = query(host, username, password, script, **options)
+        except IPMIError as e:
+            record['error'] = str(e)
+            if getattr(e, 'auth', False):
+                if cache is not None and cache.get(host) == [username, password]:
+                    cache.pop(host, None)
+                continue
+            break
+        record.update(mc=mc, fru=fru, user=username, error=None)
+        record['model'] = fru.get('Board Part Number') or fru.get('Board Product')
+        if mc.get('Firmware Revision'):
+            record['firmware']['BMC'] = mc['Firmware Revision']
+            record['names']['BMC'] = 'BMC Firmware'
+        if cache is not None:
+            cache[host] = [username, password]
+        break
+
+    if record['error']:
+        log.error('IPMI census of {} failed: {}'.format(host, record['error']))
+    record['elapsed'] = time.time() - started
+    return record
+
+
+def collect(hosts, credentials, workers=WORKERS, cache=None, **options):
+    '''Return the records of hosts, in the order of hosts.
+
+    credentials is a list of (username, password); cache the credentials
+    cache, updated with the credentials each BMC accepted.
+    '''
+    hosts = list(hosts)
+    if not hosts:
+        return []
+    fd, script = tempfile.mkstemp(prefix='ipmi_collector', suffix='.txt')
+    with os.fdopen(fd, 'w') as f:
+        f.write('\n'.join(COMMANDS) + '\n')
+    pool = ThreadPool(min(workers, len(hosts)))
+    started = time.time()
+    try:
+        records = pool.map(
+            lambda host: collect_host(host, credentials, script, cache=cache,
+                                      **options),
+            hosts, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+        os.remove(script)
+
+    log.debug('Collected {} BMCs in {:.2f} seconds, {} logins, {} failed'.format(
+        len(hosts), time.time() - started,
+        sum(r['attempts'] for r in records),
+        sum(1 for r in records if r['error'])))
+    return records
+
+
+def component_version(record, component):
+    '''Return the version of component ('BMC') in a census record.'''
+    return record['firmware'].get(component.upper())
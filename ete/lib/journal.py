@@ -0,0 +1,128 @@
+'''journal.py
+
+Durable journal of a fleet run, so a restarted run resumes where the last
+one stopped.
+
+Every state change of a component on a host is appended to a SQLite file
+in WAL mode, committed before the next step starts:
+
+    running -> success | failed | timeout | error
+
+A run that crashed leaves its in-flight components in 'running'.  On the
+next run with the same journal the rollout skips the components in
+'success', re-verifies the version of those left 'running' and updates
+everything else:
+
+    j = journal.Journal('~/fw_rollout.db')
+    controller = rollout.Rollout(nodes, ['BMC', 'BIOS'], runner, journal=j)
+
+The file is only appended to, so it doubles as the audit trail of the
+rollout: history() returns every transition of a host.
+
+Prerequisites:
+    - This module is tested on Python 2.7.15 and is compatible with python
+      2.7 or later.
+'''
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+
+log = logging.getLogger(__name__)
+
+RUNNING = 'running'
+SUCCESS = 'success'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    run_id    TEXT PRIMARY KEY,
+    started   REAL NOT NULL,
+    pid       INTEGER NOT NULL,
+    note      TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS events (
+    id        INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id    TEXT NOT NULL,
+    host      TEXT NOT NULL,
+    component TEXT NOT NULL,
+    state     TEXT NOT NULL,
+    detail    TEXT NOT NULL DEFAULT '',
+    at        REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_lookup ON events (host, component, id);
+'''
+
+
+class Journal(object):
+    '''SQLite backed, append-only journal of per-host, per-component states.'''
+
+    def __init__(self, path, run_id=None, note='', timeout=30):
+        self.path = os.path.expanduser(path)
+        self.run_id = run_id or uuid.uuid4().hex
+        self.lock = threading.Lock()
+
+        if not os.path.exists(self.path):
+            # Only the owner may read the audit trail, SQLite gives the WAL
+            # files the mode of the database
+            os.close(os.open(self.path, os.O_WRONLY | os.O_CREAT, 0o600))
+
+        # The rollout records from one thread per node of a wave
+        self.db = sqlite3.connect(self.path, timeout=timeout,
+                                  check_same_thread=False)
+        try:
+            self.db.execute('PRAGMA journal_mode=WAL')
+        except sqlite3.DatabaseError:
+            pass
+        # Each transition must be on disk before the step it records starts
+        self.db.execute('PRAGMA synchronous=FULL')
+        self.db.executescript(SCHEMA)
+        self.db.execute('INSERT INTO runs (run_id, started, pid, note) VALUES (?, ?, ?, ?)',
+                        (self.run_id, time.time(), os.getpid(), note))
+        self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def record(self, host, component, state, detail=''):
+        '''Append a state change of component on host.'''
+        with self.lock:
+            self.db.execute(
+                'INSERT INTO events (run_id, host, component, state, detail, at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (self.run_id, host, component, state, detail or '', time.time()))
+            self.db.commit()
+        log.debug('{} {} {}{}'.format(host, component, state,
+                                      ' ({})'.format(detail) if detail else ''))
+
+    def states(self):
+        '''Return {(host, component): state} of the last change of each.'''
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT host, component, state FROM events WHERE id IN '
+                '(SELECT MAX(id) FROM events GROUP BY host, component)').fetchall()
+        return dict(((host, component), state) for host, component, state in rows)
+
+    def state(self, host, component):
+        '''Return the last state of component on host, or None.'''
+        with self.lock:
+            row = self.db.execute(
+                'SELECT state FROM events WHERE host = ? AND component = ? '
+                'ORDER BY id DESC LIMIT 1', (host, component)).fetchone()
+        return row[0] if row else None
+
+    def history(self, host):
+        '''Return [(at, run_id, component, state, detail)] of host in order.'''
+        with self.lock:
+            return self.db.execute(
+                'SELECT at, run_id, component, state, detail FROM events '
+                'WHERE host = ? ORDER BY id', (host,)).fetchall()
+
+    def runs(self):
+        '''Return [(run_id, started, pid, note)] of the runs of the journal.'''
+        with self.lock:
+            return self.db.execute(
+                'SELECT run_id, started, pid, note FROM runs ORDER BY started').fetchall()
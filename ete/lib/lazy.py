@@ -0,0 +1,77 @@
+'''lazy.py
+
+Lazy imports for the heavy vendored packages.
+
+pexpect (with ptyprocess), requests and xmltodict take tens of milliseconds to
+import, which every updater used to pay even for --help or a dry run.  A lazy
+module stands in for the real one and imports it on the first attribute
+access:
+
+    pexpect = lazy.lazy_import('pexpect')
+    ...
+    except pexpect.TIMEOUT:       # pexpect is only imported here if needed
+
+Prerequisites:
+    - This module is tested on Python 2.7.15 and is compatible with python
+      2.7 or later.
+'''
+import importlib
+import logging
+import sys
+import types
+
+
+log = logging.getLogger(__name__)
+
+# Modules the updaters must not import before they are needed
+HEAVY_MODULES = ('pexpect', 'ptyprocess', 'requests', 'xmltodict')
+
+
+class LazyModule(types.ModuleType):
+    '''Module proxy that imports the real module on first attribute access.'''
+
+    def __init__(self, name):
+        super(LazyModule, self).__init__(name)
+        self.__dict__['_lazy_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_lazy_module']
+        if module is None:
+            module = importlib.import_module(self.__name__)
+            self.__dict__['_lazy_module'] = module
+            log.debug('Lazy import of {}'.format(self.__name__))
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_lazy_module'] is not None else 'not loaded'
+        return '<lazy module {!r} ({})>'.format(self.__name__, state)
+
+
+def lazy_import(name):
+    '''Return module name, imported on first use.
+
+    The real module is returned right away if it has already been imported.
+    '''
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return LazyModule(name)
+
+
+def is_loaded(name):
+    '''Return True if module name has really been imported.'''
+    return name in sys.modules
+
+
+def loaded_heavy_modules():
+    '''Return the HEAVY_MODULES imported so far.'''
+    return [name for name in HEAVY_MODULES if name in sys.modules]
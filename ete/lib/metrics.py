@@ -0,0 +1,265 @@
+'''metrics.py
+
+Prometheus textfile metrics for updater runs.
+
+The updaters count the commands they send, the bytes read from the pty, the
+expect timeouts, the flash and reboot wait durations and the final result per
+component.  At the end of the run the samples are written atomically to a
+directory read by the node_exporter textfile collector, or to any local
+directory when testing offline:
+
+    metrics.start(args.ip, 'BMC')
+    ...
+    metrics.set_result('success')
+    metrics.finish(args.metrics_dir)
+
+One file is kept per host and component.  Counters and histograms are added
+to the values already in that file so they keep increasing across runs the
+way Prometheus expects.
+
+Collection is off until start() is called, inc() and observe() then return
+immediately.
+
+Prerequisites:
+    - This module is tested on Python 2.7.15 and is compatible with python
+      2.7 or later.
+'''
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+
+log = logging.getLogger(__name__)
+
+# Upper bounds in seconds for the duration histograms
+DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 900, 1800, 3600)
+
+# name: (type, help, buckets)
+METRICS = {
+    'fw_update_commands_sent_total': (
+        'counter', 'Commands sent over the connection.', None),
+    'fw_update_pty_read_bytes_total': (
+        'counter', 'Bytes read from the pty.', None),
+    'fw_update_expect_timeouts_total': (
+        'counter', 'Expect calls that timed out.', None),
+    'fw_update_results_total': (
+        'counter', 'Updater runs by result.', None),
+    'fw_update_flash_duration_seconds': (
+        'histogram', 'Time spent flashing firmware.', DURATION_BUCKETS),
+    'fw_update_reboot_wait_duration_seconds': (
+        'histogram', 'Time spent waiting for reboots.', DURATION_BUCKETS),
+    'fw_update_last_run_timestamp_seconds': (
+        'gauge', 'Unix time the last run finished.', None),
+}
+
+# Phases recorded by timing_db.phase() that feed a histogram
+PHASE_HISTOGRAMS = {
+    'flash': 'fw_update_flash_duration_seconds',
+    'reboot_wait': 'fw_update_reboot_wait_duration_seconds',
+}
+
+_SAMPLE = re.compile(r'^([a-zA-Z_:][\w:]*)(\{.*\})?\s+(\S+)$')
+_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+class Registry(object):
+    '''Holds the samples of one run keyed by (sample name, labels).'''
+
+    def __init__(self, labels=None):
+        self.labels = dict(labels or {})
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def _key(self, name, labels):
+        merged = dict(self.labels)
+        merged.update(labels)
+        return (name, tuple(sorted(merged.items())))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.samples[key] = self.samples.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.samples[key] = value
+
+    def observe(self, name, value, **labels):
+        '''Add value to the histogram name.'''
+        buckets = METRICS[name][2]
+        with self.lock:
+            for bound in buckets:
+                key = self._key(name + '_bucket', dict(labels, le=str(bound)))
+                self.samples[key] = self.samples.get(key, 0) + (value <= bound)
+            for suffix, amount in (('_bucket', 1), ('_sum', value), ('_count', 1)):
+                extra = dict(labels, le='+Inf') if suffix == '_bucket' else labels
+                key = self._key(name + suffix, extra)
+                self.samples[key] = self.samples.get(key, 0) + amount
+
+    def merge(self, samples):
+        '''Add previously written counter and histogram samples.'''
+        with self.lock:
+            for key, value in samples.items():
+                if _metric_type(key[0]) == 'gauge':
+                    self.samples.setdefault(key, value)
+                else:
+                    self.samples[key] = self.samples.get(key, 0) + value
+
+    def render(self):
+        '''Return the samples in the Prometheus text exposition format.'''
+        by_metric = {}
+        with self.lock:
+            for (name, labels), value in self.samples.items():
+                by_metric.setdefault(_base_name(name), []).append((name, labels, value))
+
+        lines = []
+        for metric in sorted(by_metric):
+            kind, help_text, _ = METRICS.get(metric, ('untyped', metric, None))
+            lines.append('# HELP {} {}'.format(metric, help_text))
+            lines.append('# TYPE {} {}'.format(metric, kind))
+            for name, labels, value in sorted(by_metric[metric], key=_sort_key):
+                label_text = ','.join('{}="{}"'.format(k, _escape(v)) for k, v in labels)
+                lines.append('{}{} {}'.format(
+                    name, '{' + label_text + '}' if label_text else '',
+                    _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+def _base_name(name):
+    for suffix in ('_bucket', '_sum', '_count'):
+        if name.endswith(suffix) and name[:-len(suffix)] in METRICS:
+            return name[:-len(suffix)]
+    return name
+
+
+def _metric_type(name):
+    return METRICS.get(_base_name(name), ('untyped',))[0]
+
+
+def _sort_key(sample):
+    name, labels, _ = sample
+    labels = dict(labels)
+    le = labels.pop('le', None)
+    bound = float('inf') if le == '+Inf' else float(le) if le else 0
+    return (name, sorted(labels.items()), bound)
+
+
+def _escape(value):
+    return '{}'.format(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+
+def parse_textfile(path):
+    '''Return {(name, labels): value} of the samples in a textfile.'''
+    samples = {}
+    if not os.path.exists(path):
+        return samples
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            match = _SAMPLE.match(line)
+            if not match:
+                continue
+            name, label_text, value = match.groups()
+            labels = tuple(sorted(
+                (k, v.replace('\\n', '\n').replace('\\"', '"').replace('\\\\', '\\'))
+                for k, v in _LABEL.findall(label_text or '')))
+            try:
+                samples[(name, labels)] = float(value)
+            except ValueError:
+                pass
+    return samples
+
+
+def write_textfile(directory, registry, file_name):
+    '''Write registry to directory/file_name atomically.
+
+    The file is written to a hidden temporary file in the same directory and
+    renamed into place so node_exporter never reads a partial file.
+    '''
+    if '~' in directory:
+        directory = os.path.expanduser(directory)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    path = os.path.join(directory, file_name)
+    registry.merge(parse_textfile(path))
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + file_name, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(registry.render())
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+''' ------------------- Module level run used by updaters -------------------'''
+_run = {'registry': None, 'component': '', 'host': '', 'result': None}
+
+
+def start(host, component):
+    '''Start collecting metrics for this updater run.'''
+    _run.update(registry=Registry({'host': host, 'component': component}),
+                host=host, component=component, result=None)
+    return _run['registry']
+
+
+def inc(name, value=1, **labels):
+    registry = _run['registry']
+    if registry is not None:
+        registry.inc(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    registry = _run['registry']
+    if registry is not None:
+        registry.observe(name, value, **labels)
+
+
+def observe_phase(phase, elapsed):
+    '''Feed a timed phase into its histogram, if it has one.'''
+    name = PHASE_HISTOGRAMS.get(phase)
+    if name is not None:
+        observe(name, elapsed)
+
+
+def set_result(result):
+    '''Set the result of the run, eg. 'success' or 'timeout'.'''
+    _run['result'] = result
+
+
+def finish(directory=None):
+    '''Count the run result and write the textfile if directory is set.
+
+    A run that never called set_result() is counted as a failure, that is the
+    case for all the sys.exit(1) paths of the updaters.
+    '''
+    registry = _run['registry']
+    if registry is None:
+        return None
+    registry.inc('fw_update_results_total', result=_run['result'] or 'failure')
+    registry.set('fw_update_last_run_timestamp_seconds', time.time())
+
+    path = None
+    if directory:
+        file_name = 'fw_update_{}_{}.prom'.format(
+            _run['component'].lower(), re.sub(r'[^\w.-]', '_', _run['host']))
+        path = write_textfile(directory, registry, file_name)
+        log.debug('Metrics written to {}'.format(path))
+    _run.update(registry=None, component='', host='', result=None)
+    return path
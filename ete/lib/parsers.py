@@ -0,0 +1,286 @@
+'''parsers.py
+
+Parsers of the tool outputs the updaters take their inventory from.
+
+Each parser scans the output of one tool once, with a regular expression
+compiled at import, and returns a record:
+
+    fru(output)                 ipmitool fru
+        {'Board Product': 'X11DPT-B', 'Product Part Number': 'NX-1065-G6', ...}
+    dmidecode(output)           dmidecode -t baseboard, -t bios, ...
+        {'Base Board Information': {'Product Name': 'X11DPT-B', ...},
+         'BIOS Information': {'Version': 'PB20.000', ...}}
+    ipmicfg_ver(output)         ipmicfg -ver
+        {'version': '6.39'}
+    ipmicfg_tp_info(output)     ipmicfg -tp info
+        {'part_number': 'BPN-SAS3-827BHQ-N3', 'version': '1.10'}
+    sas3flash_listall(output)   sas3flash -listall
+        [{'index': 0, 'controller': 'SAS3008', 'channel': 'C0',
+          'fw_version': '16.00.01.00', 'nvdata': ..., 'bios': ..., 'pci_address': ...}]
+    sas3flash_list(output)      sas3flash -list
+        {'Board Name': 'LSI3008-IT', 'Firmware Version': '16.00.01.00', ...}
+    mlxup_query(output)         mlxup -query
+        [{'Part Number': 'MCX414A-BCA_Ax', 'PSID': ..., 'versions': {'FW': '12.18.1000', ...}}]
+    ethtool_i(output)           ethtool -i
+        {'bus-info': '0000:5e:00.0', 'firmware-version': '0x800006d1', 'etrack': '0x800006d1', ...}
+    lspci_vn(output)            lspci -vn
+        [{'slot': '5e:00.0', 'class': '0200', 'vendor': '8086', 'device': '1563',
+          'subsystem': '15d9:0920', 'driver': 'ixgbe'}]
+    grep_h(output)              grep -H . FILE...
+        {'/sys/class/dmi/id/board_name': ['X11DPT-B'], ...}
+
+Keys spelled as the tool prints them are its fields, as printed; lower case
+keys are values the parser derives.  The first line of an output is the
+echo of the command, as in Connection.output, and is never taken as a field.
+
+Records are memoized by a hash of the output, so the updaters that query
+the same tool twice (the part number, then the version) and the fleet
+reports parse an output once.  A record is shared by everyone parsing the
+same output and must not be modified.
+
+Prerequisites:
+    - This module is tested on Python 2.7.15 and is compatible with python
+      2.7 or later.
+'''
+import collections
+import functools
+import hashlib
+import logging
+import re
+import threading
+
+
+log = logging.getLogger(__name__)
+
+# Records kept, the least recently used one is dropped first
+CACHE_SIZE = 256
+
+_cache = collections.OrderedDict()
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+
+# 'key : value' of ipmitool, last one wins as with a dict built line by line
+_FRU = re.compile(r'^[ \t]*(.*?)[ \t]* : [ \t]*(.*?)[ \t]*\r?$', re.M)
+
+# 'key: value', the key without a colon
+_FIELD = re.compile(r'^[ \t]*([^\s:][^\r\n:]*?)[ \t]*:[ \t]*([^\r\n]*?)[ \t]*\r?$', re.M)
+
+# A handle and its title, or a field of its section (nested lines excluded)
+_DMI = re.compile(
+    r'^Handle 0x[0-9A-Fa-f]+, DMI type \d+[^\n]*\n(?P<title>[^\r\n]*?)[ \t]*\r?$'
+    r'|^\t(?P<key>[^\s:][^\r\n:]*?):[ \t]*(?P<value>[^\r\n]*?)[ \t]*\r?$', re.M)
+
+_IPMICFG_VER = re.compile(r'Ver\w*:[ \t]*(\d+[-.][^\r\n]*\d)', re.I)
+
+_IPMICFG_TP = re.compile(
+    r'(?P<part_number>BPN\S+)|MCU\s[^\r\n]*?(?P<version>\d+\.\d+)', re.I)
+
+_SAS3FLASH_ROW = re.compile(
+    r'^[ \t]*(\d+)[ \t]+(\w+)\((\w+)\)[ \t]+(\d+\.\d+\.\d+\.\d+)'
+    r'(?:[ \t]+(\S+))?(?:[ \t]+(\S+))?(?:[ \t]+(\S+))?', re.M)
+
+# A device header, a field, or a row of the versions table
+_MLXUP = re.compile(
+    r'^Device #(?P<device>\d+):'
+    r'|^[ \t]*(?P<key>[^\s:][^\r\n:]*?)[ \t]*:[ \t]*(?P<value>[^\r\n]*?)[ \t]*\r?$'
+    r'|^[ \t]+(?P<image>[A-Z][\w-]*)[ \t]+(?P<current>\S+)[ \t]+\S+[ \t]*\r?$', re.M)
+
+_ETRACK = re.compile(r'\b0x[0-9a-fA-F]+\b')
+
+# A device header, its subsystem, its driver
+_LSPCI = re.compile(
+    r'^(?P<slot>[0-9a-fA-F:]*[0-9a-fA-F]{2}:[0-9a-fA-F]{2}\.[0-7])[ \t]+'
+    r'(?P<class>[0-9a-f]{4}):[ \t]+(?P<vendor>[0-9a-f]{4}):(?P<device>[0-9a-f]{4})'
+    r'|^[ \t]+Subsystem:[ \t]+(?P<subsystem>[0-9a-f]{4}:[0-9a-f]{4})'
+    r'|^[ \t]+Kernel driver in use:[ \t]+(?P<driver>\S+)', re.M)
+
+# 'path:line', the file name starting with a letter so a ':' in a directory
+# name (a PCI slot) is not taken as the separator
+_GREP_H = re.compile(r'^(/[^\r\n]*?/[A-Za-z_][\w.-]*):([^\r\n]*?)\r?$', re.M)
+
+
+def _digest(output):
+    if not isinstance(output, bytes):
+        output = output.encode('utf-8')
+    return hashlib.sha1(output).digest()
+
+
+def memoized(parser):
+    '''Decorate parser(output) to return the record cached for output.'''
+    name = parser.__name__
+
+    @functools.wraps(parser)
+    def parse(output):
+        output = output or ''
+        key = (name, _digest(output))
+        with _lock:
+            record = _cache.pop(key, None)
+            if record is not None:
+                _cache[key] = record
+                _stats['hits'] += 1
+                return record
+            _stats['misses'] += 1
+        record = parser(output)
+        with _lock:
+            _cache[key] = record
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+        return record
+
+    return parse
+
+
+def cache_info():
+    '''Return the hits, misses and size of the record cache.'''
+    with _lock:
+        return dict(_stats, size=len(_cache))
+
+
+def cache_clear():
+    with _lock:
+        _cache.clear()
+        _stats.update(hits=0, misses=0)
+
+
+def _body(output):
+    '''Return the position after the echoed command, None without output.'''
+    start = output.find('\n')
+    return None if start < 0 else start + 1
+
+
+def _fields(output):
+    fields = {}
+    start = _body(output)
+    if start is not None:
+        for key, value in _FIELD.findall(output, start):
+            fields.setdefault(key, value)
+    return fields
+
+
+@memoized
+def fields(output):
+    '''Return the 'key: value' fields of output, the first one of a key wins.'''
+    return _fields(output)
+
+
+@memoized
+def fru(output):
+    '''Return the fields of ipmitool fru.'''
+    start = _body(output)
+    if start is None:
+        return {}
+    return dict(_FRU.findall(output, start))
+
+
+@memoized
+def dmidecode(output):
+    '''Return the fields of each section of dmidecode, by section title.
+
+    The first section with a title wins, as the first field of a section.
+    '''
+    sections = {}
+    section = None
+    for match in _DMI.finditer(output):
+        title, key, value = match.group('title', 'key', 'value')
+        if title is not None:
+            section = None if title in sections else sections.setdefault(title, {})
+        elif section is not None:
+            section.setdefault(key, value)
+    return sections
+
+
+@memoized
+def ipmicfg_ver(output):
+    '''Return the BMC firmware version of ipmicfg -ver.'''
+    match = _IPMICFG_VER.search(output)
+    return {'version': match.group(1) if match else None}
+
+
+@memoized
+def ipmicfg_tp_info(output):
+    '''Return the backplane part number and MCU version of ipmicfg -tp info.'''
+    record = {'part_number': None, 'version': None}
+    for match in _IPMICFG_TP.finditer(output):
+        for key in ('part_number', 'version'):
+            if record[key] is None and match.group(key):
+                record[key] = match.group(key)
+        if None not in record.values():
+            break
+    return record
+
+
+@memoized
+def sas3flash_listall(output):
+    '''Return the controllers listed by sas3flash -listall.'''
+    controllers = []
+    for row in _SAS3FLASH_ROW.findall(output):
+        index, controller, channel, fw_version, nvdata, bios, pci_address = row
+        controllers.append({
+            'index': int(index), 'controller': controller, 'channel': channel,
+            'fw_version': fw_version, 'nvdata': nvdata or None,
+            'bios': bios or None, 'pci_address': pci_address or None,
+        })
+    return controllers
+
+
+@memoized
+def sas3flash_list(output):
+    '''Return the fields of the controller selected by sas3flash -list.'''
+    return _fields(output)
+
+
+@memoized
+def mlxup_query(output):
+    '''Return the devices of mlxup -query, with their current versions.'''
+    devices = []
+    device = None
+    for match in _MLXUP.finditer(output):
+        if match.group('device'):
+            device = {'versions': {}}
+            devices.append(device)
+        elif device is None:
+            continue
+        elif match.group('key') is not None:
+            device.setdefault(match.group('key'), match.group('value'))
+        else:
+            device['versions'].setdefault(match.group('image'), match.group('current'))
+    return devices
+
+
+@memoized
+def ethtool_i(output):
+    '''Return the fields of ethtool -i, with the etrack id of the firmware.'''
+    record = _fields(output)
+    match = _ETRACK.search(record.get('firmware-version', ''))
+    record['etrack'] = match.group() if match else None
+    return record
+
+
+@memoized
+def lspci_vn(output):
+    '''Return the devices of lspci -vn.'''
+    devices = []
+    device = None
+    for match in _LSPCI.finditer(output):
+        if match.group('slot'):
+            device = {'slot': match.group('slot'), 'class': match.group('class'),
+                      'vendor': match.group('vendor'),
+                      'device': match.group('device'),
+                      'subsystem': None, 'driver': None}
+            devices.append(device)
+        elif device is not None:
+            for key in ('subsystem', 'driver'):
+                if match.group(key) and device[key] is None:
+                    device[key] = match.group(key)
+    return devices
+
+
+@memoized
+def grep_h(output):
+    '''Return the lines of each file printed by grep -H, by path.'''
+    files = {}
+    start = _body(output)
+    if start is not None:
+        for path, line in _GREP_H.findall(output, start):
+            files.setdefault(path, []).append(line)
+    return files
@@ -0,0 +1,287 @@
+'''recording.py
+
+Record and replay of sessions, with their timing.
+
+A Recorder writes every chunk a session sends or reads as one JSON line,
+with the seconds since the session started:
+
+    {"format": "fw_update-session", "version": 1, "started": 1539..., ...}
+    [0.0312, "r", "Last login: ...\\r\\n"]
+    [0.0824, "m", {"name": "login", "server": "10.1.1.12", "prompt": "[root@n1 ~]#"}]
+    [0.1337, "s", "dmidecode -t bios\\r"]
+    [0.1695, "r", "dmidecode -t bios\\r\\n# dmidecode 3.1\\r\\n..."]
+
+"s" is sent, "r" is read and "m" a mark left by the session (the end of
+the login, the close).  A send holding a secret, the password login()
+types, is recorded as [t, "s", null].  Bytes are stored as latin-1 text so
+any byte round-trips.  The connections record when built with record=path
+or when FW_UPDATE_RECORD_DIR is set, see lib/connection.py.
+
+ReplaySpawn is a pexpect spawn that reads a recording back: every read
+chunk is returned when it is due, the recorded delay after the send it
+followed, divided by speed (0 replays as fast as possible).  A chunk read
+after a send is not returned before the replaying side sent something in
+its place, so expect() sees the output in the same pieces and with the same
+timing as the original session did, and times out where it timed out.
+
+    spawn = recording.ReplaySpawn('~/logs/20181015T101200_session.jsonl', speed=10)
+    spawn.send('dmidecode -t bios\\r')
+    spawn.expect_exact('[root@n1 ~]#')
+
+Prerequisites:
+    - This module is tested on Python 2.7.15 and is compatible with python
+      2.7 or later.
+'''
+import io
+import json
+import logging
+import os
+import threading
+import time
+
+from pexpect.exceptions import EOF, ExceptionPexpect, TIMEOUT
+from pexpect.spawnbase import SpawnBase
+
+
+log = logging.getLogger(__name__)
+
+FORMAT = 'fw_update-session'
+VERSION = 1
+
+# Event kinds
+SEND, READ, MARK = 's', 'r', 'm'
+
+# Environment variable naming the directory the connections record to
+RECORD_DIR_ENV = 'FW_UPDATE_RECORD_DIR'
+
+
+class ReplayError(ExceptionPexpect):
+    pass
+
+
+def _text(data):
+    if isinstance(data, bytes):
+        return data.decode('latin-1')
+    return data
+
+
+def load(path):
+    '''Return (header, events) of a recording, events as (t, kind, data).'''
+    events = []
+    with io.open(os.path.expanduser(path), encoding='utf-8') as f:
+        header = json.loads(f.readline())
+        if header.get('format') != FORMAT:
+            raise ReplayError('{} is not a session recording'.format(path))
+        for line in f:
+            line = line.strip()
+            if line:
+                t, kind, data = json.loads(line)
+                events.append((t, kind, data))
+    return header, events
+
+
+class Recorder(object):
+    '''Append the events of one session to a JSON lines file.
+
+    Each event is flushed as it is written, a session that hangs or
+    crashes leaves its recording up to the last chunk.
+    '''
+
+    def __init__(self, path, **header):
+        self.path = os.path.expanduser(path)
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.file = io.open(self.path, 'a', encoding='utf-8')
+        header.update(format=FORMAT, version=VERSION, started=self.started,
+                      pid=os.getpid())
+        self._write(header)
+
+    def _write(self, item):
+        line = json.dumps(item, ensure_ascii=True, separators=(',', ':'))
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(_text(line) + u'\n')
+            self.file.flush()
+
+    def event(self, kind, data):
+        self._write([round(time.time() - self.started, 6), kind, data])
+
+    def send(self, data):
+        self.event(SEND, _text(data))
+
+    def redacted_send(self):
+        '''Record that something was sent without what it was.'''
+        self.event(SEND, None)
+
+    def read(self, data):
+        self.event(READ, _text(data))
+
+    def mark(self, name, **info):
+        info['name'] = name
+        self.event(MARK, info)
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+class ReplaySpawn(SpawnBase):
+    '''A spawn reading a recording back instead of a child process.
+
+    speed scales the recorded delays, 0 replays without waiting.  With
+    strict, sending something else than the recorded session sent raises
+    ReplayError; otherwise the difference is only logged.
+    '''
+
+    def __init__(self, path, speed=1.0, strict=False, timeout=30, maxread=2000,
+                 searchwindowsize=None, logfile=None, encoding=None,
+                 codec_errors='strict'):
+        super(ReplaySpawn, self).__init__(
+            timeout=timeout, maxread=maxread, searchwindowsize=searchwindowsize,
+            logfile=logfile, encoding=encoding, codec_errors=codec_errors)
+        self.path = path
+        self.header, self.events = load(path)
+        self.speed = speed
+        self.strict = strict
+        self.delaybeforesend = None
+        self.delayafterread = None
+        self.closed = False
+        self.terminated = False
+        self.name = '<replay {}>'.format(path)
+
+        # Next event, what is left of a read chunk returned in part, and the
+        # (wall clock, recording) times the reads are due relative to
+        self._pos = 0
+        self._rest = b''
+        self._anchor = (time.time(), 0.0)
+        # Index of each send event answered by send(), with its wall clock
+        self._sent = {}
+        self._next_send = 0
+        self.mismatches = 0
+
+    def _bytes(self, data):
+        # Stored as latin-1 text when the session read bytes, as text otherwise
+        if self.header.get('encoding'):
+            return data.encode(self.header['encoding'])
+        return data.encode('latin-1')
+
+    def marks(self, name=None):
+        '''Return [(index, info)] of the marks, of those named name.'''
+        return [(i, e[2]) for i, e in enumerate(self.events)
+                if e[1] == MARK and (name is None or e[2].get('name') == name)]
+
+    def skip_to(self, index):
+        '''Drop the events before index, as if they were replayed.'''
+        index = min(index, len(self.events))
+        for i in range(self._pos, index):
+            if self.events[i][1] == SEND:
+                self._sent.setdefault(i, time.time())
+        self._next_send = max(self._next_send, index)
+        self._pos = index
+        self._rest = b''
+        self._anchor = (time.time(), self.events[index - 1][0] if index else 0.0)
+
+    def _due(self, t):
+        wall, recorded = self._anchor
+        if not self.speed:
+            return wall
+        return wall + (t - recorded) / float(self.speed)
+
+    def _wait(self, seconds, timeout):
+        '''Sleep seconds, or raise TIMEOUT if that is longer than timeout.
+
+        seconds is None when the recording waits for a send, which would
+        never come.
+        '''
+        if seconds is None or (timeout is not None and seconds > timeout):
+            if self.speed and timeout:
+                time.sleep(max(timeout, 0))
+            raise TIMEOUT('Timeout exceeded replaying {}'.format(self.path))
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def read_nonblocking(self, size=1, timeout=-1):
+        '''Return the next recorded chunk once it is due.
+
+        Raises TIMEOUT when it is not due within timeout, or when the
+        recorded session waited for a send that was not made; EOF at the
+        end of the recording.
+        '''
+        if timeout == -1:
+            timeout = self.timeout
+        if not self._rest:
+            while True:
+                if self._pos >= len(self.events):
+                    self.flag_eof = True
+                    raise EOF('End of the recording {}'.format(self.path))
+                t, kind, data = self.events[self._pos]
+                if kind == MARK:
+                    self._pos += 1
+                    continue
+                if kind == SEND:
+                    if self._pos not in self._sent:
+                        # The recorded session is waiting for input
+                        self._wait(None, timeout)
+                    # What follows a send is due relative to it
+                    self._anchor = (self._sent[self._pos], t)
+                    self._pos += 1
+                    continue
+                self._wait(self._due(t) - time.time(), timeout)
+                self._rest = self._bytes(data)
+                self._pos += 1
+                break
+        data, self._rest = self._rest[:size], self._rest[size:]
+        s = self._decoder.decode(data, final=False)
+        self._log(s, 'read')
+        return s
+
+    def send(self, s):
+        '''Answer the next recorded send.'''
+        s = self._coerce_send_string(s)
+        self._log(s, 'send')
+        b = self._encoder.encode(s, final=False)
+
+        index = self._next_send
+        while index < len(self.events) and self.events[index][1] != SEND:
+            index += 1
+        if index >= len(self.events):
+            self._mismatch('{!r} sent after the recorded session ended'.format(s))
+            return len(b)
+        # A redacted send matches whatever is sent in its place
+        recorded = self.events[index][2]
+        if recorded is not None and self._bytes(recorded) != b:
+            self._mismatch('sent {!r}, the recorded session sent {!r}'.format(
+                b, self._bytes(recorded)))
+        self._sent[index] = time.time()
+        self._next_send = index + 1
+        return len(b)
+
+    def _mismatch(self, message):
+        self.mismatches += 1
+        if self.strict:
+            raise ReplayError(message)
+        log.debug('Replay of {}: {}'.format(self.path, message))
+
+    def sendline(self, s=''):
+        s = self._coerce_send_string(s)
+        return self.send(s + self.linesep)
+
+    def write(self, s):
+        self.send(s)
+
+    def writelines(self, sequence):
+        for s in sequence:
+            self.send(s)
+
+    def sendeof(self):
+        pass
+
+    def isalive(self):
+        return not self.closed and (self._rest or self._pos < len(self.events))
+
+    def close(self, force=True):
+        self.closed = True
+        self.terminated = True
@@ -0,0 +1,478 @@
+'''redfish.py
+
+Out-of-band firmware updates through the BMC's Redfish UpdateService.
+
+The in-band updaters need an SSH session to the host OS to run sumtool and
+ipmicfg.  This client talks to the BMC directly, so nodes whose OS is down or
+not installed yet can still be flashed:
+
+    client = redfish.RedfishClient('https://10.1.2.3', 'ADMIN', 'ADMIN')
+    version = client.firmware_version('BMC')
+    task = client.update_firmware(BMC.BMC_FW_FILES[(part, version)])
+    client.wait_task(task)
+    client.wait_reset('BMC', previous=version)
+
+The image is streamed to the HttpPushUri in chunks with chunked transfer
+encoding, it is never read into memory as a whole.  All the clients share one
+Session that keeps a pool of keep-alive connections per BMC, so the task
+polling and consecutive hosts reuse their connections instead of paying a TCP
+and TLS handshake per request.
+
+The client is written on httplib: the vendored requests comes without its
+urllib3, chardet, idna and certifi dependencies and cannot be imported.
+
+Prerequisites:
+    - This module is tested on Python 2.7.15 and is compatible with python
+      2.7 or later.
+'''
+import base64
+import httplib
+import json
+import logging
+import os
+import socket
+import ssl
+import threading
+import time
+import urlparse
+from collections import OrderedDict
+
+
+log = logging.getLogger(__name__)
+
+SERVICE_ROOT = '/redfish/v1/'
+
+# Size of the image chunks streamed to the BMC
+CHUNK_SIZE = 64 * 1024
+
+# Number of BMCs and connections per BMC kept in the shared pool
+POOL_CONNECTIONS = 16
+POOL_MAXSIZE = 4
+
+# Task states, see the Redfish Task schema
+TASK_DONE = ('Completed',)
+TASK_FAILED = ('Exception', 'Killed', 'Cancelled', 'Interrupted')
+
+
+class RedfishError(Exception):
+    pass
+
+
+class Response(object):
+    '''Status, headers and body of an HTTP response.
+
+    headers is the httplib message, its get() ignores the case of the name.
+    '''
+
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', 'replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class Session(object):
+    '''Pool of keep-alive HTTP and HTTPS connections.
+
+    Up to pool_maxsize idle connections are kept for each of pool_connections
+    hosts, the least recently used host pool is dropped when more hosts are
+    contacted.  A Session can be shared by threads, a connection is only used
+    by one request at a time.
+    '''
+
+    def __init__(self, pool_connections=POOL_CONNECTIONS,
+                 pool_maxsize=POOL_MAXSIZE):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.headers = {'Accept': 'application/json', 'OData-Version': '4.0'}
+        self._idle = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _connect(self, key, timeout, verify):
+        scheme, host, port = key
+        if scheme == 'http':
+            return httplib.HTTPConnection(host, port, timeout=timeout)
+        try:
+            context = (ssl.create_default_context() if verify
+                       else ssl._create_unverified_context())
+        except AttributeError:
+            # Before 2.7.9 httplib does not check certificates anyway
+            return httplib.HTTPSConnection(host, port, timeout=timeout)
+        return httplib.HTTPSConnection(host, port, timeout=timeout,
+                                       context=context)
+
+    def _checkout(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop()
+        return None
+
+    def _checkin(self, key, conn):
+        with self._lock:
+            idle = self._idle.pop(key, [])
+            if len(idle) < self.pool_maxsize:
+                idle.append(conn)
+                conn = None
+            self._idle[key] = idle
+            dropped = []
+            while len(self._idle) > self.pool_connections:
+                dropped.extend(self._idle.popitem(last=False)[1])
+        for stale in dropped + [conn]:
+            if stale is not None:
+                stale.close()
+
+    def request(self, method, url, auth=None, verify=False, timeout=30,
+                headers=None, data=None):
+        '''Send a request and return its Response.
+
+        data is a string or an iterable of strings, the latter is sent with
+        Transfer-Encoding: chunked.  Raises socket.error and
+        httplib.HTTPException on connection and protocol errors.
+        '''
+        parts = urlparse.urlsplit(url)
+        key = (parts.scheme, parts.hostname,
+               parts.port or (443 if parts.scheme == 'https' else 80))
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        all_headers = dict(self.headers, **(headers or {}))
+        if auth:
+            all_headers['Authorization'] = 'Basic ' + base64.b64encode(
+                '{}:{}'.format(*auth))
+
+        conn = self._checkout(key)
+        # A pooled connection may have been closed by the BMC meanwhile, a
+        # request that is safe to resend gets one retry on a new connection
+        retry = conn is not None and (data is None or isinstance(data, str))
+        while True:
+            if conn is None:
+                conn = self._connect(key, timeout, verify)
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            try:
+                _send(conn, method, path, all_headers, data)
+                response = conn.getresponse()
+                content = response.read()
+                break
+            except (socket.error, httplib.HTTPException):
+                conn.close()
+                if not retry:
+                    raise
+                retry, conn = False, None
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._checkin(key, conn)
+        return Response(response.status, response.msg, content)
+
+    def close(self):
+        '''Close the idle connections.'''
+        with self._lock:
+            idle, self._idle = self._idle, OrderedDict()
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+def _send(conn, method, path, headers, data):
+    if data is None or isinstance(data, str):
+        conn.request(method, path, data, headers)
+        return
+    conn.putrequest(method, path, skip_accept_encoding=True)
+    for name, value in headers.items():
+        conn.putheader(name, value)
+    conn.putheader('Transfer-Encoding', 'chunked')
+    conn.endheaders()
+    for chunk in data:
+        if chunk:
+            conn.send('{:x}\r\n{}\r\n'.format(len(chunk), chunk))
+    conn.send('0\r\n\r\n')
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def make_session(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE):
+    '''Return a new Session for Redfish requests.'''
+    return Session(pool_connections, pool_maxsize)
+
+
+def get_session(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE):
+    '''Return the Session shared by all the clients of this process.'''
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = make_session(pool_connections, pool_maxsize)
+        return _session
+
+
+def close_session():
+    '''Close the pooled connections of the shared Session.'''
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def base_url(address):
+    '''Return the URL of a BMC given as an IP, host:port or full URL.'''
+    if '://' not in address:
+        address = 'https://' + address
+    return address.rstrip('/')
+
+
+def read_chunks(path, chunk_size=CHUNK_SIZE, progress=None):
+    '''Yield the content of path in chunks of chunk_size bytes.
+
+    progress is called with (bytes sent, total bytes) after every chunk.
+    '''
+    total = os.path.getsize(path)
+    sent = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            sent += len(chunk)
+            yield chunk
+            if progress is not None:
+                progress(sent, total)
+
+
+def find_component(inventory, component):
+    '''Return the FirmwareInventory resource of component ('BMC', 'BIOS').
+
+    Members match by Id or by a Name starting with the component, eg. 'BMC'
+    or 'BIOS Firmware'.  Returns None if there is no such member.
+    '''
+    component = component.upper()
+    for member_id, resource in sorted(inventory.items()):
+        names = (member_id.upper(), resource.get('Name', '').upper())
+        if any(name == component or name.startswith(component + ' ')
+               for name in names):
+            return resource
+    return None
+
+
+class RedfishClient(object):
+    '''Client of one BMC's Redfish service.
+
+    etags is an optional {url: [etag, resource]} cache, possibly shared by
+    several clients.  When given, GETs are sent with If-None-Match and a 304
+    answer returns the cached resource without transferring it again.
+    '''
+
+    def __init__(self, address, username, password, session=None,
+                 verify=False, timeout=30, etags=None):
+        self.url = base_url(address)
+        self.auth = (username, password)
+        self.session = session or get_session()
+        self.verify = verify
+        self.timeout = timeout
+        self.etags = etags
+        self.stats = {'requests': 0, 'not_modified': 0}
+
+    def _url(self, uri):
+        if uri.startswith('http://') or uri.startswith('https://'):
+            return uri
+        return self.url + uri
+
+    def request(self, method, uri, expect=(200,), **kwargs):
+        '''Send a request and return the response.
+
+        Raises RedfishError if the request fails or the status code is not
+        in expect.
+        '''
+        kwargs.setdefault('auth', self.auth)
+        kwargs.setdefault('verify', self.verify)
+        kwargs.setdefault('timeout', self.timeout)
+        self.stats['requests'] += 1
+        try:
+            response = self.session.request(method, self._url(uri), **kwargs)
+        except (socket.error, httplib.HTTPException) as e:
+            raise RedfishError('{} {} failed: {}'.format(method, uri, e))
+        if response.status_code not in expect:
+            raise RedfishError('{} {} returned {}: {}'.format(
+                method, uri, response.status_code, _message(response)))
+        return response
+
+    def get(self, uri, **kwargs):
+        '''Return the JSON resource at uri.'''
+        if self.etags is None:
+            return self.request('GET', uri, **kwargs).json()
+
+        url = self._url(uri)
+        cached = self.etags.get(url)
+        if cached:
+            kwargs['headers'] = dict(kwargs.get('headers') or {},
+                                     **{'If-None-Match': cached[0]})
+        response = self.request('GET', uri, expect=(200, 304), **kwargs)
+        if response.status_code == 304 and cached:
+            self.stats['not_modified'] += 1
+            return cached[1]
+        resource = response.json()
+        etag = response.headers.get('ETag')
+        if etag:
+            self.etags[url] = [etag, resource]
+        return resource
+
+    def members(self, uri):
+        '''Return the @odata.id of the members of the collection at uri.'''
+        return [m['@odata.id'] for m in self.get(uri).get('Members', [])]
+
+    ''' ------------------------------ Inventory ------------------------------'''
+    def board_model(self):
+        '''Return the baseboard model, eg. X11DPT-B.'''
+        for uri in self.members(SERVICE_ROOT + 'Systems'):
+            model = self.get(uri).get('Model')
+            if model:
+                return model.strip()
+        raise RedfishError('No system reports a model on {}'.format(self.url))
+
+    def firmware_inventory(self, expand=False):
+        '''Return {Id: resource} of the FirmwareInventory members.
+
+        With expand the members are requested inline with $expand, which
+        costs one request instead of one per member.  Services that ignore
+        $expand return plain links and the members are fetched one by one.
+        '''
+        uri = SERVICE_ROOT + 'UpdateService/FirmwareInventory'
+        if expand:
+            uri += '?$expand=.($levels=1)'
+        inventory = {}
+        for member in self.get(uri).get('Members', []):
+            link = member['@odata.id']
+            resource = member if 'Version' in member else self.get(link)
+            inventory[resource.get('Id', link.rsplit('/', 1)[-1])] = resource
+        return inventory
+
+    def firmware_version(self, component):
+        '''Return the version of component ('BMC', 'BIOS') as reported by
+        the FirmwareInventory.'''
+        resource = find_component(self.firmware_inventory(), component)
+        if resource is None:
+            raise RedfishError('No {} firmware in the inventory of {}'.format(
+                component, self.url))
+        return resource.get('Version')
+
+    ''' ------------------------------- Update --------------------------------'''
+    def push_uri(self):
+        '''Return the HttpPushUri of the UpdateService.'''
+        service = self.get(SERVICE_ROOT + 'UpdateService')
+        if not service.get('ServiceEnabled', True):
+            raise RedfishError('UpdateService is disabled on {}'.format(self.url))
+        uri = service.get('HttpPushUri')
+        if not uri:
+            raise RedfishError('UpdateService on {} has no HttpPushUri'.format(self.url))
+        return uri
+
+    def update_firmware(self, file_name, chunk_size=CHUNK_SIZE, timeout=None):
+        '''Stream the image file_name to the UpdateService.
+
+        Returns the URI of the task monitoring the update, or None if the BMC
+        finished the update synchronously.
+        '''
+        if not os.path.isfile(file_name):
+            raise RedfishError('Firmware file {} not found'.format(file_name))
+        uri = self.push_uri()
+        size = os.path.getsize(file_name)
+        log.debug('Uploading {} ({} bytes) to {}{}'.format(file_name, size, self.url, uri))
+
+        def progress(sent, total):
+            if sent == total or sent % (chunk_size * 256) == 0:
+                log.debug('Uploaded {}/{} bytes'.format(sent, total))
+
+        # A generator body is sent with Transfer-Encoding: chunked
+        response = self.request(
+            'POST', uri, expect=(200, 201, 202, 204),
+            data=read_chunks(file_name, chunk_size, progress),
+            headers={'Content-Type': 'application/octet-stream'},
+            timeout=timeout or max(self.timeout, 600))
+        return self._task_uri(response)
+
+    def _task_uri(self, response):
+        location = response.headers.get('Location')
+        if location:
+            return location
+        if response.content:
+            try:
+                body = response.json()
+            except ValueError:
+                return None
+            return body.get('@odata.id') if 'TaskState' in body else None
+        return None
+
+    def wait_task(self, task_uri, timeout=1800, interval=5):
+        '''Poll the task at task_uri until it completes.
+
+        Returns the final task resource, raises RedfishError if the task
+        failed or did not finish within timeout seconds.
+        '''
+        if not task_uri:
+            return None
+        deadline = time.time() + timeout
+        while True:
+            response = self.request('GET', task_uri, expect=(200, 202))
+            task = response.json() if response.content else {}
+            state = task.get('TaskState', 'Running' if response.status_code == 202 else 'Completed')
+            log.debug('Task {} is {} {}%'.format(task_uri, state, task.get('PercentComplete', '-')))
+            if state in TASK_DONE:
+                if task.get('TaskStatus') == 'Critical':
+                    raise RedfishError('Task {} failed: {}'.format(
+                        task_uri, _task_messages(task)))
+                return task
+            if state in TASK_FAILED:
+                raise RedfishError('Task {} ended {}: {}'.format(
+                    task_uri, state, _task_messages(task)))
+            if time.time() > deadline:
+                raise RedfishError('Task {} still {} after {} seconds'.format(
+                    task_uri, state, timeout))
+            time.sleep(interval)
+
+    def wait_reset(self, component='BMC', previous=None, timeout=600, interval=10):
+        '''Wait until the BMC is back from the reset following an update.
+
+        The service still answers when the update task completes, the BMC
+        resets afterwards.  The reset is over once the service stopped
+        answering and answers again, or once component reports a version
+        other than previous.  Returns the version of component.
+        '''
+        deadline = time.time() + timeout
+        down = False
+        while True:
+            try:
+                version = self.firmware_version(component)
+                if down or (previous is not None and version != previous):
+                    return version
+            except RedfishError as e:
+                log.debug('Waiting for {} to reset: {}'.format(self.url, e))
+                down = True
+            if time.time() > deadline:
+                raise RedfishError('{} did not {} within {} seconds'.format(
+                    self.url, 'come back' if down else 'reset', timeout))
+            time.sleep(interval)
+
+
+def _message(response):
+    '''Return the error message of a Redfish error response.'''
+    try:
+        error = response.json().get('error', {})
+    except ValueError:
+        return response.text[:200]
+    extended = error.get('@Message.ExtendedInfo') or [{}]
+    return extended[0].get('Message') or error.get('message', '')
+
+
+def _task_messages(task):
+    return '; '.join(m.get('Message', '') for m in task.get('Messages', []))
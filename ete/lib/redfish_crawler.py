@@ -0,0 +1,138 @@
+'''redfish_crawler.py
+
+Bulk firmware inventory of many BMCs over Redfish.
+
+A compliance sweep needs the model and the FirmwareInventory of every BMC in
+the fleet.  Done one node at a time that is one GET per component per node,
+each paying its own connection setup.  The crawler instead:
+
+    - fetches the BMCs concurrently from a thread pool,
+    - shares one redfish.Session that keeps a connection pool per BMC
+      (pool_connections = number of hosts, so no pool is evicted during the
+      sweep, pool_maxsize = connections per host),
+    - asks for the FirmwareInventory members inline with $expand, falling
+      back to per-member GETs on services that ignore it,
+    - sends conditional GETs from an ETag cache kept between sweeps, so
+      unchanged resources cost a 304 without a body.
+
+    etags = redfish_crawler.load_etags('~/.cache/redfish_etags.json')
+    for record in redfish_crawler.crawl(hosts, 'ADMIN', 'ADMIN', etags=etags):
+        print(record['host'], record['model'], record['firmware'])
+    redfish_crawler.save_etags('~/.cache/redfish_etags.json', etags)
+
+Prerequisites:
+    - This module is tested on Python 2.7.15 and is compatible with python
+      2.7 or later.
+'''
+import json
+import logging
+import os
+import tempfile
+import time
+from multiprocessing.pool import ThreadPool
+
+from lib import redfish
+
+
+log = logging.getLogger(__name__)
+
+# Concurrent BMCs and keep-alive connections kept per BMC
+WORKERS = 32
+CONNECTIONS_PER_HOST = 2
+
+
+def load_etags(path):
+    '''Return the ETag cache saved at path, or an empty one.'''
+    if not path:
+        return {}
+    path = os.path.expanduser(path)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except ValueError:
+        log.warning('Ignoring the corrupt ETag cache {}'.format(path))
+        return {}
+
+
+def save_etags(path, etags):
+    '''Write the ETag cache to path atomically.'''
+    if not path:
+        return
+    path = os.path.expanduser(path)
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.etags', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(etags, f)
+        os.rename(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def crawl_host(address, username, password, session=None, etags=None,
+               expand=True):
+    '''Return the inventory record of one BMC.
+
+    The record has the host, the model, {member Id: version} of the
+    FirmwareInventory, the request counts and the error if the crawl failed.
+    '''
+    started = time.time()
+    client = redfish.RedfishClient(address, username, password,
+                                   session=session, etags=etags)
+    record = {'host': address, 'model': None, 'firmware': {}, 'error': None}
+    try:
+        record['model'] = client.board_model()
+        inventory = client.firmware_inventory(expand=expand)
+        record['firmware'] = dict((member_id, resource.get('Version'))
+                                  for member_id, resource in inventory.items())
+        record['names'] = dict((member_id, resource.get('Name', member_id))
+                               for member_id, resource in inventory.items())
+    except redfish.RedfishError as e:
+        log.error('Inventory of {} failed: {}'.format(address, e))
+        record['error'] = str(e)
+    record.update(requests=client.stats['requests'],
+                  not_modified=client.stats['not_modified'],
+                  elapsed=time.time() - started)
+    return record
+
+
+def crawl(hosts, username, password, workers=WORKERS, etags=None,
+          expand=True, connections_per_host=CONNECTIONS_PER_HOST):
+    '''Return the inventory records of hosts, in the order of hosts.'''
+    hosts = list(hosts)
+    if not hosts:
+        return []
+    session = redfish.make_session(pool_connections=len(hosts),
+                                   pool_maxsize=connections_per_host)
+    pool = ThreadPool(min(workers, len(hosts)))
+    started = time.time()
+    try:
+        records = pool.map(
+            lambda host: crawl_host(host, username, password, session=session,
+                                    etags=etags, expand=expand),
+            hosts, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+        session.close()
+
+    log.debug('Crawled {} BMCs in {:.2f} seconds, {} requests, {} not modified'.format(
+        len(hosts), time.time() - started,
+        sum(r['requests'] for r in records),
+        sum(r['not_modified'] for r in records)))
+    return records
+
+
+def component_version(record, component):
+    '''Return the version of component ('BMC', 'BIOS') in a crawl record.'''
+    inventory = dict((member_id, {'Name': record.get('names', {}).get(member_id, ''),
+                                  'Version': version})
+                     for member_id, version in record['firmware'].items())
+    resource = redfish.find_component(inventory, component)
+    return resource['Version'] if resource else None
@@ -0,0 +1,372 @@
+'''rollout.py
+
+Rolling-wave rollout of firmware updates with a failure budget.
+
+Instead of updating a whole fleet at once, the nodes are updated in waves:
+a canary wave first, then batches growing by a factor after every clean
+wave.  A wave never holds more than max_per_rack nodes of one rack or
+max_per_pdu nodes of one PDU, so a bad image cannot take down a rack or a
+power feed at once.  Failures are counted against a budget:
+
+    - a failed canary halts the rollout,
+    - a wave failing more than slow_failure_rate of its nodes shrinks the
+      next batches (the rollout is 'slowed'),
+    - more than max_failures failed nodes, or a failure rate over
+      max_failure_rate once min_samples nodes ran, halts it ('halted').
+      The nodes not started yet are reported as 'skipped'.
+
+The updates themselves are run by a runner, runner(host, component), which
+returns a dict with a 'status' of 'success' or anything else for a failure.
+The default ScriptRunner runs the updater scripts; tests pass a function
+instead:
+
+    nodes = rollout.load_inventory('rack12.txt')
+    controller = rollout.Rollout(nodes, ['BMC', 'BIOS'],
+                                 rollout.ScriptRunner('root', 'nutanix/4u'),
+                                 max_per_rack=4, max_failures=3)
+    summary = controller.run()
+
+With a journal.Journal the state of every component is recorded durably as
+it changes.  A rollout restarted on the same journal skips the nodes and
+components already updated.  Components left 'running' by a crash are
+checked with verify(host, component), when given, and updated again if it
+does not confirm the new version; the updater scripts check the installed
+version themselves before flashing.
+
+Prerequisites:
+    - This module is tested on Python 2.7.15 and is compatible with python
+      2.7 or later.
+'''
+import logging
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from lib import journal
+
+
+log = logging.getLogger(__name__)
+
+# Updater script of each component, in ete/fw_update
+SCRIPTS = {
+    'BMC': 'update_bmc_fw.py',
+    'BIOS': 'update_bios_fw.py',
+    'NIC': 'update_nic_fw.py',
+    'MLX': 'update_mlx_fw.py',
+    'HBA': 'update_hba_fw.py',
+    'MCU': 'update_mcu_fw.py',
+    # Every component in one session, see update_all_fw.py
+    'ALL': 'update_all_fw.py',
+}
+SCRIPTS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            'fw_update')
+
+# Output of an updater that failed without a non-zero exit status
+FAILURE_OUTPUT = re.compile(r'^\*\*\* Timeout occurred|^Traceback ', re.M)
+
+SUCCESS = 'success'
+
+
+class RolloutError(Exception):
+    pass
+
+
+class Node(object):
+    '''A host to update and the rack and PDU it is in.'''
+
+    __slots__ = ('host', 'rack', 'pdu')
+
+    def __init__(self, host, rack=None, pdu=None):
+        self.host = host
+        self.rack = rack
+        self.pdu = pdu
+
+    def __repr__(self):
+        return 'Node({0!r}, rack={1!r}, pdu={2!r})'.format(self.host, self.rack, self.pdu)
+
+
+def load_inventory(path):
+    '''Return the nodes listed in path.
+
+    One node per line, the host followed by optional rack=<name> and
+    pdu=<name> fields.  Text after '#' is ignored.
+    '''
+    nodes = []
+    with open(os.path.expanduser(path)) as f:
+        for number, line in enumerate(f, 1):
+            fields = line.split('#', 1)[0].split()
+            if not fields:
+                continue
+            labels = {}
+            for field in fields[1:]:
+                key, sep, value = field.partition('=')
+                if not sep or key not in ('rack', 'pdu'):
+                    raise RolloutError('{0}:{1}: unknown field {2!r}'.format(
+                        path, number, field))
+                labels[key] = value
+            nodes.append(Node(fields[0], **labels))
+    return nodes
+
+
+class ScriptRunner(object):
+    '''Run the updater script of a component against a host.
+
+    The output and logs of every run go to log_dir/<host>/, which is also
+    the working directory of the script so concurrent runs do not share
+    their debug logs.  A run fails if the script exits with a non-zero
+    status, prints a timeout or a traceback, or runs longer than timeout
+    seconds.
+    '''
+
+    def __init__(self, username, password, extra_args=(), timeout=3600,
+                 log_dir='~/logs/rollout', python=sys.executable):
+        self.username = username
+        self.password = password
+        self.extra_args = list(extra_args)
+        self.timeout = timeout
+        self.log_dir = os.path.expanduser(log_dir)
+        self.python = python
+
+    def command(self, host, component):
+        script = os.path.join(SCRIPTS_PATH, SCRIPTS[component])
+        return [self.python, script, '--ip', host, '--username', self.username,
+                '--password', self.password,
+                '--log', '{0}_{1}.log'.format(host, component.lower())] + self.extra_args
+
+    def __call__(self, host, component):
+        if component not in SCRIPTS:
+            raise RolloutError('No updater for component {0}'.format(component))
+        cwd = os.path.join(self.log_dir, host)
+        if not os.path.exists(cwd):
+            os.makedirs(cwd)
+        output_path = os.path.join(cwd, '{0}_output.log'.format(component.lower()))
+
+        started = time.time()
+        killed = []
+        with open(output_path, 'wb') as output:
+            process = subprocess.Popen(self.command(host, component), cwd=cwd,
+                                       stdout=output, stderr=subprocess.STDOUT)
+            timer = threading.Timer(self.timeout, lambda: killed.append(process.kill()))
+            timer.start()
+            try:
+                returncode = process.wait()
+            finally:
+                timer.cancel()
+        elapsed = time.time() - started
+
+        with open(output_path) as output:
+            text = output.read()
+        if killed:
+            status, detail = 'timeout', 'killed after {0} seconds'.format(self.timeout)
+        elif returncode != 0:
+            status, detail = 'failed', 'exit status {0}'.format(returncode)
+        elif FAILURE_OUTPUT.search(text):
+            status, detail = 'failed', FAILURE_OUTPUT.search(text).group(0).strip()
+        else:
+            status, detail = SUCCESS, ''
+        return {'status': status, 'detail': detail, 'elapsed': elapsed,
+                'output': output_path}
+
+
+class Rollout(object):
+    '''Update nodes in waves, stopping when the failure budget is spent.'''
+
+    def __init__(self, nodes, components, runner, canary=1, growth=2,
+                 max_batch=32, max_per_rack=None, max_per_pdu=None,
+                 max_failures=None, max_failure_rate=0.1, min_samples=5,
+                 slow_failure_rate=0.0, pause=0, on_result=None,
+                 journal=None, verify=None):
+        if not nodes:
+            raise RolloutError('No node to update')
+        hosts = [node.host for node in nodes]
+        if len(set(hosts)) != len(hosts):
+            raise RolloutError('Duplicate hosts in the inventory')
+        self.nodes = list(nodes)
+        self.components = list(components)
+        self.runner = runner
+        self.canary = max(1, canary)
+        self.growth = max(1, growth)
+        self.max_batch = max(1, max_batch)
+        self.max_per_rack = max_per_rack
+        self.max_per_pdu = max_per_pdu
+        self.max_failures = max_failures
+        self.max_failure_rate = max_failure_rate
+        self.min_samples = min_samples
+        self.slow_failure_rate = slow_failure_rate
+        self.pause = pause
+        self.on_result = on_result
+        self.journal = journal
+        self.verify = verify
+
+        self.state = 'pending'
+        self.reason = None
+        self.waves = []
+        self.results = {}
+
+    ''' ------------------------------ Budget -------------------------------'''
+    def failed(self):
+        return [h for h, r in self.results.items() if r['status'] != SUCCESS]
+
+    def budget_exceeded(self):
+        '''Return why the failure budget is spent, or None.'''
+        failures = len(self.failed())
+        if self.max_failures is not None and failures > self.max_failures:
+            return '{0} failed nodes, the budget is {1}'.format(failures, self.max_failures)
+        done = len(self.results)
+        if (self.max_failure_rate is not None and done >= self.min_samples
+                and failures > self.max_failure_rate * done):
+            return '{0} of {1} nodes failed, over the {2:.0%} budget'.format(
+                failures, done, self.max_failure_rate)
+        return None
+
+    ''' ------------------------------ Waves --------------------------------'''
+    def next_wave(self, pending, size):
+        '''Return up to size nodes of pending within the rack and PDU limits.'''
+        wave, racks, pdus = [], {}, {}
+        for node in pending:
+            if len(wave) >= size:
+                break
+            if (self.max_per_rack and node.rack is not None
+                    and racks.get(node.rack, 0) >= self.max_per_rack):
+                continue
+            if (self.max_per_pdu and node.pdu is not None
+                    and pdus.get(node.pdu, 0) >= self.max_per_pdu):
+                continue
+            wave.append(node)
+            racks[node.rack] = racks.get(node.rack, 0) + 1
+            pdus[node.pdu] = pdus.get(node.pdu, 0) + 1
+        return wave
+
+    ''' ------------------------------ Journal ------------------------------'''
+    def resumed(self, host, component):
+        '''Return the outcome of component from an earlier run, or None if
+        it has to be updated.'''
+        if self.journal is None:
+            return None
+        state = self.journal.state(host, component)
+        if state == SUCCESS:
+            return {'status': SUCCESS, 'detail': 'updated by an earlier run'}
+        if state != journal.RUNNING or self.verify is None:
+            return None
+        try:
+            verified = self.verify(host, component)
+        except Exception as e:
+            log.warning('Cannot verify {0} on {1}: {2}'.format(component, host, e))
+            verified = False
+        if not verified:
+            return None
+        self.journal.record(host, component, SUCCESS, 'verified after restart')
+        return {'status': SUCCESS, 'detail': 'verified after restart'}
+
+    def completed(self):
+        '''Return the nodes the journal has every component updated on.'''
+        if self.journal is None:
+            return []
+        states = self.journal.states()
+        return [n for n in self.nodes
+                if all(states.get((n.host, c)) == SUCCESS for c in self.components)]
+
+    def update_node(self, node):
+        '''Run the components of node in order, stopping at the first failure.'''
+        started = time.time()
+        result = {'host': node.host, 'status': SUCCESS, 'components': {}}
+        for component in self.components:
+            outcome = self.resumed(node.host, component)
+            if outcome is not None:
+                result['components'][component] = outcome
+                continue
+            if self.journal is not None:
+                self.journal.record(node.host, component, journal.RUNNING)
+            try:
+                outcome = self.runner(node.host, component)
+            except Exception as e:
+                log.exception('Updating {0} on {1} failed'.format(component, node.host))
+                outcome = {'status': 'error', 'detail': str(e)}
+            if self.journal is not None:
+                self.journal.record(node.host, component,
+                                    outcome.get('status') or 'failed',
+                                    outcome.get('detail', ''))
+            result['components'][component] = outcome
+            if outcome.get('status') != SUCCESS:
+                result['status'] = outcome.get('status') or 'failed'
+                result['failed_component'] = component
+                break
+        result['elapsed'] = time.time() - started
+        return result
+
+    def run_wave(self, number, wave):
+        log.info('Wave {0}: {1}'.format(number, ' '.join(n.host for n in wave)))
+        pool = ThreadPool(len(wave))
+        try:
+            results = pool.map(self.update_node, wave, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        for result in results:
+            self.results[result['host']] = result
+            if self.on_result:
+                self.on_result(result)
+        failures = sum(1 for r in results if r['status'] != SUCCESS)
+        self.waves.append({'wave': number, 'hosts': [n.host for n in wave],
+                           'failures': failures})
+        return failures
+
+    def run(self):
+        '''Run the rollout and return its summary.'''
+        for node in self.completed():
+            self.results[node.host] = {
+                'host': node.host, 'status': SUCCESS, 'resumed': True, 'elapsed': 0,
+                'components': dict((c, {'status': SUCCESS, 'detail': 'updated by an earlier run'})
+                                   for c in self.components)}
+        if self.results:
+            log.info('{0} nodes already updated by an earlier run'.format(len(self.results)))
+        pending = [n for n in self.nodes if n.host not in self.results]
+        size = self.canary
+        self.state = 'running'
+        number = len(self.waves)
+        while pending:
+            wave = self.next_wave(pending, size)
+            number += 1
+            failures = self.run_wave(number, wave)
+            pending = [n for n in pending if n not in wave]
+
+            if number == 1 and failures:
+                self.state, self.reason = 'halted', 'canary failed'
+            else:
+                self.reason = self.budget_exceeded()
+                if self.reason:
+                    self.state = 'halted'
+            if self.state == 'halted':
+                log.error('Rollout halted after wave {0}: {1}'.format(number, self.reason))
+                break
+
+            if failures > self.slow_failure_rate * len(wave):
+                size = max(1, size // self.growth)
+                self.state = 'slowed'
+                log.warning('Wave {0} had {1} failures, next waves of {2} nodes'.format(
+                    number, failures, size))
+            else:
+                size = min(self.max_batch, size * self.growth)
+            if pending and self.pause:
+                time.sleep(self.pause)
+
+        if self.state != 'halted':
+            self.state = 'done'
+        return self.summary()
+
+    def summary(self):
+        started = set(self.results)
+        skipped = [n.host for n in self.nodes if n.host not in started]
+        return {
+            'state': self.state,
+            'reason': self.reason,
+            'waves': self.waves,
+            'succeeded': sorted(h for h, r in self.results.items() if r['status'] == SUCCESS),
+            'failed': sorted(self.failed()),
+            'skipped': skipped,
+            'results': self.results,
+        }
@@ -0,0 +1,314 @@
+'''sol.py
+
+Serial-over-LAN console driver.
+
+When the OS of a node is unreachable the BIOS/POST console is only visible
+over SOL.  SolConsole runs ipmitool sol activate on a Connection (any host
+with ipmitool, the test stand by default) and feeds everything the console
+prints into the vendored pexpect.ANSI terminal emulator, so callers see the
+virtual screen exactly as an operator would:
+
+    sol = sol.SolConsole(conn, '192.168.3.123', 'ADMIN', 'ADMIN')
+    sol.activate()
+    sol.wait_for_post(timeout=600)         # eg. 'Press <DEL> to run Setup'
+    sol.send_keys(['DEL'] * 5)             # enter BIOS setup
+    sol.wait_for('Main', region=(1, 1, 3, 80))
+    sol.send_keys(['RIGHT', 'RIGHT', 'ENTER'], delay=0.5)
+    sol.deactivate()
+
+Text is looked up both on the current screen and in the recent output with
+the escape sequences removed, because POST messages often scroll off before
+they are read.
+
+Prerequisites:
+    - This module is tested on Python 2.7.15 and is compatible with python
+      2.7 or later.
+'''
+import logging
+import pipes
+import re
+import time
+import warnings
+
+from pexpect import pxssh
+from pexpect.exceptions import EOF, TIMEOUT
+
+with warnings.catch_warnings():
+    # pexpect warns that screen and ANSI are deprecated in favour of pyte,
+    # which is not vendored
+    warnings.simplefilter('ignore')
+    from pexpect import ANSI
+
+from lib.connection import REDACTED
+
+try:
+    basestring
+except NameError:
+    basestring = str
+
+
+log = logging.getLogger(__name__)
+
+# Escape sequences of the keys used in BIOS setup (VT100 / ANSI as sent by
+# the Supermicro SOL console)
+KEYS = {
+    'ENTER': '\r', 'ESC': '\x1b', 'TAB': '\t', 'SPACE': ' ',
+    'BACKSPACE': '\x7f', 'DEL': '\x1b[3~', 'INSERT': '\x1b[2~',
+    'UP': '\x1b[A', 'DOWN': '\x1b[B', 'RIGHT': '\x1b[C', 'LEFT': '\x1b[D',
+    'HOME': '\x1b[H', 'END': '\x1b[F', 'PGUP': '\x1b[5~', 'PGDN': '\x1b[6~',
+    'PLUS': '+', 'MINUS': '-',
+    'F1': '\x1bOP', 'F2': '\x1bOQ', 'F3': '\x1bOR', 'F4': '\x1bOS',
+    'F5': '\x1b[15~', 'F6': '\x1b[17~', 'F7': '\x1b[18~', 'F8': '\x1b[19~',
+    'F9': '\x1b[20~', 'F10': '\x1b[21~', 'F11': '\x1b[23~', 'F12': '\x1b[24~',
+}
+
+# Console text showing the BIOS is running POST
+POST_PATTERNS = (
+    r'Press\s*<DEL>', r'Press\s*<F2>', r'to run Setup', r'Entering Setup',
+    r'Invoking Boot Menu', r'DXE--', r'PEI--', r'Version \d+\.\d+\.\d+\.\s*Copyright',
+)
+
+# Console text showing the OS is up
+BOOT_PATTERNS = (r'\blogin:\s*$',)
+
+# Remove the escape sequences from the raw output
+_ESCAPES = re.compile(r'\x1b(\[[0-9;?]*[A-Za-z]|\([AB012]|[78=>MD]|O[A-Z]|#.)')
+
+# Characters of the raw output kept for matching
+HISTORY = 64 * 1024
+
+
+class SolError(Exception):
+    pass
+
+
+class Screen(ANSI.ANSI):
+    '''ANSI terminal whose unknown escape sequences are logged through the
+    logging module instead of being appended to a file named 'log' in the
+    current directory, as pexpect.ANSI does.'''
+
+    def __init__(self, r=25, c=80, *args, **kwargs):
+        ANSI.ANSI.__init__(self, r, c, *args, **kwargs)
+        fsm = self.state
+        swap = lambda t: (_log_unknown if t[0] is ANSI.DoLog else t[0], t[1])
+        for key, transition in fsm.state_transitions.items():
+            fsm.state_transitions[key] = swap(transition)
+        for key, transition in fsm.state_transitions_any.items():
+            fsm.state_transitions_any[key] = swap(transition)
+        fsm.default_transition = swap(fsm.default_transition)
+        fsm.compile()
+
+    def text(self):
+        '''Return the screen as text, one line per row.'''
+        return self._unicode()
+
+    def region(self, r1, c1, r2, c2):
+        '''Return the text of a region, 1-based inclusive coordinates.'''
+        return u'\n'.join(self.get_region(r1, c1, r2, c2))
+
+
+def _log_unknown(fsm):
+    screen = fsm.memory[0]
+    fsm.memory = [screen]
+    log.debug('Unknown escape sequence {!r} in state {}'.format(
+        fsm.input_symbol, fsm.current_state))
+
+
+class SolConsole(object):
+    '''SOL console of one node, run on a logged in Connection.'''
+
+    def __init__(self, conn, bmc_ip, username='ADMIN', password='ADMIN',
+                 rows=25, cols=80, interface='lanplus'):
+        self.conn = conn
+        self.bmc_ip = bmc_ip
+        self.username = username
+        self.password = password
+        self.interface = interface
+        self.screen = Screen(rows, cols)
+        self.history = u''
+        self.active = False
+
+    def _ipmitool(self, command):
+        # The password is handed over in IPMI_PASSWORD (-E) so it does not
+        # show in ps on the host
+        return 'IPMI_PASSWORD={} ipmitool -I {} -H {} -U {} -E {}'.format(
+            pipes.quote(self.password), self.interface, self.bmc_ip,
+            self.username, command)
+
+    def _run(self, command, pattern, timeout):
+        '''Send the ipmitool command, the password is kept out of the
+        recording, the trace and the logs of the connection.'''
+        with self.conn._redacting(self.password):
+            return self.conn.sendline(self._ipmitool(command), pattern,
+                                      timeout=timeout)
+
+    def _output(self):
+        '''Return the output of the last command without the password.'''
+        output = self.conn.output or ''
+        return output.replace(self.password, REDACTED) if self.password else output
+
+    ''' ----------------------------- Session ---------------------------------'''
+    def activate(self, timeout=30):
+        '''Start the SOL session, closing a stale one first.'''
+        self._run('sol deactivate', self.conn.PROMPT, timeout)
+        index = self._run('sol activate',
+                          ['SOL Session operational', 'Error', 'Unable'], timeout)
+        if index != 0:
+            raise SolError('SOL activate failed on {}: {}'.format(
+                self.bmc_ip, self._output()))
+        self.active = True
+        log.debug('SOL session operational on {}'.format(self.bmc_ip))
+
+    def escape(self):
+        '''Return the keys leaving the SOL session, ipmitool's '~.'.
+
+        The ssh client under a pxssh Connection takes '~.' after a newline
+        as its own escape and would drop the SSH session instead, '~~' makes
+        it pass a single '~' on to ipmitool.
+        '''
+        if isinstance(self.conn, pxssh.pxssh):
+            return '\r~~.'
+        return '\r~.'
+
+    def deactivate(self, timeout=10):
+        '''Leave the SOL session with the ipmitool escape sequence.'''
+        if not self.active:
+            return
+        self.active = False
+        try:
+            self.conn.send(self.escape(), self.conn.PROMPT, timeout=timeout)
+        except TIMEOUT:
+            self._run('sol deactivate', self.conn.PROMPT, timeout)
+        except EOF:
+            raise SolError('Session closed while leaving SOL on {}'.format(
+                self.bmc_ip))
+
+    def __enter__(self):
+        self.activate()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.deactivate()
+        except (SolError, TIMEOUT, EOF) as e:
+            # Do not hide the error that ended the with block
+            if exc_type is None:
+                raise
+            log.error('Leaving SOL on {} failed: {}'.format(self.bmc_ip, e))
+        return False
+
+    ''' ----------------------------- Reading ---------------------------------'''
+    def feed(self, data):
+        '''Process console output into the screen and the history.'''
+        if isinstance(data, bytes):
+            data = data.decode('latin-1')
+        self.screen.write(data)
+        self.history = (self.history + _ESCAPES.sub(u'', data))[-HISTORY:]
+
+    def read(self, timeout=1, size=4096):
+        '''Read what the console printed within timeout seconds.
+
+        Returns the number of characters read.
+        '''
+        deadline = time.time() + timeout
+        total = 0
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return total
+            try:
+                data = self.conn.read_nonblocking(size, timeout=remaining)
+            except TIMEOUT:
+                return total
+            except EOF:
+                self.active = False
+                raise SolError('SOL session on {} closed'.format(self.bmc_ip))
+            total += len(data)
+            self.feed(data)
+            if len(data) < size:
+                # Caught up, let the caller look at the screen
+                return total
+
+    def search(self, patterns, region=None):
+        '''Return the index of the first pattern found, or None.
+
+        The patterns are regular expressions, looked up on the screen (or
+        the region (r1, c1, r2, c2) of it) and, when no region is given, in
+        the history.
+        '''
+        if region is not None:
+            texts = [self.screen.region(*region)]
+        else:
+            texts = [self.screen.text(), self.history]
+        for index, pattern in enumerate(patterns):
+            for text in texts:
+                if re.search(pattern, text, re.M):
+                    return index
+        return None
+
+    def wait_for(self, patterns, region=None, timeout=60, clear=True):
+        '''Wait until one of patterns shows up and return its index.
+
+        patterns is a regular expression or a list of them.  The history is
+        cleared first unless clear is False, so text from before the call
+        does not match.  Raises TIMEOUT if nothing matched within timeout.
+        '''
+        if not isinstance(patterns, (list, tuple)):
+            patterns = [patterns]
+        if clear:
+            self.history = u''
+        deadline = time.time() + timeout
+        while True:
+            index = self.search(patterns, region)
+            if index is not None:
+                log.debug('SOL {} matched {!r}'.format(self.bmc_ip, patterns[index]))
+                return index
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise TIMEOUT('{!r} not seen on {} within {} seconds'.format(
+                    patterns, self.bmc_ip, timeout))
+            self.read(min(remaining, 1))
+
+    def wait_for_post(self, timeout=600):
+        '''Wait until the BIOS shows its POST screen.'''
+        return self.wait_for(list(POST_PATTERNS), timeout=timeout)
+
+    def wait_for_boot(self, timeout=900, patterns=BOOT_PATTERNS):
+        '''Wait until the OS shows its login prompt.'''
+        return self.wait_for(list(patterns), timeout=timeout)
+
+    ''' ----------------------------- Writing ---------------------------------'''
+    def send_keys(self, keys, delay=0.2, settle=0.5):
+        '''Send a sequence of keys.
+
+        keys is a list of key names from KEYS or literal strings.  delay is
+        the pause between keys, the BIOS setup drops keys sent too fast.  The
+        console is read for settle seconds afterwards to update the screen.
+        '''
+        if isinstance(keys, basestring):
+            keys = [keys]
+        for key in keys:
+            self.conn.send(KEYS.get(key.upper(), key) if len(key) > 1 else key)
+            self.read(delay)
+        if settle:
+            self.read(settle)
+
+
+def wait_for_reboot(conn, bmc_ip, username='ADMIN', password='ADMIN',
+                    timeout=900, post_timeout=None):
+    '''Watch the SOL console of a rebooting node until the OS is up.
+
+    This replaces fixed sleeps after a reboot: it returns as soon as the OS
+    login prompt is printed, and fails early when POST never starts.
+    Returns the seconds it took.
+    '''
+    started = time.time()
+    with SolConsole(conn, bmc_ip, username, password) as console:
+        console.wait_for_post(timeout=post_timeout or timeout)
+        log.debug('{} is in POST after {:.0f} seconds'.format(
+            bmc_ip, time.time() - started))
+        remaining = max(timeout - (time.time() - started), 1)
+        console.wait_for_boot(timeout=remaining)
+    elapsed = time.time() - started
+    log.debug('{} booted in {:.0f} seconds'.format(bmc_ip, elapsed))
+    return elapsed
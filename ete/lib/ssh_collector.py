@@ -0,0 +1,98 @@
+'''ssh_collector.py
+
+In-band BMC and BIOS firmware census of many nodes over SSH.
+
+For the nodes whose BMC cannot be asked out-of-band, the versions are read
+the way the updaters read them before an update, logged into the host OS:
+the board and the BIOS version from the DMI ids, the BMC version from
+ipmicfg.  The sessions run on the worker processes of lib/fleet.py:
+
+    - one task per node and value (the model, then each component), so a
+      node with several components is logged into once and its tasks stay
+      on the worker holding its session,
+    - the matching of hundreds of session outputs is spread over the cores
+      instead of waiting on the GIL in threads,
+    - a worker done with its nodes takes over the nodes another worker has
+      not started yet.
+
+    records = ssh_collector.collect(hosts, 'root', 'nutanix/4u', ['BMC', 'BIOS'])
+    for record in records:
+        print(record['host'], record['model'], record['firmware'].get('BIOS'))
+
+The records have the shape of the redfish_crawler records, so they can be
+audited with the same code.
+
+Prerequisites:
+    - This module is tested on Python 2.7.15 and is compatible with python
+      2.7 or later.
+'''
+import collections
+import logging
+
+from lib import fleet, inventory, parsers
+
+
+log = logging.getLogger(__name__)
+
+IPMICFG = '/usr/bin/ipmicfg-linux.x86_64'
+
+
+def read_model(conn, host):
+    '''Return the baseboard model of the node.'''
+    return inventory.dmi(conn, 'board_name')
+
+
+def read_bmc(conn, host):
+    '''Return the BMC version of the node.'''
+    conn.sendline('{} -ver'.format(IPMICFG), conn.PROMPT)
+    return parsers.ipmicfg_ver(conn.output or '')['version']
+
+
+def read_bios(conn, host):
+    '''Return the BIOS version of the node.'''
+    return inventory.dmi(conn, 'bios_version')
+
+
+# Job reading the version of each component
+READERS = {'BMC': read_bmc, 'BIOS': read_bios}
+
+
+def collect(hosts, username, password, components=('BMC', 'BIOS'),
+            workers=None, connect=fleet.login):
+    '''Return the census records of hosts, in the order of hosts.
+
+    workers is the number of worker processes, the number of CPUs by
+    default.  The components without a reader are left out.
+    '''
+    records = collections.OrderedDict(
+        (host, {'host': host, 'model': None, 'firmware': {}, 'error': None})
+        for host in hosts)
+    components = [c.upper() for c in components if c.upper() in READERS]
+
+    tasks, fields = [], []
+    for host in records:
+        tasks.append((host, read_model))
+        fields.append('model')
+        for component in components:
+            tasks.append((host, READERS[component]))
+            fields.append(component)
+
+    for result in fleet.run(tasks, username, password, workers=workers,
+                            connect=connect):
+        record = records[result.host]
+        field = fields[result.index]
+        if result.status != 'ok':
+            log.error('{} of {} failed: {} {}'.format(
+                field, result.host, result.status, result.error))
+            record['error'] = record['error'] or '{}: {}'.format(
+                result.status, result.error)
+        elif field == 'model':
+            record['model'] = result.value
+        else:
+            record['firmware'][field] = result.value
+    return list(records.values())
+
+
+def component_version(record, component):
+    '''Return the version of component ('BMC', 'BIOS') in a census record.'''
+    return record['firmware'].get(component.upper())
@@ -0,0 +1,62 @@
+'''telemetry.py
+
+Command line options and setup of the timing, tracing and metrics of an
+updater run.
+
+Every updater takes --timing-db, --trace and --metrics-dir and wraps its run
+in run_context(), which starts the three and closes them when the run ends,
+whether it exits, fails or times out:
+
+    parser = argparse.ArgumentParser(...)
+    ...
+    telemetry.add_run_args(parser)
+    args = parser.parse_args()
+
+    with telemetry.run_context(args, args.ip, 'BMC'):
+        ...
+        metrics.set_result('success')
+
+Prerequisites:
+    - This module is tested on Python 2.7.15 and is compatible with python
+      2.7 or later.
+'''
+import contextlib
+
+from lib import metrics, timing_db, tracing
+
+
+def add_run_args(parser):
+    '''Add the --timing-db, --trace and --metrics-dir options to parser.'''
+    parser.add_argument(
+        '--timing-db', required=False,
+        help='SQLite file to record the phase timings into', default=None)
+    parser.add_argument(
+        '--trace', required=False,
+        help='File to write a trace of the run to (.json for Chrome trace '
+             'format, JSON lines otherwise)', default=None)
+    parser.add_argument(
+        '--metrics-dir', required=False,
+        help='node_exporter textfile directory to write the run metrics to',
+        default=None)
+
+
+@contextlib.contextmanager
+def run_context(args, host, component):
+    '''Record the enclosed run of component on host as args ask.
+
+    The run is traced as a component span, which is yielded.  On the way
+    out the timings are closed, the trace is written and the metrics are
+    counted, with the result set by metrics.set_result() or as a failure.
+    '''
+    span = None
+    try:
+        timing_db.start(args.timing_db, host, component)
+        tracing.enable(args.trace, host=host)
+        metrics.start(host, component)
+        span = tracing.begin(component, cat='component')
+        yield span
+    finally:
+        timing_db.stop()
+        tracing.end(span)
+        tracing.disable()
+        metrics.finish(args.metrics_dir)
@@ -0,0 +1,266 @@
+'''timing_db.py
+
+Historical timing store for firmware operations.
+
+Every updater run records how long each phase took (login, inventory,
+transfer, flash, reboot wait, verify) for a host and component into a SQLite
+file.  In every updater 'flash' times the flash command alone.  The resets
+and reboot waits after it are recorded as their own phases, so the flash
+times of different components can be compared.  The query helpers return
+percentiles grouped by model and component so maintenance windows can be
+sized from real data and slow tools or BMCs show up as regressions.
+
+Usage from an updater:
+
+    timing_db.start(args.timing_db, args.ip, 'BMC')
+    with timing_db.phase('login'):
+        conn.login(...)
+    timing_db.set_model(part_number)
+    ...
+    timing_db.stop()
+
+All the module level helpers are no-ops until start() is called with a path,
+so the updaters behave exactly as before when --timing-db is not given.
+
+Prerequisites:
+    - This module is tested on Python 2.7.15 and is compatible with python
+      2.7 or later.
+'''
+import contextlib
+import logging
+import sqlite3
+import time
+import uuid
+
+from lib import metrics, tracing
+
+
+log = logging.getLogger(__name__)
+
+# Phases recorded by the updaters. 'transfer' is the image upload of the
+# Redfish updates, the SSH updates flash an image already on the node.
+# 'verify' is the check of update_all_fw.py after the flash and the version
+# read after a Redfish BMC update.
+PHASES = ('login', 'inventory', 'transfer', 'flash', 'reboot_wait', 'verify',
+          'configure')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS timings (
+    id        INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id    TEXT NOT NULL,
+    host      TEXT NOT NULL,
+    model     TEXT NOT NULL DEFAULT '',
+    component TEXT NOT NULL,
+    phase     TEXT NOT NULL,
+    started   REAL NOT NULL,
+    elapsed   REAL NOT NULL,
+    status    TEXT NOT NULL DEFAULT 'ok'
+);
+CREATE INDEX IF NOT EXISTS timings_lookup ON timings (component, phase, model);
+CREATE INDEX IF NOT EXISTS timings_run ON timings (run_id);
+'''
+
+
+def percentile(values, pct):
+    '''Return the pct percentile of values using linear interpolation.
+
+    Returns None for an empty list.
+    '''
+    if not values:
+        return None
+    values = sorted(values)
+    if len(values) == 1:
+        return values[0]
+    rank = (len(values) - 1) * (pct / 100.0)
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+class TimingDB(object):
+    '''SQLite backed store of per-host, per-component, per-phase durations.'''
+
+    def __init__(self, path, run_id=None, timeout=30):
+        self.path = path
+        self.run_id = run_id or uuid.uuid4().hex
+
+        # Several updaters may write the same file at once, WAL lets readers
+        # and the writer proceed without blocking each other.
+        self.db = sqlite3.connect(path, timeout=timeout)
+        try:
+            self.db.execute('PRAGMA journal_mode=WAL')
+        except sqlite3.DatabaseError:
+            pass
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def record(self, host, component, phase, elapsed, model='', status='ok',
+               started=None):
+        '''Record one phase duration in seconds.'''
+        if started is None:
+            started = time.time() - elapsed
+        self.db.execute(
+            'INSERT INTO timings (run_id, host, model, component, phase, '
+            'started, elapsed, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (self.run_id, host, model or '', component, phase, started,
+             elapsed, status))
+        self.db.commit()
+        log.debug('{} {} {} {:.2f} seconds ({})'.format(host, component, phase, elapsed, status))
+
+    def set_model(self, host, component, model):
+        '''Back fill the model on rows of this run recorded before it was
+        known (eg. the login phase happens before inventory).'''
+        self.db.execute(
+            "UPDATE timings SET model = ? WHERE run_id = ? AND host = ? AND "
+            "component = ? AND model = ''",
+            (model, self.run_id, host, component))
+        self.db.commit()
+
+    @contextlib.contextmanager
+    def timer(self, host, component, phase, model=''):
+        '''Context manager recording the duration of the enclosed block.
+
+        The row status is 'error' if the block raises, except for a
+        sys.exit(0) which the updaters use to finish successfully.
+        '''
+        status = 'ok'
+        started = time.time()
+        try:
+            yield
+        except SystemExit as e:
+            if e.code not in (None, 0):
+                status = 'error'
+            raise
+        except BaseException:
+            status = 'error'
+            raise
+        finally:
+            self.record(host, component, phase, time.time() - started,
+                        model=model, status=status, started=started)
+
+    def _where(self, component=None, phase=None, model=None, host=None,
+               since=None, status='ok'):
+        '''Build the WHERE clause shared by the query helpers.'''
+        clauses, params = [], []
+        for column, value in (('component', component), ('phase', phase),
+                              ('model', model), ('host', host),
+                              ('status', status)):
+            if value is not None:
+                clauses.append('{} = ?'.format(column))
+                params.append(value)
+        if since is not None:
+            clauses.append('started >= ?')
+            params.append(since)
+        where = ' WHERE ' + ' AND '.join(clauses) if clauses else ''
+        return where, params
+
+    def durations(self, component=None, phase=None, model=None, host=None,
+                  since=None, status='ok'):
+        '''Return the list of recorded durations matching the filters.'''
+        where, params = self._where(component, phase, model, host, since, status)
+        rows = self.db.execute('SELECT elapsed FROM timings' + where, params)
+        return [row[0] for row in rows]
+
+    def percentiles(self, component=None, phase=None, model=None, host=None,
+                    since=None, pcts=(50, 90, 99)):
+        '''Return {pct: seconds} of successful durations matching the
+        filters.'''
+        values = sorted(self.durations(component, phase, model, host, since))
+        return dict((pct, percentile(values, pct)) for pct in pcts)
+
+    def summary(self, since=None, pcts=(50, 90, 99)):
+        '''Return a list of dicts with count, mean and percentiles for each
+        (model, component, phase) seen, successful runs only.'''
+        where, params = self._where(since=since)
+        rows = self.db.execute(
+            'SELECT model, component, phase, elapsed FROM timings' + where +
+            ' ORDER BY model, component, phase', params)
+        groups = {}
+        for model, component, phase, elapsed in rows:
+            groups.setdefault((model, component, phase), []).append(elapsed)
+
+        summary = []
+        for (model, component, phase), values in sorted(groups.items()):
+            entry = {
+                'model': model,
+                'component': component,
+                'phase': phase,
+                'count': len(values),
+                'mean': sum(values) / len(values),
+            }
+            for pct in pcts:
+                entry['p{}'.format(pct)] = percentile(values, pct)
+            summary.append(entry)
+        return summary
+
+
+''' ------------------- Module level run used by updaters -------------------'''
+_run = {'db': None, 'host': '', 'component': '', 'model': ''}
+
+
+def start(path, host, component, model=''):
+    '''Start recording the phases of this updater run into path.
+
+    Does nothing if path is empty so callers can pass the CLI option through.
+    '''
+    if not path:
+        return None
+    stop()
+    _run.update(db=TimingDB(path), host=host, component=component, model=model)
+    return _run['db']
+
+
+def set_model(model):
+    '''Set the model for the current run once inventory has found it.'''
+    db = _run['db']
+    if db is None or not model:
+        return
+    _run['model'] = model
+    db.set_model(_run['host'], _run['component'], model)
+
+
+@contextlib.contextmanager
+def phase(name, component=None):
+    '''Record the enclosed block as phase name of the current run.
+
+    The block is also traced as a phase span when tracing is enabled and its
+    duration feeds the phase histogram of the run metrics.
+    '''
+    started = time.time()
+    try:
+        with tracing.span(name, cat='phase'):
+            db = _run['db']
+            if db is None:
+                yield
+                return
+            with db.timer(_run['host'], component or _run['component'], name,
+                          model=_run['model']):
+                yield
+    finally:
+        metrics.observe_phase(name, time.time() - started)
+
+
+@contextlib.contextmanager
+def component(name):
+    '''Record the phases of the enclosed block under component name.
+
+    Lets a run covering several components, such as update_all_fw.py, call
+    the flash functions of the updaters which record their own phases.
+    '''
+    previous = _run['component']
+    _run['component'] = name
+    try:
+        yield
+    finally:
+        _run['component'] = previous
+
+
+def stop():
+    '''Close the database of the current run, if any.'''
+    db = _run['db']
+    if db is not None:
+        db.close()
+    _run.update(db=None, host='', component='', model='')
@@ -0,0 +1,229 @@
+'''tracing.py
+
+Structured tracing spans across the updater phases.
+
+Spans nest host -> component -> phase -> command and are written either as
+JSON lines (one record per finished span) or in the Chrome trace event format,
+which can be opened in chrome://tracing or https://ui.perfetto.dev to see
+exactly where the minutes of a slow node went.
+
+    tracing.enable('node1.json', host='192.168.2.123')
+    with tracing.span('BMC', cat='component'):
+        with tracing.span('flash', cat='phase'):
+            conn.sendline(...)        # Connection.send opens a command span
+    tracing.disable()
+
+Tracing is off by default.  While disabled span() returns a shared no-op
+object and traced() calls straight through, so the instrumentation points in
+Connection.send and the updaters cost one global lookup.
+
+Prerequisites:
+    - This module is tested on Python 2.7.15 and is compatible with python
+      2.7 or later.
+'''
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+
+import decorator
+
+
+log = logging.getLogger(__name__)
+
+# Names longer than this are truncated, commands can be long one-liners
+MAX_NAME = 80
+
+
+class _State(object):
+    enabled = False
+    out = None
+    chrome = False
+    host = ''
+    pid = 0
+    first = True
+
+
+_state = _State()
+_lock = threading.Lock()
+_local = threading.local()
+_ids = itertools.count(1)
+
+
+class _NullSpan(object):
+    '''Span returned while tracing is disabled.'''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span(object):
+    '''A timed, nested section of work.'''
+
+    __slots__ = ('name', 'cat', 'attrs', 'id', 'parent', 'depth', 'start')
+
+    def __init__(self, name, cat, attrs):
+        self.name = name
+        self.cat = cat
+        self.attrs = attrs
+        self.id = None
+        self.parent = None
+        self.depth = 0
+        self.start = None
+
+    def set(self, **attrs):
+        '''Add attributes known only once the work is done.'''
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        stack = _stack()
+        self.id = next(_ids)
+        if stack:
+            self.parent = stack[-1].id
+            self.depth = len(stack)
+        stack.append(self)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.time() - self.start
+        stack = _stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        _emit(self, elapsed)
+        return False
+
+
+def _stack():
+    try:
+        return _local.stack
+    except AttributeError:
+        _local.stack = []
+        return _local.stack
+
+
+def _name(name):
+    name = '{}'.format(name).strip()
+    if len(name) > MAX_NAME:
+        name = name[:MAX_NAME - 3] + '...'
+    return name
+
+
+def _write(record):
+    '''Write one record to the trace file.'''
+    with _lock:
+        out = _state.out
+        if out is None:
+            return
+        if _state.chrome:
+            out.write(('' if _state.first else ',\n') + json.dumps(record))
+            _state.first = False
+        else:
+            out.write(json.dumps(record) + '\n')
+        out.flush()
+
+
+def _emit(span, elapsed):
+    attrs = dict((k, v if isinstance(v, (int, float, bool)) or v is None
+                  else _name(v)) for k, v in span.attrs.items())
+    if _state.chrome:
+        attrs.update(id=span.id, parent=span.parent)
+        record = {
+            'name': _name(span.name), 'cat': span.cat, 'ph': 'X',
+            'ts': int(span.start * 1e6), 'dur': int(elapsed * 1e6),
+            'pid': _state.pid, 'tid': threading.current_thread().ident,
+            'args': attrs,
+        }
+    else:
+        record = {
+            'name': _name(span.name), 'cat': span.cat, 'host': _state.host,
+            'start': span.start, 'elapsed': elapsed, 'id': span.id,
+            'parent': span.parent, 'depth': span.depth,
+            'thread': threading.current_thread().name, 'attrs': attrs,
+        }
+    _write(record)
+
+
+def enable(path, host='', chrome=None):
+    '''Start writing spans to path.
+
+    The Chrome trace event format is used when chrome is True, or when it is
+    None and path ends with .json; JSON lines otherwise.  Does nothing if path
+    is empty so callers can pass the CLI option through.
+    '''
+    if not path:
+        return
+    disable()
+    if '~' in path:
+        path = os.path.expanduser(path)
+    if chrome is None:
+        chrome = path.endswith('.json')
+    with _lock:
+        _state.out = open(path, 'w')
+        _state.chrome = chrome
+        _state.host = host
+        _state.pid = os.getpid()
+        _state.first = True
+        if chrome:
+            _state.out.write('[\n')
+    if chrome:
+        # Name the process row after the host in the trace viewer
+        _write({'name': 'process_name', 'ph': 'M', 'pid': _state.pid,
+                'args': {'name': host or 'localhost'}})
+    _state.enabled = True
+
+
+def disable():
+    '''Stop tracing and close the trace file.'''
+    _state.enabled = False
+    with _lock:
+        out, _state.out = _state.out, None
+        if out is not None:
+            if _state.chrome:
+                out.write('\n]\n')
+            out.close()
+
+
+def is_enabled():
+    return _state.enabled
+
+
+def span(name, cat='phase', **attrs):
+    '''Return a context manager timing the enclosed block as a span.'''
+    if not _state.enabled:
+        return _NULL_SPAN
+    return Span(name, cat, attrs)
+
+
+def begin(name, cat='phase', **attrs):
+    '''Open a span without a with block, close it with end().'''
+    return span(name, cat, **attrs).__enter__()
+
+
+def end(s, exc_type=None):
+    '''Close a span opened by begin().'''
+    if s is not None:
+        s.__exit__(exc_type, None, None)
+
+
+def traced(name=None, cat='phase'):
+    '''Decorator wrapping every call of the function in a span.'''
+    def caller(f, *args, **kwargs):
+        if not _state.enabled:
+            return f(*args, **kwargs)
+        with Span(name or f.__name__, cat, {}):
+            return f(*args, **kwargs)
+    return decorator.decorator(caller)
@@ -1,25 +1,21 @@
 import json
-import site
+import os
 import subprocess
 import sys
 
 
 def add_python_packages(package_path):
-    '''Add the custom python packages path.'''
-    # Get python command path in case there are several versions installed
-    # Reference: https://stackoverflow.com/questions/2589711/find-full-path-of-the-python-interpreter
-    local_pythonpath = run_cmd('{0} -m site --user-site'.format(sys.executable))
-
-    # Add custom package path
-    # Reference: https://stackoverflow.com/a/12311321
-    run_cmd('mkdir -p {0}'.format(local_pythonpath))
-    run_cmd('echo {0} > {1}/package.pth'.format(package_path, local_pythonpath))
-
-    # Reload the sys.path to make the packages available
-    # Reference: https://stackoverflow.com/questions/25384922/how-to-refresh-sys-path
-    reload(site)
-    
-    
+    '''Add the custom python packages path.
+
+    The path is appended to sys.path in-process, the same place a .pth file in
+    the user site directory would have put it, so no subprocess is spawned
+    and nothing is written outside the project at import time.
+    '''
+    package_path = os.path.abspath(package_path)
+    if package_path not in sys.path:
+        sys.path.append(package_path)
+
+
 def is_int(s):
     '''Check if string is an integer.'''
     try: 
@@ -0,0 +1,280 @@
+'''xml_extract.py
+
+Streaming extraction of a few values from large XML outputs.
+
+sumtool and the other vendor tools print XML documents (BIOS configuration
+dumps, BIOS and DMI info) of which the updaters need only a handful of
+fields.  xmltodict.parse() builds the whole document as nested dicts first;
+here the parse runs in xmltodict's streaming mode (item_depth/item_callback)
+so only one subtree at a time is ever built, and it is interrupted with
+ParsingInterrupted as soon as every requested value has been found.  Paths of
+different depths are streamed in one pass per depth.
+
+    values = xml_extract.extract(bios_cfg_xml, [
+        'BiosCfg/Menu[@name="Advanced"]/Setting[@name="Power Technology"]/@selectedOption',
+        'BiosCfg/@version',
+    ])
+
+A path lists the element names from the root separated by '/'.  A step may
+carry one attribute predicate, Menu[@name="Advanced"], a '*' step matches any
+element, and the last step may be '@attribute' to return an attribute
+instead of the element.  Elements are returned as xmltodict returns them:
+the text for a plain element, a dict with '@attr' and '#text' keys
+otherwise.
+
+Prerequisites:
+    - This module is tested on Python 2.7.15 and is compatible with python
+      2.7 or later.
+'''
+import logging
+import re
+
+import xmltodict
+
+try:
+    basestring
+except NameError:
+    basestring = str
+
+
+log = logging.getLogger(__name__)
+
+_STEP = re.compile(r'^([^\[\]@]+)(?:\[@([\w:.-]+)=(["\'])(.*)\3\])?$')
+
+
+class XMLExtractError(Exception):
+    pass
+
+
+def split_path(path):
+    '''Split path on the '/' that are not inside a quoted predicate.'''
+    steps, current, quote = [], [], None
+    for char in path:
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in '"\'':
+            quote = char
+        elif char == '/':
+            steps.append(''.join(current))
+            current = []
+            continue
+        current.append(char)
+    steps.append(''.join(current))
+    return [step.strip() for step in steps if step.strip()]
+
+
+class Step(object):
+    '''One element step of a path: a name and an optional predicate.'''
+
+    __slots__ = ('name', 'attr', 'value')
+
+    def __init__(self, text):
+        match = _STEP.match(text)
+        if not match:
+            raise XMLExtractError('Invalid path step {!r}'.format(text))
+        self.name = match.group(1).strip()
+        self.attr = match.group(2)
+        self.value = match.group(4)
+
+    def matches(self, name, attrs):
+        if self.name != '*' and self.name != name:
+            return False
+        if self.attr is None:
+            return True
+        return (attrs or {}).get(self.attr) == self.value
+
+
+class Path(object):
+    '''A compiled path: element steps and an optional trailing attribute.'''
+
+    def __init__(self, text):
+        self.text = text
+        steps = split_path(text)
+        self.attribute = None
+        if steps and steps[-1].startswith('@'):
+            self.attribute = steps.pop()[1:]
+        if not steps:
+            raise XMLExtractError('Path {!r} has no element'.format(text))
+        self.steps = [Step(step) for step in steps]
+
+    def matches_prefix(self, path):
+        '''Return True if the xmltodict path (list of (name, attrs)) matches
+        the first steps of this path.'''
+        if len(path) > len(self.steps):
+            return False
+        return all(step.matches(name, attrs)
+                   for step, (name, attrs) in zip(self.steps, path))
+
+    def value_of(self, attrs, item):
+        '''Return (found, value) for the element matched at the depth of
+        this path, attrs being its attributes and item its content.'''
+        if self.attribute is None:
+            return True, _with_attrs(item, attrs)
+        if attrs and self.attribute in attrs:
+            return True, attrs[self.attribute]
+        return False, None
+
+
+def _parse(xml_input, depth, callback, **kwargs):
+    '''Stream xml_input calling callback(path, item) for the items at depth.
+
+    Returns True if the parse was interrupted by the callback.
+    '''
+    try:
+        xmltodict.parse(xml_input, item_depth=depth, item_callback=callback,
+                        **kwargs)
+    except xmltodict.ParsingInterrupted:
+        return True
+    return False
+
+
+def _rewinder(xml_input):
+    '''Return a function giving xml_input back for another parse.
+
+    A file object is rewound to where it was, one that cannot seek (a pipe)
+    is read into a string first.
+    '''
+    if isinstance(xml_input, (basestring, bytes)):
+        return lambda: xml_input
+    try:
+        start = xml_input.tell()
+        xml_input.seek(start)
+    except (AttributeError, IOError, OSError, ValueError):
+        text = xml_input.read()
+        return lambda: text
+
+    def rewind():
+        xml_input.seek(start)
+        return xml_input
+    return rewind
+
+
+def extract(xml_input, paths, **kwargs):
+    '''Return {path: value} of the first match of each path in xml_input.
+
+    xml_input is a string or a file object, which is read incrementally.
+    Paths that are not found map to None.  Extra keyword arguments go to
+    xmltodict.parse.
+
+    Each path is resolved at its own depth: the paths are grouped by the
+    number of element steps and every group streams the document with
+    item_depth set to that number, stopping as soon as the group is found.
+    Items are thus only built below the elements a path names, an attribute
+    of the root does not force the whole document to be built, and a
+    shallow path is never answered from the ancestors of deeper items.
+
+    >>> xml = ('<BiosCfg version="1.2"><Menu name="Main"/>'
+    ...        '<Menu name="Advanced"><Setting name="Watch Dog" selectedOption="Off"/>'
+    ...        '<Menu name="CPU"><Setting selectedOption="Enabled"/></Menu></Menu>'
+    ...        '</BiosCfg>')
+    >>> values = extract(xml, [
+    ...     'BiosCfg/@version',
+    ...     'BiosCfg/Menu[@name="Advanced"]/Setting[@name="Watch Dog"]/@selectedOption',
+    ...     'BiosCfg/Menu[@name="Advanced"]/Menu[@name="CPU"]/Setting/@selectedOption',
+    ...     'BiosCfg/Menu/@name'])
+    >>> for path in sorted(values):
+    ...     print('{} = {}'.format(path, values[path]))
+    BiosCfg/@version = 1.2
+    BiosCfg/Menu/@name = Main
+    BiosCfg/Menu[@name="Advanced"]/Menu[@name="CPU"]/Setting/@selectedOption = Enabled
+    BiosCfg/Menu[@name="Advanced"]/Setting[@name="Watch Dog"]/@selectedOption = Off
+    '''
+    compiled = [Path(p) for p in paths]
+    found = dict((p, None) for p in paths)
+    if not compiled:
+        return found
+
+    groups = {}
+    for p in compiled:
+        groups.setdefault(len(p.steps), []).append(p)
+    rewind = _rewinder(xml_input) if len(groups) > 1 else lambda: xml_input
+
+    missing = 0
+    for depth in sorted(groups):
+        pending = list(groups[depth])
+
+        def callback(path, item):
+            for p in list(pending):
+                if not p.matches_prefix(path):
+                    continue
+                ok, value = p.value_of(path[-1][1], item)
+                if ok:
+                    found[p.text] = value
+                    pending.remove(p)
+            return bool(pending)
+
+        interrupted = _parse(rewind(), depth, callback, **kwargs)
+        missing += len(pending)
+        log.debug('Extracted {} of {} paths at depth {}{}'.format(
+            len(groups[depth]) - len(pending), len(groups[depth]), depth,
+            ', stopped early' if interrupted else ''))
+    if missing:
+        log.debug('{} of {} paths not found'.format(missing, len(compiled)))
+    return found
+
+
+def extract_one(xml_input, path, **kwargs):
+    '''Return the value of the first match of path, or None.'''
+    return extract(xml_input, [path], **kwargs)[path]
+
+
+def find_all(xml_input, name, item_depth=1, callback=None, **kwargs):
+    '''Return [(ancestors, element)] of every element called name.
+
+    The document is streamed item by item at item_depth and each item is
+    searched recursively, so name may appear at any depth below it.
+    ancestors is the list of (name, attrs) from the root down to the parent
+    of the element, attrs being a dict or None.  If callback is given it is
+    called with (ancestors, element) instead of collecting the results, and
+    parsing stops when it returns False.
+    '''
+    results = []
+    emit = callback or (lambda ancestors, element: results.append((ancestors, element)) or True)
+
+    def walk(ancestors, tag, node):
+        nodes = node if isinstance(node, list) else [node]
+        if tag == name:
+            for element in nodes:
+                if emit(ancestors, element) is False:
+                    return False
+            return True
+        for child in nodes:
+            if not isinstance(child, dict):
+                continue
+            attrs = dict((k[1:], v) for k, v in child.items() if k.startswith('@')) or None
+            here = ancestors + [(tag, attrs)]
+            for key, value in child.items():
+                if key.startswith('@') or key == '#text':
+                    continue
+                if walk(here, key, value) is False:
+                    return False
+        return True
+
+    def on_item(path, item):
+        ancestors = [(n, dict(a) if a else None) for n, a in path[:-1]]
+        if path[-1][0] == name:
+            return emit(ancestors, _with_attrs(item, path[-1][1]))
+        return walk(ancestors, path[-1][0], _with_attrs(item, path[-1][1]))
+
+    _parse(xml_input, item_depth, on_item, **kwargs)
+    return results
+
+
+def _with_attrs(item, attrs):
+    '''Return the item built at item_depth with its own attributes.
+
+    xmltodict passes the attributes of the streamed element in the path, not
+    in the item, so put them back the way a full parse would have.
+    '''
+    if isinstance(item, basestring):
+        # The text of a streamed element also holds the whitespace before it
+        item = item.strip() or None
+    if not attrs:
+        return item
+    element = xmltodict.OrderedDict(('@' + k, v) for k, v in attrs.items())
+    if isinstance(item, dict):
+        element.update(item)
+    elif item is not None:
+        element['#text'] = item
+    return element
@@ -28,6 +28,7 @@ PEXPECT LICENSE
 
 from . import screen
 from . import FSM
+import re
 import string
 
 #
@@ -278,6 +279,16 @@ class ANSI (term):
         self.state.add_transition ('q', 'NUMBER_X', self.do_decsca, 'INIT')
         self.state.add_transition (';', 'NUMBER_X', None, 'SEMICOLON_X')
 
+        # Runs of characters that the INIT state only emits are written to
+        # the screen in bulk by write(), without one FSM step per character.
+        # Escape sequences are walked by the compiled FSM.
+        specials = set([u'\r', u'\n', chr(screen.BS)])
+        specials.update(symbol for symbol, state in self.state.state_transitions
+                        if state == 'INIT')
+        self.plain_run = re.compile(u'[^%s]+' % u''.join(
+            re.escape(c) for c in sorted(specials)))
+        self.state.compile()
+
     def process (self, c):
         """Process a single character. Called by :meth:`write`."""
         if isinstance(c, bytes):
@@ -294,8 +305,18 @@ class ANSI (term):
         """
         if isinstance(s, bytes):
             s = self._decode(s)
-        for c in s:
-            self.process(c)
+        fsm = self.state
+        bulk = fsm.state_transitions_any.get('INIT', (None,))[0] is DoEmit
+        i = 0
+        n = len(s)
+        while i < n:
+            if bulk and fsm.current_state == 'INIT':
+                run = self.plain_run.match(s, i)
+                if run:
+                    self.put_run(run.group())
+                    i = run.end()
+                    continue
+            i = fsm.process_until(s, i, 'INIT')
 
     def flush (self):
         pass
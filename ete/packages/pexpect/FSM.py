@@ -118,6 +118,8 @@ class FSM:
         self.next_state = None
         self.action = None
         self.memory = memory
+        # Dense transition table built by compile(), None when not compiled.
+        self.table = None
 
     def reset (self):
 
@@ -144,6 +146,7 @@ class FSM:
         if next_state is None:
             next_state = state
         self.state_transitions[(input_symbol, state)] = (action, next_state)
+        self.table = None
 
     def add_transition_list (self, list_input_symbols, state, action=None, next_state=None):
 
@@ -178,6 +181,7 @@ class FSM:
         if next_state is None:
             next_state = state
         self.state_transitions_any [state] = (action, next_state)
+        self.table = None
 
     def set_default_transition (self, action, next_state):
 
@@ -191,6 +195,36 @@ class FSM:
         default_transition to None. '''
 
         self.default_transition = (action, next_state)
+        self.table = None
+
+    def compile (self):
+
+        '''This precomputes the transitions into a dense table, one row per
+        state indexed by the code of the ASCII input symbols, so process() and
+        process_list() find a transition with two indexings instead of
+        get_transition()'s lookups. Symbols outside ASCII, or that are not one
+        character, still go through get_transition().
+
+        The add_transition*() and set_default_transition() methods drop the
+        table. After changing state_transitions, state_transitions_any or
+        default_transition directly, call compile() again. '''
+
+        states = set([self.initial_state])
+        states.update(state for symbol, state in self.state_transitions)
+        states.update(self.state_transitions_any)
+        transitions = list(self.state_transitions.values()) + list(self.state_transitions_any.values())
+        if self.default_transition is not None:
+            transitions.append(self.default_transition)
+        states.update(next_state for action, next_state in transitions)
+
+        table = {}
+        for state in states:
+            fallback = self.state_transitions_any.get(state, self.default_transition)
+            table[state] = [fallback] * 128
+        for (symbol, state), transition in self.state_transitions.items():
+            if isinstance(symbol, (str, type(u''))) and len(symbol) == 1 and ord(symbol) < 128:
+                table[state][ord(symbol)] = transition
+        self.table = table
 
     def get_transition (self, input_symbol, state):
 
@@ -236,7 +270,15 @@ class FSM:
         (or a string) by calling process_list(). '''
 
         self.input_symbol = input_symbol
-        (self.action, self.next_state) = self.get_transition (self.input_symbol, self.current_state)
+        transition = None
+        if self.table is not None:
+            try:
+                transition = self.table[self.current_state][ord(input_symbol)]
+            except (KeyError, IndexError, TypeError):
+                pass
+        if transition is None:
+            transition = self.get_transition (self.input_symbol, self.current_state)
+        (self.action, self.next_state) = transition
         if self.action is not None:
             self.action (self)
         self.current_state = self.next_state
@@ -245,10 +287,50 @@ class FSM:
     def process_list (self, input_symbols):
 
         '''This takes a list and sends each element to process(). The list may
-        be a string or any iterable object. '''
-
-        for s in input_symbols:
-            self.process (s)
+        be a string or any iterable object. When the FSM is compiled the
+        whole list is walked here, without a call to process() per symbol. '''
+
+        if self.table is None:
+            for s in input_symbols:
+                self.process (s)
+            return
+        if not hasattr(input_symbols, '__getitem__'):
+            input_symbols = list(input_symbols)
+        self.process_until (input_symbols, 0)
+
+    def process_until (self, input_symbols, start=0, state=None):
+
+        '''This processes the symbols of the sequence input_symbols from
+        index start until the FSM enters the given state, or to the end of the
+        sequence when state is None. At least one symbol is processed. This
+        returns the index after the last symbol processed, so a caller can
+        handle what follows the state itself. The table is read once, changes
+        made by the actions apply from the next call. '''
+
+        table = self.table or {}
+        get_transition = self.get_transition
+        current = self.current_state
+        i = start
+        n = len(input_symbols)
+        while i < n:
+            symbol = input_symbols[i]
+            i += 1
+            self.input_symbol = symbol
+            try:
+                action, next_state = table[current][ord(symbol)]
+            except (KeyError, IndexError, TypeError):
+                # Not in the table: unknown state, symbol outside ASCII or
+                # no transition at all, which get_transition() reports.
+                action, next_state = get_transition (symbol, current)
+            self.action = action
+            self.next_state = next_state
+            if action is not None:
+                action (self)
+            self.current_state = current = next_state
+            self.next_state = None
+            if current == state and state is not None:
+                break
+        return i
 
 ##############################################################################
 # The following is an example that demonstrates the use of the FSM class to
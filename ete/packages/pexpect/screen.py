@@ -24,8 +24,8 @@ PEXPECT LICENSE
 '''
 
 import codecs
-import copy
 import sys
+from array import array
 
 import warnings
 
@@ -57,6 +57,17 @@ PY3 = (sys.version_info[0] >= 3)
 if PY3:
     unicode = str
 
+# Rows are kept as arrays of unicode characters, so a region is filled,
+# copied or read with one slice per row. 'u' is deprecated from Python 3.13
+# in favour of 'w'.
+ROW_TYPECODE = 'w' if sys.version_info >= (3, 13) else 'u'
+
+def row_of (text):
+
+    '''This returns a screen row holding the unicode string text. '''
+
+    return array (ROW_TYPECODE, text)
+
 def constrain (n, min, max):
 
     '''This returns a number, n constrained to the min and max bounds. '''
@@ -69,7 +80,7 @@ def constrain (n, min, max):
 
 class screen:
     '''This object maintains the state of a virtual text screen as a
-    rectangular array. This maintains a virtual cursor position and handles
+    rectangular array, one array of characters per row. This maintains a virtual cursor position and handles
     scrolling as characters are added. This supports most of the methods needed
     by an ANSI text screen. Row and column indexes are 1-based (not zero-based,
     like arrays).
@@ -99,7 +110,7 @@ class screen:
         self.cur_saved_c = 1
         self.scroll_row_start = 1
         self.scroll_row_end = self.rows
-        self.w = [ [SPACE] * self.cols for _ in range(self.rows)]
+        self.w = [ row_of (SPACE * self.cols) for _ in range(self.rows)]
 
     def _decode(self, s):
         '''This converts from the external coding system (as passed to
@@ -115,7 +126,7 @@ class screen:
         string (which, under Python 3.x, is the same as 'str'). The end of each
         screen line is terminated by a newline.'''
 
-        return u'\n'.join ([ u''.join(c) for c in self.w ])
+        return u'\n'.join ([ row.tounicode() for row in self.w ])
 
     if PY3:
         __str__ = _unicode
@@ -133,7 +144,7 @@ class screen:
         __str__/__unicode__ except that lines are not terminated with line
         feeds.'''
 
-        return u''.join ([ u''.join(c) for c in self.w ])
+        return u''.join ([ row.tounicode() for row in self.w ])
 
     def pretty (self):
         '''This returns a copy of the screen as a unicode string with an ASCII
@@ -163,9 +174,9 @@ class screen:
             rs, re = re, rs
         if cs > ce:
             cs, ce = ce, cs
-        for r in range (rs, re+1):
-            for c in range (cs, ce + 1):
-                self.put_abs (r,c,ch)
+        fill = row_of (ch[0] * (ce - cs + 1))
+        for row in self.w[rs-1:re]:
+            row[cs-1:ce] = fill
 
     def cr (self):
         '''This moves the cursor to the beginning (col 1) of the current row.
@@ -228,8 +239,8 @@ class screen:
 
         r = constrain (r, 1, self.rows)
         c = constrain (c, 1, self.cols)
-        for ci in range (self.cols, c, -1):
-            self.put_abs (r,ci, self.get_abs(r,ci-1))
+        row = self.w[r-1]
+        row[c:] = row[c-1:-1]
         self.put_abs (r,c,ch)
 
     def insert (self, ch):
@@ -261,14 +272,35 @@ class screen:
             rs, re = re, rs
         if cs > ce:
             cs, ce = ce, cs
-        sc = []
-        for r in range (rs, re+1):
-            line = u''
-            for c in range (cs, ce + 1):
-                ch = self.get_abs (r,c)
-                line = line + ch
-            sc.append (line)
-        return sc
+        return [ row[cs-1:ce].tounicode() for row in self.w[rs-1:re] ]
+
+    def put_run (self, text):
+        '''This writes a run of printable characters at the cursor, with the
+        same wrapping and scrolling as writing them one at a time: a character
+        written in the last column moves the cursor to the start of the next
+        line, scrolling at the bottom of the scroll region.
+        '''
+
+        if isinstance(text, bytes):
+            text = self._decode(text)
+
+        while text:
+            r = self.cur_r
+            c = self.cur_c
+            room = self.cols - c + 1
+            chunk = text[:room]
+            text = text[room:]
+            self.w[r-1][c-1:c-1+len(chunk)] = row_of (chunk)
+            if len(chunk) < room:
+                self.cur_c = c + len(chunk)
+                continue
+            self.cursor_down ()
+            if r != self.cur_r:
+                self.cursor_home (self.cur_r, 1)
+            else:
+                self.scroll_up ()
+                self.cursor_home (self.cur_r, 1)
+                self.erase_line ()
 
     def cursor_constrain (self):
         '''This keeps the cursor within the screen area.
@@ -363,7 +395,10 @@ class screen:
         # Screen is indexed from 1, but arrays are indexed from 0.
         s = self.scroll_row_start - 1
         e = self.scroll_row_end - 1
-        self.w[s+1:e+1] = copy.deepcopy(self.w[s:e])
+        if e <= s:
+            return
+        # Rows move by reference, only the row left behind is copied.
+        self.w[s:e+1] = [ self.w[s][:] ] + self.w[s:e]
 
     def scroll_up (self): # <ESC>M
         '''Scroll display up one line.'''
@@ -371,7 +406,10 @@ class screen:
         # Screen is indexed from 1, but arrays are indexed from 0.
         s = self.scroll_row_start - 1
         e = self.scroll_row_end - 1
-        self.w[s:e] = copy.deepcopy(self.w[s+1:e+1])
+        if e <= s:
+            return
+        # Rows move by reference, only the row left behind is copied.
+        self.w[s:e+1] = self.w[s+1:e+1] + [ self.w[e][:] ]
 
     def erase_end_of_line (self): # <ESC>[0K -or- <ESC>[K
         '''Erases from the current cursor position to the end of the current
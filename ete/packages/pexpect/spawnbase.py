@@ -4,12 +4,64 @@ import os
 import sys
 import re
 import errno
+import itertools
+import threading
 from .exceptions import ExceptionPexpect, EOF, TIMEOUT
 from .expect import Expecter, searcher_string, searcher_re
 
 PY3 = (sys.version_info[0] >= 3)
 text_type = str if PY3 else unicode
 
+# Pattern lists compiled by compile_pattern_list() and prepared by
+# expect_exact(), shared by all the spawns of the process. The searchers
+# keep the result of their last match, so a fresh one is built from the
+# cached list on every expect. An entry is [last use, patterns]; a hit
+# stamps it, the least recently used entry is evicted on a miss. Both go
+# through the lock, the spawns of a process may expect from several threads.
+PATTERN_CACHE_SIZE = 256
+_pattern_cache = {}
+_pattern_cache_clock = itertools.count()
+_pattern_cache_lock = threading.Lock()
+_pattern_cache_stats = {'hits': 0, 'misses': 0}
+
+def _cached_patterns(key, build):
+    '''Return the pattern list cached for key, else the one build() returns.
+    A key that cannot be hashed is not cached.'''
+
+    try:
+        hash(key)
+    except TypeError:
+        return build()
+    with _pattern_cache_lock:
+        entry = _pattern_cache.get(key)
+        if entry is not None:
+            entry[0] = next(_pattern_cache_clock)
+            _pattern_cache_stats['hits'] += 1
+            return list(entry[1])
+    # Built outside the lock, compiling does not hold up the other lookups
+    patterns = build()
+    with _pattern_cache_lock:
+        _pattern_cache_stats['misses'] += 1
+        if len(_pattern_cache) >= PATTERN_CACHE_SIZE and key not in _pattern_cache:
+            del _pattern_cache[min(_pattern_cache, key=lambda k: _pattern_cache[k][0])]
+        _pattern_cache[key] = [next(_pattern_cache_clock), tuple(patterns)]
+    return patterns
+
+def pattern_cache_info():
+    '''Return the hits, misses, hit rate and size of the pattern cache.'''
+
+    with _pattern_cache_lock:
+        hits, misses = _pattern_cache_stats['hits'], _pattern_cache_stats['misses']
+        size = len(_pattern_cache)
+    return {'hits': hits, 'misses': misses, 'size': size,
+            'maxsize': PATTERN_CACHE_SIZE,
+            'hit_rate': float(hits) / (hits + misses) if hits + misses else 0.0}
+
+def pattern_cache_clear():
+    with _pattern_cache_lock:
+        _pattern_cache.clear()
+        _pattern_cache_stats.update(hits=0, misses=0)
+
 class _NullCoder(object):
     """Pass bytes through unchanged."""
     @staticmethod
@@ -211,6 +263,10 @@ class SpawnBase(object):
                 ...
                 i = self.expect_list(cpl, timeout)
                 ...
+
+        The compiled lists are cached by patterns, flags and encoding, see
+        pattern_cache_info(), so the same patterns are compiled once per
+        process.
         '''
 
         if patterns is None:
@@ -222,6 +278,13 @@ class SpawnBase(object):
         compile_flags = re.DOTALL
         if self.ignorecase:
             compile_flags = compile_flags | re.IGNORECASE
+        # The types are part of the key, 'a' == u'a' on Python 2
+        key = ('re', compile_flags, self.encoding, tuple(patterns),
+               tuple(map(type, patterns)))
+        return _cached_patterns(
+            key, lambda: self._compile_pattern_list(patterns, compile_flags))
+
+    def _compile_pattern_list(self, patterns, compile_flags):
         compiled_pattern_list = []
         for idx, p in enumerate(patterns):
             if isinstance(p, self.allowed_string_types):
@@ -405,10 +468,13 @@ class SpawnBase(object):
             self._pattern_type_err(pattern)
 
         try:
-            pattern_list = iter(pattern_list)
+            pattern_list = list(pattern_list)
         except TypeError:
             self._pattern_type_err(pattern_list)
-        pattern_list = [prepare_pattern(p) for p in pattern_list]
+        key = ('exact', self.encoding, tuple(pattern_list),
+               tuple(map(type, pattern_list)))
+        pattern_list = _cached_patterns(
+            key, lambda: [prepare_pattern(p) for p in pattern_list])
 
         exp = Expecter(self, searcher_string(pattern_list), searchwindowsize)
         if async_:
@@ -0,0 +1,345 @@
+#!/usr/local/bin/python2.7
+
+'''
+Program Name: node.py
+
+Simulated nodes for running the update_*_fw.py scripts, the fleet runner and
+the rollout without hardware.
+
+A simulated node is a directory holding the node state (state.json) and an
+rc file for bash.  The rc file defines shell functions standing in for the
+tools the updaters run (tools.py), under their plain names and the paths
+the updaters call them by (/usr/bin/sumtool, CMD_PATH/sas3flash, ...).
+With FW_UPDATE_SIM_DIR set to the directory of the nodes,
+connection.for_host() returns a LocalConnection running bash with the rc
+file of the host, so the updaters drive the fake shell through the same
+login/sendline path as an SSH session.
+
+The outputs match what the updaters parse, every command sleeps the node
+latency, flashing takes flash_seconds and a reboot makes the node refuse
+logins for reboot_seconds.  Flashing moves a component to the version the
+node is told it gets (updates, by default the version fw_config prefers for
+the model), or fails for the components in fail.
+
+Usage:
+    $ python node.py --dir /tmp/simfleet --nodes 200 --racks 10 --fail-rate 0.02
+    $ export FW_UPDATE_SIM_DIR=/tmp/simfleet
+    $ ../fw_update/rollout_fw.py -f /tmp/simfleet/inventory.txt -c BMC BIOS
+
+Use from Python:
+    with SimFleet('/tmp/simfleet', count=200, latency=0.01) as fleet:
+        ...                   # fleet.hosts are reachable by the updaters
+        print(fleet.versions())
+'''
+import argparse
+import json
+import os
+import random
+import runpy
+import shutil
+import sys
+import zlib
+
+try:
+    from pipes import quote
+except ImportError:
+    from shlex import quote
+
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+package_path = os.path.dirname(this_dir)
+FW_CONFIG = os.path.join(package_path, 'fw_update', 'fw_config.py')
+TOOLS = os.path.join(this_dir, 'tools.py')
+
+# Environment variable read by connection.for_host()
+SIM_DIR_ENV = 'FW_UPDATE_SIM_DIR'
+
+# Commands of the node and the tool of tools.py standing in for them
+COMMANDS = {
+    'ipmitool': 'ipmitool', 'dmidecode': 'dmidecode',
+    'ipmicfg-linux.x86_64': 'ipmicfg', 'ipmicfg': 'ipmicfg',
+    'sumtool': 'sumtool', 'sas3flash': 'sas3flash', 'mlxup': 'mlxup',
+    'ethtool': 'ethtool', 'lspci': 'lspci', 'nvmupdate64e': 'nvmupdate64e',
+    'ip': 'ip', 'reboot': 'reboot',
+}
+
+# Directories the updaters run the tools from, besides fw_config.CMD_PATH
+# and the directories of the NIC images (nvmupdate64e)
+TOOL_DIRS = ('/usr/bin', '/bin', '/usr/sbin', '/sbin')
+
+# Versions a new node reports, older than what fw_config prefers
+VERSIONS = {
+    'BMC': '6.30', 'BIOS': 'PB20.000', 'HBA': '13.00.00.00', 'MCU': '1.10',
+    'MLX': '12.18.1000', 'NIC': '0x800006d1',
+}
+
+# Seconds each flash takes; fdl is the BMC factory default
+FLASH_SECONDS = {
+    'BMC': 10, 'BIOS': 10, 'HBA': 2, 'MCU': 5, 'MLX': 5, 'NIC': 5, 'fdl': 0.5,
+}
+
+_fw_config = None
+
+
+def fw_config():
+    '''Return the names defined by fw_update/fw_config.py.'''
+    global _fw_config
+    if _fw_config is None:
+        _fw_config = runpy.run_path(FW_CONFIG)
+    return _fw_config
+
+
+class SimNode(object):
+    '''A simulated node, the directory root/host.
+
+    The component parts default to those of an NX-1065-G6 (X11DPT-B).
+    flash_seconds is a number for every component or a dict.
+    '''
+
+    def __init__(self, root, host, model='X11DPT-B', part_number='NX-1065-G6',
+                 versions=None, updates=None, hba='SAS3008',
+                 mcu='BPN-SAS3-827BHQ-N3', mlx='MCX414A-BCA_Ax',
+                 nic='15d9:0920', latency=0.05, flash_seconds=None,
+                 reboot_seconds=30, bmc_reset_seconds=10, login_seconds=0,
+                 jitter=0, fail=(), python=sys.executable):
+        self.host = host
+        self.path = os.path.join(os.path.abspath(os.path.expanduser(root)), host)
+        self.state_file = os.path.join(self.path, 'state.json')
+        self.rcfile = os.path.join(self.path, 'rc')
+        self.python = python
+
+        if isinstance(flash_seconds, (int, float)):
+            flash_seconds = dict((k, flash_seconds) for k in FLASH_SECONDS)
+        parts = {'BMC': model, 'BIOS': model, 'HBA': hba, 'MCU': mcu,
+                 'MLX': mlx, 'NIC': nic}
+        self.state = {
+            'host': host, 'model': model, 'part_number': part_number,
+            'chassis': 'CSE-827HQ-R2K04BP2', 'serial': 'ZM18AS{0:06d}'.format(
+                (zlib.crc32(host.encode('utf-8')) & 0xffffffff) % 1000000),
+            'hba': hba, 'mcu': mcu, 'mlx': mlx, 'nic': nic,
+            'nics': {'enp94s0f0': '5e:00.0', 'enp94s0f1': '5e:00.1'},
+            'versions': dict(VERSIONS, **(versions or {})),
+            'updates': dict(self.preferred(parts), **(updates or {})),
+            'pending': {}, 'flashes': {}, 'reboots': 0,
+            'latency': latency,
+            'flash_seconds': dict(FLASH_SECONDS, **(flash_seconds or {})),
+            'reboot_seconds': reboot_seconds,
+            'bmc_reset_seconds': bmc_reset_seconds,
+            'login_seconds': login_seconds, 'jitter': jitter,
+            'fail': list(fail), 'down_until': 0, 'bmc_down_until': 0,
+        }
+
+    @staticmethod
+    def preferred(parts):
+        '''Return the versions fw_config prefers for the parts.'''
+        config = fw_config()
+        prefer = {
+            'BMC': config['BMC_FW_PREFER'], 'BIOS': config['BIOS_FW_PREFER'],
+            'HBA': config['HBA_FW_PREFER'], 'MCU': config['MCU_FW_PREFER'],
+            'MLX': config['NIC_FW_PREFER'], 'NIC': config['NIC_FW_PREFER'],
+        }
+        return dict((component, prefer[component][part])
+                    for component, part in parts.items()
+                    if prefer[component].get(part, '').strip())
+
+    def create(self):
+        '''Write the state and the rc file of the node.'''
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        with open(self.state_file, 'w') as f:
+            json.dump(self.state, f, indent=4, sort_keys=True)
+        with open(self.rcfile, 'w') as f:
+            f.write(self.rc())
+        return self
+
+    def rc(self):
+        '''Return the bash rc file of the node.'''
+        lines = [
+            '# Simulated node {0}, written by sim/node.py'.format(self.host),
+            '_sim() {',
+            '    {0} {1} {2} "$@"'.format(quote(self.python), quote(TOOLS),
+                                          quote(self.state_file)),
+            '    local status=$?',
+            '    # The node went down, drop the session as sshd would',
+            '    [ $status -eq 200 ] && exit 0',
+            '    return $status',
+            '}',
+            '_sim login || exit 255',
+            '# The node has every firmware image',
+            'function ls {',
+            '    case "$1" in',
+            '        {0}/*) echo "$1" ;;'.format(quote(fw_config()['IMGS_PATH'])),
+            '        *) command ls "$@" ;;',
+            '    esac',
+            '}',
+            '# and its sysfs files are read from its state',
+            'function grep {',
+            '    case "$*" in',
+            '        */sys/*) _sim sysfs "$@" ;;',
+            '        *) command grep "$@" ;;',
+            '    esac',
+            '}',
+        ]
+        for command, tool in sorted(self.commands().items()):
+            lines.append('function {0} {{ _sim {1} "$@"; }}'.format(command, tool))
+        return '\n'.join(lines) + '\n'
+
+    def commands(self):
+        '''Return {command or path: tool} for every function of the rc file.'''
+        config = fw_config()
+        dirs = set(TOOL_DIRS) | set([config['CMD_PATH']])
+        commands = {}
+        for name, tool in COMMANDS.items():
+            commands[name] = tool
+            for d in dirs:
+                commands[os.path.join(d, name)] = tool
+        # nvmupdate64e runs from the directory of the NIC image
+        for image in config['NIC_FW_FILES'].values():
+            if '/intc/' in image:
+                path = os.path.join(os.path.dirname(image), 'nvmupdate64e')
+                commands[path] = 'nvmupdate64e'
+        return commands
+
+    def read(self):
+        '''Return the current state of the node.'''
+        with open(self.state_file) as f:
+            return json.load(f)
+
+    def update(self, **state):
+        '''Change the state of a created node, eg. update(fail=['BIOS']).'''
+        current = self.read()
+        current.update(state)
+        tmp = self.state_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(current, f, indent=4, sort_keys=True)
+        os.rename(tmp, self.state_file)
+
+
+class SimFleet(object):
+    '''count simulated nodes (or one per host of hosts) under root.
+
+    The nodes are spread over racks, one PDU per rack, for the rollout
+    inventory.  fail_rate of the nodes fail every flash.  The other keyword
+    arguments go to every SimNode.
+    '''
+
+    def __init__(self, root, count=0, hosts=None, prefix='sim', racks=1,
+                 fail_rate=0, seed=None, **node_options):
+        self.root = os.path.abspath(os.path.expanduser(root))
+        self.hosts = list(hosts or ['{0}-{1:04d}'.format(prefix, i + 1)
+                                    for i in range(count)])
+        self.racks = max(1, racks)
+        rand = random.Random(seed)
+        self.nodes = []
+        for host in self.hosts:
+            options = dict(node_options)
+            if fail_rate and rand.random() < fail_rate:
+                options['fail'] = list(VERSIONS)
+            self.nodes.append(SimNode(self.root, host, **options))
+        self._saved_env = None
+
+    def create(self):
+        '''Write the nodes and the inventory; returns self.'''
+        for node in self.nodes:
+            node.create()
+        self.inventory()
+        return self
+
+    def inventory(self, path=None):
+        '''Write the rollout inventory of the fleet and return its path.'''
+        path = path or os.path.join(self.root, 'inventory.txt')
+        per_rack = -(-len(self.hosts) // self.racks)
+        with open(path, 'w') as f:
+            for index, host in enumerate(self.hosts):
+                rack = index // max(per_rack, 1) + 1
+                f.write('{0} rack=r{1:02d} pdu=r{1:02d}-pdu\n'.format(host, rack))
+        return path
+
+    def failing(self):
+        '''Return the hosts set up to fail.'''
+        return [node.host for node in self.nodes if node.state['fail']]
+
+    def versions(self):
+        '''Return {host: {component: version}} as the nodes report them.'''
+        return dict((node.host, node.read()['versions']) for node in self.nodes)
+
+    def activate(self):
+        '''Point connection.for_host() at the fleet, in this process and the
+        processes it starts.'''
+        self._saved_env = os.environ.get(SIM_DIR_ENV)
+        os.environ[SIM_DIR_ENV] = self.root
+
+    def deactivate(self):
+        if self._saved_env is None:
+            os.environ.pop(SIM_DIR_ENV, None)
+        else:
+            os.environ[SIM_DIR_ENV] = self._saved_env
+
+    def remove(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def __enter__(self):
+        self.create()
+        self.activate()
+        return self
+
+    def __exit__(self, *exc):
+        self.deactivate()
+        self.remove()
+        return False
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Create a fleet of simulated nodes')
+    parser.add_argument('--dir', default='~/simfleet',
+                        help='directory of the nodes, FW_UPDATE_SIM_DIR')
+    parser.add_argument('--nodes', type=int, default=100, help='number of nodes')
+    parser.add_argument('--prefix', default='sim', help='host name prefix')
+    parser.add_argument('--racks', type=int, default=1,
+                        help='racks the nodes are spread over')
+    parser.add_argument('--model', default='X11DPT-B', help='baseboard model')
+    parser.add_argument('--part-number', default='NX-1065-G6',
+                        help='product part number')
+    for component in sorted(VERSIONS):
+        parser.add_argument('--{0}'.format(component.lower()), default=None,
+                            help='current {0} version'.format(component))
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='seconds every command takes')
+    parser.add_argument('--flash-seconds', type=float, default=None,
+                        help='seconds every flash takes')
+    parser.add_argument('--reboot-seconds', type=float, default=30,
+                        help='seconds the node is down after a reboot')
+    parser.add_argument('--bmc-reset-seconds', type=float, default=10,
+                        help='seconds the BMC is down after a cold reset')
+    parser.add_argument('--login-seconds', type=float, default=0,
+                        help='seconds a login takes')
+    parser.add_argument('--jitter', type=float, default=0,
+                        help='spread of the times, eg. 0.2 for +/-20%%')
+    parser.add_argument('--fail-rate', type=float, default=0,
+                        help='fraction of the nodes whose flashes fail')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='seed picking the failing nodes')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    versions = dict((c, getattr(args, c.lower())) for c in VERSIONS
+                    if getattr(args, c.lower()))
+    fleet = SimFleet(
+        args.dir, args.nodes, prefix=args.prefix, racks=args.racks,
+        fail_rate=args.fail_rate, seed=args.seed, model=args.model,
+        part_number=args.part_number, versions=versions,
+        latency=args.latency, flash_seconds=args.flash_seconds,
+        reboot_seconds=args.reboot_seconds,
+        bmc_reset_seconds=args.bmc_reset_seconds,
+        login_seconds=args.login_seconds, jitter=args.jitter).create()
+    print('{0} simulated nodes in {1}, {2} failing'.format(
+        len(fleet.hosts), fleet.root, len(fleet.failing())))
+    print('    export {0}={1}'.format(SIM_DIR_ENV, fleet.root))
+    print('    rollout_fw.py -f {0}'.format(os.path.join(fleet.root, 'inventory.txt')))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,361 @@
+#!/usr/local/bin/python2.7
+
+'''
+Program Name: redfish_server.py
+
+Local stand-in for a BMC's Redfish service, used to exercise lib/redfish.py
+and the --redfish mode of the updaters without hardware.
+
+It serves the service root, a Systems collection reporting the baseboard
+model, the UpdateService with its FirmwareInventory, and accepts firmware
+images on the HttpPushUri (plain or chunked body).  Each upload starts a task
+that completes after --flash-seconds and then reports the new version in the
+inventory.  A BMC update is followed by a reset: the service answers 503 for
+--reset-seconds and reports the new BMC version once it is back.  Connections are kept alive (HTTP/1.1) so connection reuse by the
+client can be checked with the per-server connection counter.  Resources carry
+an ETag and answer 304 to a matching If-None-Match, the FirmwareInventory
+collection honours $expand.
+
+Usage:
+    $ python redfish_server.py --port 8000 --model X11DPT-B --bmc 6.30
+    $ python update_bmc_fw.py --redfish http://127.0.0.1:8000
+
+Use from Python:
+    server = RedfishServer(model='X11DPT-B', versions={'BMC': '6.30'})
+    server.start()            # serves on server.url in a background thread
+    ...
+    server.stop()
+'''
+import argparse
+import base64
+import hashlib
+import itertools
+import json
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import unquote
+
+
+ROOT = '/redfish/v1/'
+PUSH_URI = ROOT + 'UpdateService/upload'
+INVENTORY = ROOT + 'UpdateService/FirmwareInventory'
+TASKS = ROOT + 'TaskService/Tasks'
+
+# Seconds between the end of a BMC update task and the reset of the BMC
+RESET_DELAY = 0.5
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'RedfishStandIn/1.0'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, fmt, *args)
+
+    def _send(self, status, body=None, headers=None):
+        data = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('OData-Version', '4.0')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status, message):
+        self._send(status, {'error': {
+            'code': 'Base.1.0.GeneralError', 'message': message,
+            '@Message.ExtendedInfo': [{'Message': message}]}})
+
+    def _authorized(self):
+        if self.server.credentials is None:
+            return True
+        header = self.headers.get('Authorization', '')
+        if not header.startswith('Basic '):
+            return False
+        try:
+            user, password = base64.b64decode(header[6:]).decode('utf-8').split(':', 1)
+        except (TypeError, ValueError):
+            return False
+        return (user, password) == self.server.credentials
+
+    def _read_body(self, sink):
+        '''Feed the request body to sink, plain or chunked.'''
+        if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+            while True:
+                size = int(self.rfile.readline().split(b';')[0].strip(), 16)
+                if size == 0:
+                    # Trailers end with an empty line
+                    while self.rfile.readline().strip():
+                        pass
+                    return True
+                sink(self.rfile.read(size))
+                self.rfile.readline()
+        length = int(self.headers.get('Content-Length') or 0)
+        while length > 0:
+            chunk = self.rfile.read(min(length, 64 * 1024))
+            if not chunk:
+                break
+            length -= len(chunk)
+            sink(chunk)
+        return False
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests += 1
+        if self.server.resetting():
+            return self._error(503, 'The BMC is resetting')
+        if not self._authorized():
+            return self._error(401, 'Unauthorized')
+        path, _, query = self.path.partition('?')
+        resource = self.server.resource(path, expand='$expand' in unquote(query))
+        if resource is None:
+            return self._error(404, 'Resource {} not found'.format(self.path))
+        if 'TaskState' in resource:
+            status = 202 if resource['TaskState'] == 'Running' else 200
+            return self._send(status, resource)
+
+        etag = '"{}"'.format(hashlib.sha1(
+            json.dumps(resource, sort_keys=True).encode('utf-8')).hexdigest()[:16])
+        if self.headers.get('If-None-Match') == etag:
+            with self.server.lock:
+                self.server.not_modified += 1
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self._send(200, resource, {'ETag': etag})
+
+    def do_POST(self):
+        with self.server.lock:
+            self.server.requests += 1
+        if self.server.resetting():
+            return self._error(503, 'The BMC is resetting')
+        if not self._authorized():
+            return self._error(401, 'Unauthorized')
+        if self.path.split('?')[0] != PUSH_URI:
+            return self._error(405, 'POST not allowed on {}'.format(self.path))
+        digest = hashlib.sha256()
+        received = [0]
+
+        def sink(data):
+            digest.update(data)
+            received[0] += len(data)
+
+        chunked = self._read_body(sink)
+        task = self.server.start_task(received[0], digest.hexdigest(), chunked)
+        self._send(202, task, {'Location': task['@odata.id']})
+
+
+class RedfishServer(ThreadingMixIn, HTTPServer):
+    '''Redfish stand-in serving one node.
+
+    versions maps the FirmwareInventory member ids to their versions, an
+    upload updates the member next_component (default: BMC) to
+    next_version once its task completes, or once the BMC is back from the
+    reset_seconds reset that follows an update of the BMC.
+    '''
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, model='X11DPT-B',
+                 versions=None, credentials=('ADMIN', 'ADMIN'),
+                 flash_seconds=0.5, next_component=None, next_version=None,
+                 fail_updates=False, reset_seconds=1, verbose=False):
+        HTTPServer.__init__(self, (host, port), Handler)
+        self.model = model
+        self.versions = dict(versions or {'BMC': '6.30', 'BIOS': 'PB20.000'})
+        self.credentials = tuple(credentials) if credentials else None
+        self.flash_seconds = flash_seconds
+        self.next_component = next_component or (
+            'BMC' if 'BMC' in self.versions else sorted(self.versions)[0])
+        self.next_version = next_version
+        self.fail_updates = fail_updates
+        self.reset_seconds = reset_seconds
+        self.reset = None
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.tasks = {}
+        self.uploads = []
+        self.connections = 0
+        self.requests = 0
+        self.not_modified = 0
+        self._ids = itertools.count(1)
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self.server_address[:2])
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def resetting(self):
+        '''Return True while the BMC resets after an update.'''
+        with self.lock:
+            if self.reset is None:
+                return False
+            starts, ends, version = self.reset
+            now = time.time()
+            if now >= ends:
+                # Back up running the new firmware
+                if version:
+                    self.versions['BMC'] = version
+                self.reset = None
+                return False
+            return now >= starts
+
+    def start_task(self, size, sha256, chunked):
+        with self.lock:
+            task_id = str(next(self._ids))
+            self.uploads.append({'size': size, 'sha256': sha256, 'chunked': chunked})
+            task = {
+                '@odata.id': '{}/{}'.format(TASKS, task_id), 'Id': task_id,
+                'Name': 'Firmware update', 'TaskState': 'Running',
+                'TaskStatus': 'OK', 'PercentComplete': 0, 'Messages': [],
+                'started': time.time(),
+            }
+            self.tasks[task_id] = task
+            return self._task_view(task)
+
+    def _advance(self, task):
+        '''Move task forward according to the time since the upload.'''
+        if task['TaskState'] != 'Running':
+            return
+        progress = (time.time() - task['started']) / max(self.flash_seconds, 1e-6)
+        if progress < 1:
+            task['PercentComplete'] = int(progress * 100)
+            return
+        task['PercentComplete'] = 100
+        if self.fail_updates:
+            task.update(TaskState='Exception', TaskStatus='Critical',
+                        Messages=[{'Message': 'Image verification failed'}])
+        else:
+            task['TaskState'] = 'Completed'
+            if self.next_component == 'BMC':
+                starts = time.time() + RESET_DELAY
+                self.reset = (starts, starts + self.reset_seconds,
+                              self.next_version)
+            elif self.next_version:
+                self.versions[self.next_component] = self.next_version
+
+    def _task_view(self, task):
+        return dict((k, v) for k, v in task.items() if k != 'started')
+
+    def _member(self, member):
+        return {'@odata.id': '{}/{}'.format(INVENTORY, member), 'Id': member,
+                'Name': '{} Firmware'.format(member),
+                'Version': self.versions[member], 'Updateable': True}
+
+    def resource(self, path, expand=False):
+        '''Return the resource at path or None.
+
+        With expand the members of the FirmwareInventory are inlined.
+        '''
+        path = path.rstrip('/')
+        if path + '/' == ROOT:
+            path = ROOT
+        with self.lock:
+            if path == ROOT:
+                return {'@odata.id': ROOT, 'Id': 'RootService',
+                        'RedfishVersion': '1.6.0',
+                        'ProtocolFeaturesSupported': {'ExpandQuery': {
+                            'ExpandAll': False, 'Levels': True,
+                            'MaxLevels': 1, 'NoLinks': False, 'Links': False}},
+                        'Systems': {'@odata.id': ROOT + 'Systems'},
+                        'UpdateService': {'@odata.id': ROOT + 'UpdateService'}}
+            if path == ROOT + 'Systems':
+                return {'@odata.id': path, 'Members@odata.count': 1,
+                        'Members': [{'@odata.id': ROOT + 'Systems/1'}]}
+            if path == ROOT + 'Systems/1':
+                return {'@odata.id': path, 'Id': '1', 'Model': self.model,
+                        'Manufacturer': 'Supermicro',
+                        'BiosVersion': self.versions.get('BIOS', '')}
+            if path == ROOT + 'UpdateService':
+                return {'@odata.id': path, 'ServiceEnabled': True,
+                        'HttpPushUri': PUSH_URI,
+                        'FirmwareInventory': {'@odata.id': INVENTORY}}
+            if path == INVENTORY:
+                members = [self._member(k) if expand else
+                           {'@odata.id': '{}/{}'.format(INVENTORY, k)}
+                           for k in sorted(self.versions)]
+                return {'@odata.id': path, 'Members': members,
+                        'Members@odata.count': len(members)}
+            if path.startswith(INVENTORY + '/'):
+                member = path[len(INVENTORY) + 1:]
+                if member in self.versions:
+                    return self._member(member)
+            if path.startswith(TASKS + '/'):
+                task = self.tasks.get(path[len(TASKS) + 1:])
+                if task is not None:
+                    self._advance(task)
+                    return self._task_view(task)
+        return None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Serve a Redfish stand-in for one node')
+    parser.add_argument('--host', default='127.0.0.1', help='address to bind')
+    parser.add_argument('--port', type=int, default=8000, help='port to bind')
+    parser.add_argument('--model', default='X11DPT-B', help='baseboard model')
+    parser.add_argument('--bmc', default='6.30', help='BMC firmware version')
+    parser.add_argument('--bios', default='PB20.000', help='BIOS firmware version')
+    parser.add_argument('--username', default='ADMIN', help='BMC username')
+    parser.add_argument('--password', default='ADMIN', help='BMC password')
+    parser.add_argument('--flash-seconds', type=float, default=5,
+                        help='time an update task takes to complete')
+    parser.add_argument('--next-component', default='BMC',
+                        help='inventory member an upload updates')
+    parser.add_argument('--next-version', default=None,
+                        help='version reported after an update')
+    parser.add_argument('--fail-updates', action='store_true',
+                        help='make every update task fail')
+    parser.add_argument('--reset-seconds', type=float, default=10,
+                        help='time the BMC takes to reset after an update')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    server = RedfishServer(
+        args.host, args.port, args.model, {'BMC': args.bmc, 'BIOS': args.bios},
+        (args.username, args.password), args.flash_seconds,
+        args.next_component, args.next_version, args.fail_updates,
+        args.reset_seconds, verbose=True)
+    print('Redfish stand-in for {} on {}'.format(args.model, server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,495 @@
+'''
+Program Name: tools.py
+
+Stand-ins for the node tools the updaters run, used by the simulated nodes
+of node.py.  The rc file of a simulated node defines shell functions for
+ipmitool, dmidecode, ipmicfg-linux.x86_64, sumtool, sas3flash, mlxup,
+ethtool, lspci, nvmupdate64e, ip and reboot (under their plain names and
+the paths the updaters call them by), and grep over /sys files, that run:
+
+    python tools.py STATE_FILE TOOL [ARGS...]
+
+Each tool prints what the real one prints on a Supermicro node, sleeps the
+configured latency, and reads or updates the node state in STATE_FILE.  A
+flashed version becomes current when the real one would: the BMC after its
+cold reset, the BIOS, MLX and NIC after a host reboot, the HBA and the MCU
+right away.
+
+The exit status DOWN tells the shell function that the node went down (a
+reboot or a power cycle); it then exits the shell, which the session sees
+as the connection dropping.
+'''
+import fnmatch
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+
+# Exit status of a tool that took the host down
+DOWN = 200
+
+# Exit status of a login to a host that is down, as ssh
+UNREACHABLE = 255
+
+# When a flashed version becomes current
+ON_FLASH, ON_BMC_RESET, ON_REBOOT = 'flash', 'bmc_reset', 'reboot'
+ACTIVATION = {
+    'BMC': ON_BMC_RESET, 'BIOS': ON_REBOOT, 'HBA': ON_FLASH,
+    'MCU': ON_FLASH, 'MLX': ON_REBOOT, 'NIC': ON_REBOOT,
+}
+
+
+class Node(object):
+    '''The state of a simulated node, a json file.'''
+
+    def __init__(self, path):
+        self.path = path
+        with open(path) as f:
+            self.state = json.load(f)
+
+    def __getitem__(self, key):
+        return self.state[key]
+
+    def save(self):
+        # Written aside and renamed, a reader never sees half a file
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.state, f, indent=4, sort_keys=True)
+        os.rename(tmp, self.path)
+
+    def wait(self, seconds):
+        '''Sleep seconds, spread by the jitter of the node.'''
+        jitter = self.state.get('jitter', 0)
+        if jitter:
+            seconds *= random.uniform(1 - jitter, 1 + jitter)
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def query(self):
+        self.wait(self.state['latency'])
+
+    def bmc_up(self):
+        return time.time() >= self.state['bmc_down_until']
+
+    def flash(self, component, version=None, dots=0):
+        '''Take the flash time of component, return False if it fails.
+
+        dots progress dots are printed over the flash time.
+        '''
+        seconds = self.state['flash_seconds'].get(component, 0)
+        for _ in range(dots):
+            self.wait(float(seconds) / dots)
+            sys.stdout.write('.')
+            sys.stdout.flush()
+        if not dots:
+            self.wait(seconds)
+        if component in self.state['fail']:
+            return False
+        version = version or self.state['updates'].get(component)
+        if version:
+            if ACTIVATION[component] == ON_FLASH:
+                self.state['versions'][component] = version
+            else:
+                self.state['pending'][component] = version
+            self.state['flashes'][component] = self.state['flashes'].get(component, 0) + 1
+            self.save()
+        return True
+
+    def activate(self, when):
+        '''Make current the pending versions activated by when.'''
+        for component in list(self.state['pending']):
+            if ACTIVATION[component] == when:
+                self.state['versions'][component] = self.state['pending'].pop(component)
+
+    def reboot(self):
+        '''Take the host down for reboot_seconds.'''
+        self.activate(ON_REBOOT)
+        self.state['reboots'] += 1
+        self.state['down_until'] = time.time() + self.state['reboot_seconds']
+        self.save()
+        return DOWN
+
+
+''' ------------------------------- login -----------------------------------'''
+def login(node, args):
+    node.wait(node['login_seconds'])
+    if time.time() < node['down_until']:
+        print('ssh: connect to host {0} port 22: No route to host'.format(node['host']))
+        return UNREACHABLE
+    return 0
+
+
+''' ------------------------------ ipmitool ---------------------------------'''
+def ipmitool(node, args):
+    node.query()
+    if not node.bmc_up():
+        print('Could not open device at /dev/ipmi0 or /dev/ipmi/0 or '
+              '/dev/ipmidev/0: No such file or directory')
+        return 1
+    command = ' '.join(a for a in args if not a.startswith('-'))
+    if command.startswith('fru'):
+        print('FRU Device Description : Builtin FRU Device (ID 0)')
+        print(' Chassis Type          : Other')
+        print(' Chassis Part Number   : {0}'.format(node['chassis']))
+        print(' Chassis Serial        : {0}'.format(node['serial']))
+        print(' Board Mfg Date        : Mon Jan  1 00:00:00 2018')
+        print(' Board Mfg             : Supermicro')
+        print(' Board Product         : {0}'.format(node['model']))
+        print(' Board Serial          : {0}'.format(node['serial']))
+        print(' Board Part Number     : {0}'.format(node['model']))
+        print(' Product Manufacturer  : Nutanix')
+        print(' Product Name          : {0}'.format(node['part_number']))
+        print(' Product Part Number   : {0}'.format(node['part_number']))
+        print(' Product Version       : NONE')
+        print(' Product Serial        : {0}'.format(node['serial']))
+    elif command.startswith('mc info'):
+        print('Device ID                 : 32')
+        print('Device Revision           : 1')
+        print('Firmware Revision         : {0}'.format(node['versions']['BMC']))
+        print('IPMI Version              : 2.0')
+        print('Manufacturer ID           : 10876')
+        print('Manufacturer Name         : Supermicro')
+    elif command.startswith('bmc reset cold') or command.startswith('mc reset cold'):
+        print('Sent cold reset command to MC')
+        node.activate(ON_BMC_RESET)
+        node.state['bmc_down_until'] = time.time() + node['bmc_reset_seconds']
+        node.save()
+    elif command.startswith('chassis power cycle') or command.startswith('chassis power reset'):
+        print('Chassis Power Control: {0}'.format(args[-1].capitalize()))
+        sys.stdout.flush()
+        return node.reboot()
+    elif command.startswith('chassis power status'):
+        print('Chassis Power is on')
+    else:
+        print('Invalid command: "{0}"'.format(command))
+        return 1
+    return 0
+
+
+''' ------------------------------ dmidecode --------------------------------'''
+def dmidecode(node, args):
+    node.query()
+    kind = args[args.index('-t') + 1] if '-t' in args else ''
+    print('# dmidecode 3.1')
+    print('Getting SMBIOS data from sysfs.')
+    print('SMBIOS 3.1.1 present.')
+    print('')
+    if kind in ('bios', '0'):
+        print('Handle 0x0000, DMI type 0, 26 bytes')
+        print('BIOS Information')
+        print('\tVendor: American Megatrends Inc.')
+        print('\tVersion: {0}'.format(node['versions']['BIOS']))
+        print('\tRelease Date: 01/22/2018')
+        print('\tAddress: 0xF0000')
+        print('\tRuntime Size: 64 kB')
+        print('\tROM Size: 32 MB')
+    elif kind in ('baseboard', '2'):
+        print('Handle 0x0002, DMI type 2, 15 bytes')
+        print('Base Board Information')
+        print('\tManufacturer: Supermicro')
+        print('\tProduct Name: {0}'.format(node['model']))
+        print('\tVersion: 1.01')
+        print('\tSerial Number: {0}'.format(node['serial']))
+        print('\tAsset Tag: To be filled by O.E.M.')
+    else:
+        print('Invalid type keyword: {0}'.format(kind))
+        return 2
+    return 0
+
+
+''' ------------------------------- ipmicfg ---------------------------------'''
+def ipmicfg(node, args):
+    node.query()
+    if not node.bmc_up():
+        print('Can not connect to IPMI device.')
+        return 1
+    if args[:1] == ['-ver']:
+        print('Firmware Version: {0}'.format(node['versions']['BMC']))
+    elif args[:1] == ['-fdl']:
+        node.wait(node['flash_seconds'].get('fdl', 0))
+        print('Reset to the factory default completed.')
+    elif args[:2] == ['-tp', 'info']:
+        print(' Backplane Information')
+        print(' ---------------------')
+        print(' Part Number      : {0}'.format(node['mcu']))
+        print(' MCU Version      : {0}'.format(node['versions']['MCU']))
+        print(' Board ID         : 0x{0:02x}'.format(7))
+    elif args[:2] == ['-tp', 'mcuupdate']:
+        print('Updating MCU firmware, do not power off the system')
+        sys.stdout.write('Updating ')
+        if not node.flash('MCU', dots=20):
+            print(' Update failed. (Error: 0x0C)')
+            return 1
+        print(' (100%)')
+        print('Done.')
+    else:
+        print('Invalid option: {0}'.format(' '.join(args)))
+        return 1
+    return 0
+
+
+''' ------------------------------- sumtool ---------------------------------'''
+def sumtool(node, args):
+    print('Supermicro Update Manager (for UEFI BIOS) 2.0.0 (2018/01/11) (x86_64)')
+    print('Copyright(C) 2013-2018 Super Micro Computer, Inc. All rights reserved.')
+    print('')
+    command = args[args.index('-c') + 1] if '-c' in args else ''
+    if command == 'UpdateBmc':
+        print('Uploading Image ..................... (100%)')
+        sys.stdout.flush()
+        if not node.flash('BMC'):
+            print('ERROR: BMC firmware update failed (ExitCode = 30)')
+            return 30
+        print('Updating BMC ........................ (100%)')
+        print('Update Complete')
+        print('Please wait for BMC reboot, about 1 or 2 mins')
+    elif command == 'UpdateBios':
+        print('Reading BIOS flash ..................... (100%)')
+        sys.stdout.flush()
+        if not node.flash('BIOS'):
+            print('ERROR: BIOS flash failed (ExitCode = 87)')
+            return 87
+        print('Writing BIOS flash ..................... (100%)')
+        print('Verifying BIOS flash ................... (100%)')
+        print('WARNING:Must power cycle or restart the system for new BIOS to take effect!')
+    elif command == 'LoadDefaultBiosCfg':
+        node.query()
+        print('The default BIOS configuration is loaded.')
+    else:
+        node.query()
+        print('ERROR: Unknown command {0}'.format(command))
+        return 1
+    return 0
+
+
+''' ------------------------------ sas3flash --------------------------------'''
+def sas3flash(node, args):
+    node.query()
+    print('        Avago Technologies SAS3 Flash Utility')
+    print('        Version 16.00.00.00 (2017.05.02)')
+    print('        Copyright 2008-2017 Avago Technologies. All rights reserved.')
+    print('')
+    print('        Adapter Selected is a Avago SAS: {0}(C0)'.format(node['hba']))
+    print('')
+    if '-listall' in args:
+        print('Num   Ctlr            FW Ver        NVDATA        x86-BIOS         PCI Addr')
+        print('-' * 76)
+        print('')
+        print('0  {0}(C0)  {1}    0e.01.00.07    08.37.00.00     00:01:00:00'.format(
+            node['hba'], node['versions']['HBA']))
+    elif '-list' in args:
+        print('        Controller Number              : 0')
+        print('        Controller                     : {0}(C0)'.format(node['hba']))
+        print('        PCI Address                    : 00:01:00:00')
+        print('        SAS Address                    : 5003048-0-1e0a-8d00')
+        print('        NVDATA Version (Default)       : 0e.01.00.07')
+        print('        Firmware Product ID            : 0x2221 (IT)')
+        print('        Firmware Version               : {0}'.format(node['versions']['HBA']))
+        print('        NVDATA Vendor                  : LSI')
+        print('        BIOS Version                   : 08.37.00.00')
+        print('        Board Name                     : LSI{0}-IT'.format(node['hba'][3:]))
+    elif '-f' in args or '-b' in args:
+        image = args[args.index('-f' if '-f' in args else '-b') + 1]
+        print('        Executing Operation: Flash {0}'.format(
+            'Firmware Image' if '-f' in args else 'BIOS Image'))
+        print('')
+        if '-f' in args:
+            ok = node.flash('HBA')
+        else:
+            # The BIOS images of the controller do not change its version
+            node.query()
+            ok = 'HBA' not in node['fail']
+        if not ok:
+            print('        Firmware Image Validation Failed!')
+            print('        Due To Exception Command not Completed Successfully.')
+            return 1
+        print('                Firmware Image has a Valid Checksum.')
+        print('                Flash {0} Image Successfully.'.format(os.path.basename(image)))
+    print('')
+    print('        Finished Processing Commands Successfully.')
+    print('        Exiting SAS3Flash.')
+    return 0
+
+
+''' -------------------------------- mlxup ----------------------------------'''
+def mlxup(node, args):
+    node.query()
+    print('Querying Mellanox devices firmware ...')
+    print('')
+    if '-query' in args or '--query' in args:
+        print('Device #1:')
+        print('----------')
+        print('')
+        print('  Device Type:      ConnectX4')
+        print('  Part Number:      {0}'.format(node['mlx']))
+        print('  Description:      ConnectX-4 EN network interface card; 40/56GbE dual-port QSFP28')
+        print('  PSID:             MT_2130110027')
+        print('  PCI Device Name:  0000:3b:00.0')
+        print('  Versions:         Current        Available')
+        print('     FW             {0}     N/A'.format(node['versions']['MLX']))
+        print('     PXE            3.5.0210       N/A')
+        print('')
+        print('  Status:           No matching image found')
+        return 0
+    # Nothing with a '#' before Done, the updater waits for the first '#'
+    sys.stdout.write('Burning FW image without signatures - ')
+    sys.stdout.flush()
+    if not node.flash('MLX'):
+        print('FAILED')
+        print('-E- Burning FS3 image failed')
+        return 1
+    print('Done')
+    print('Restart needed for updates to take effect.')
+    return 0
+
+
+''' ------------------------------- ethtool ---------------------------------'''
+def ethtool(node, args):
+    node.query()
+    dev = args[-1]
+    nic = node['nics'].get(dev)
+    if nic is None:
+        print('Cannot get driver information: No such device')
+        return 71
+    print('driver: ixgbe')
+    print('version: 5.1.0-k')
+    print('firmware-version: {0}'.format(node['versions']['NIC']))
+    print('expansion-rom-version: ')
+    print('bus-info: 0000:{0}'.format(nic))
+    print('supports-statistics: yes')
+    print('supports-test: yes')
+    print('supports-eeprom-access: yes')
+    print('supports-register-dump: yes')
+    print('supports-priv-flags: yes')
+    return 0
+
+
+''' -------------------------------- lspci ----------------------------------'''
+def lspci(node, args):
+    node.query()
+    bus = args[args.index('-s') + 1] if '-s' in args else ''
+    # -s takes the slot with or without its domain, as ethtool prints it
+    if bus.count(':') == 2 and bus.startswith('0000:'):
+        bus = bus[len('0000:'):]
+    if bus not in node['nics'].values():
+        return 0
+    print('{0} 0200: 8086:1563 (rev 01)'.format(bus))
+    print('\tSubsystem: {0}'.format(node['nic']))
+    print('\tFlags: bus master, fast devsel, latency 0, IRQ 48, NUMA node 0')
+    print('\tMemory at c5000000 (64-bit, prefetchable) [size=4M]')
+    print('\tCapabilities: [40] Power Management version 3')
+    print('\tKernel driver in use: ixgbe')
+    return 0
+
+
+''' ---------------------------------- ip -----------------------------------'''
+def ip(node, args):
+    if not args or args[0] not in ('a', 'addr', 'address', 'l', 'link'):
+        print('Object "{0}" is unknown, try "ip help".'.format(' '.join(args)))
+        return 1
+    print('1: lo: <LOOPBACK,UP,LOWER_UP> mtu 65536 qdisc noqueue state UNKNOWN')
+    print('    link/loopback 00:00:00:00:00:00 brd 00:00:00:00:00:00')
+    for index, dev in enumerate(sorted(node['nics']), 2):
+        print('{0}: {1}: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1500 qdisc mq state UP'.format(index, dev))
+        print('    link/ether ac:1f:6b:00:00:{0:02x} brd ff:ff:ff:ff:ff:ff'.format(index))
+    return 0
+
+
+''' ----------------------------- nvmupdate64e ------------------------------'''
+def nvmupdate64e(node, args):
+    node.query()
+    print('Intel(R) Ethernet NVM Update Tool')
+    print('NVMUpdate version 1.30.2.1')
+    print('Copyright (C) 2013 - 2017 Intel Corporation.')
+    print('')
+    print('Config file read.')
+    print('Inventory')
+    print('[00:094:00:00]: Intel(R) Ethernet Controller X550-AT2')
+    print('    Flash inventory started.')
+    print('    Flash inventory finished.')
+    print('Update')
+    sys.stdout.flush()
+    if not node.flash('NIC'):
+        print('    Flash update failed.')
+        print('Tool execution completed with the following status: An error occurred')
+        return 1
+    print('    Flash update successful.')
+    print('Power cycle is required to complete the update process.')
+    print('Tool execution completed with the following status: All operations '
+          'completed successfully')
+    return 0
+
+
+''' -------------------------------- sysfs ----------------------------------'''
+def _uevent(slot, driver, pci_class, pci_id, subsys_id):
+    return ['DRIVER={0}'.format(driver), 'PCI_CLASS={0}'.format(pci_class),
+            'PCI_ID={0}'.format(pci_id.upper()),
+            'PCI_SUBSYS_ID={0}'.format(subsys_id.upper()),
+            'PCI_SLOT_NAME=0000:{0}'.format(slot)]
+
+
+def sysfs(node, args):
+    '''grep -H over the sysfs files of the node.
+
+    The shell expands the globs of the arguments on the machine running the
+    simulation, so a uevent argument stands for the uevents of its class.
+    '''
+    node.query()
+    files = [
+        ('/sys/class/dmi/id/board_name', [node['model']]),
+        ('/sys/class/dmi/id/board_vendor', ['Supermicro']),
+        ('/sys/class/dmi/id/bios_version', [node['versions']['BIOS']]),
+        ('/sys/class/dmi/id/bios_date', ['01/22/2018']),
+        ('/sys/class/dmi/id/product_name', [node['part_number']]),
+    ]
+    devices = [('01:00.0', _uevent('01:00.0', 'mpt3sas', '10700', '1000:0097', '15d9:0808')),
+               ('3b:00.0', _uevent('3b:00.0', 'mlx5_core', '20000', '15b3:1013', '15b3:0008'))]
+    for dev, slot in sorted(node['nics'].items()):
+        uevent = _uevent(slot, 'ixgbe', '20000', '8086:1563', node['nic'])
+        files.append(('/sys/class/net/{0}/device/uevent'.format(dev), uevent))
+        devices.append((slot, uevent))
+    for slot, uevent in sorted(devices):
+        files.append(('/sys/bus/pci/devices/0000:{0}/uevent'.format(slot), uevent))
+
+    paths = [arg for arg in args if arg.startswith('/sys/')]
+    status = 1
+    for path, lines in files:
+        if any(fnmatch.fnmatch(path, p) or (p.endswith('/uevent') and
+               path.endswith('/uevent') and p.split('/')[:4] == path.split('/')[:4])
+               for p in paths):
+            for line in lines:
+                print('{0}:{1}'.format(path, line))
+            status = 0
+    return status
+
+
+''' -------------------------------- reboot ---------------------------------'''
+def reboot(node, args):
+    print('Rebooting.')
+    sys.stdout.flush()
+    return node.reboot()
+
+
+TOOLS = {
+    'login': login, 'ipmitool': ipmitool, 'dmidecode': dmidecode,
+    'ipmicfg': ipmicfg, 'sumtool': sumtool, 'sas3flash': sas3flash,
+    'mlxup': mlxup, 'ethtool': ethtool, 'lspci': lspci, 'ip': ip,
+    'nvmupdate64e': nvmupdate64e, 'reboot': reboot, 'sysfs': sysfs,
+}
+
+
+def main(argv):
+    if len(argv) < 2 or argv[1] not in TOOLS:
+        sys.stderr.write('usage: tools.py STATE_FILE {{{0}}} [ARGS...]\n'.format(
+            ','.join(sorted(TOOLS))))
+        return 2
+    status = TOOLS[argv[1]](Node(argv[0]), argv[2:])
+    sys.stdout.flush()
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,21 @@
+'''Tests of the ete modules.
+
+Run from the ete directory with Python 2.7:
+
+    $ python -m unittest discover -s tests -t .
+'''
+import logging
+import os
+import sys
+
+# The package and the vendored packages, as fw_update/import_me_first.py adds
+package_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, package_path)
+
+from lib import util
+
+util.add_python_packages(package_path)
+util.add_python_packages(os.path.join(package_path, 'packages'))
+
+# The modules log through the root logger the scripts configure
+logging.getLogger().addHandler(logging.NullHandler())
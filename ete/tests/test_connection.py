@@ -0,0 +1,44 @@
+'''Tests of lib/connection.py on a local shell.'''
+import unittest
+
+from lib import connection
+
+
+class RunBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = connection.LocalConnection()
+        self.conn.login()
+
+    def tearDown(self):
+        self.conn.logout()
+
+    def test_slow_output(self):
+        # The echo of the batch is in the stream before the first output
+        results = self.conn.run_batch([
+            'echo one; sleep 0.3; echo two',
+            'printf three; sleep 0.2; printf four',
+            'sleep 0.2; false',
+        ], timeout=10)
+        self.assertEqual([r.status for r in results], [0, 0, 1])
+        self.assertEqual(results[0].output.splitlines()[1:], ['one', 'two'])
+        self.assertEqual(results[1].output.splitlines()[1:], ['threefour'])
+        self.assertEqual(results[2].output.splitlines()[1:], [])
+
+    def test_longer_than_the_tty_buffer(self):
+        cmds = ['sleep 0.01; echo line {0} {1}'.format(i, 'x' * 60)
+                for i in range(200)]
+        results = self.conn.run_batch(cmds, timeout=60)
+        for i, result in enumerate(results):
+            self.assertEqual(result.status, 0)
+            self.assertEqual(result.output.splitlines()[1:],
+                             ['line {0} {1}'.format(i, 'x' * 60)])
+
+    def test_prompt_after_the_batch(self):
+        self.conn.run_batch(['echo a'], timeout=10)
+        self.conn.sendline('echo after', self.conn.PROMPT, timeout=10)
+        self.assertIn('after', self.conn.output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+'''Tests of the pattern cache of the vendored pexpect.'''
+import sys
+import threading
+import unittest
+
+from pexpect import spawnbase
+
+
+class PatternCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.size = spawnbase.PATTERN_CACHE_SIZE
+        spawnbase.pattern_cache_clear()
+
+    def tearDown(self):
+        spawnbase.PATTERN_CACHE_SIZE = self.size
+        spawnbase.pattern_cache_clear()
+
+    def test_hit_and_miss(self):
+        build = lambda: ['pattern']
+        self.assertEqual(spawnbase._cached_patterns(('a',), build), ['pattern'])
+        self.assertEqual(spawnbase._cached_patterns(('a',), build), ['pattern'])
+        info = spawnbase.pattern_cache_info()
+        self.assertEqual((info['hits'], info['misses'], info['size']), (1, 1, 1))
+
+    def test_unhashable_key_is_not_cached(self):
+        self.assertEqual(spawnbase._cached_patterns((['a'],), lambda: [1]), [1])
+        self.assertEqual(spawnbase.pattern_cache_info()['size'], 0)
+
+    def test_lookups_racing_evictions(self):
+        # A cache smaller than the keys in use evicts on most misses
+        spawnbase.PATTERN_CACHE_SIZE = 4
+        errors, lookups = [], 2000
+
+        def worker(offset):
+            try:
+                for i in range(lookups):
+                    # Hot keys hit, the cold ones evict each other
+                    if i % 4:
+                        key = ('hot', i % 2)
+                    else:
+                        key = ('cold', (i + offset) % 16)
+                    patterns = spawnbase._cached_patterns(key, lambda: [key])
+                    if patterns != [key]:
+                        errors.append((key, patterns))
+            except Exception as e:
+                errors.append(e)
+
+        # Switch threads every few bytecodes so the lookups interleave
+        interval = sys.getcheckinterval()
+        sys.setcheckinterval(1)
+        try:
+            threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setcheckinterval(interval)
+        self.assertEqual(errors, [])
+        info = spawnbase.pattern_cache_info()
+        self.assertEqual(info['hits'] + info['misses'], 8 * lookups)
+        self.assertLessEqual(info['size'], 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,252 @@
+'''Tests of lib/rollout.py with a function runner and on simulated nodes.'''
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from lib import journal, rollout
+from sim.node import SimFleet
+
+
+def nodes(count, racks=1, pdus=None):
+    '''Return count nodes spread round-robin over the racks and PDUs.'''
+    pdus = pdus or racks
+    return [rollout.Node('node-{0:02d}'.format(i), rack='r{0}'.format(i % racks),
+                         pdu='p{0}'.format(i % pdus))
+            for i in range(count)]
+
+
+class Runner(object):
+    '''Runner failing the (host, component) pairs in fail, recording calls.'''
+
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, host, component):
+        with self.lock:
+            self.calls.append((host, component))
+        if (host, component) in self.fail:
+            return {'status': 'failed', 'detail': 'flash failed'}
+        return {'status': rollout.SUCCESS, 'detail': ''}
+
+    def hosts(self):
+        return sorted(set(host for host, _ in self.calls))
+
+
+class BudgetTest(unittest.TestCase):
+
+    def test_clean_rollout(self):
+        runner = Runner()
+        controller = rollout.Rollout(nodes(10), ['BMC', 'BIOS'], runner,
+                                     canary=1, growth=2, max_batch=4)
+        summary = controller.run()
+        self.assertEqual(summary['state'], 'done')
+        self.assertEqual([len(w['hosts']) for w in summary['waves']], [1, 2, 4, 3])
+        self.assertEqual(len(summary['succeeded']), 10)
+        self.assertEqual(len(runner.calls), 20)
+
+    def test_failed_canary_halts(self):
+        runner = Runner(fail=[('node-00', 'BMC')])
+        summary = rollout.Rollout(nodes(5), ['BMC', 'BIOS'], runner).run()
+        self.assertEqual(summary['state'], 'halted')
+        self.assertEqual(summary['reason'], 'canary failed')
+        self.assertEqual(summary['failed'], ['node-00'])
+        self.assertEqual(summary['skipped'], ['node-{0:02d}'.format(i) for i in range(1, 5)])
+        # The components after the failed one are not run
+        self.assertEqual(runner.calls, [('node-00', 'BMC')])
+
+    def test_failures_slow_the_waves(self):
+        runner = Runner(fail=[('node-01', 'BMC')])
+        summary = rollout.Rollout(nodes(10), ['BMC'], runner, canary=1, growth=2,
+                                  max_failures=None, max_failure_rate=None).run()
+        self.assertEqual(summary['state'], 'done')
+        self.assertEqual([len(w['hosts']) for w in summary['waves']], [1, 2, 1, 2, 4])
+        self.assertEqual(summary['failed'], ['node-01'])
+
+    def test_slow_failure_rate_tolerates_failures(self):
+        runner = Runner(fail=[('node-01', 'BMC')])
+        summary = rollout.Rollout(nodes(7), ['BMC'], runner, canary=1, growth=2,
+                                  max_failures=None, max_failure_rate=None,
+                                  slow_failure_rate=0.5).run()
+        self.assertEqual([len(w['hosts']) for w in summary['waves']], [1, 2, 4])
+
+    def test_failure_count_halts(self):
+        fail = [('node-0{0}'.format(i), 'BMC') for i in (1, 3, 4)]
+        summary = rollout.Rollout(nodes(20), ['BMC'], Runner(fail), canary=1,
+                                  growth=4, max_failures=2,
+                                  max_failure_rate=None).run()
+        self.assertEqual(summary['state'], 'halted')
+        self.assertEqual(summary['reason'], '3 failed nodes, the budget is 2')
+        self.assertEqual(summary['failed'], ['node-01', 'node-03', 'node-04'])
+        self.assertEqual(len(summary['skipped']), 15)
+
+    def test_failure_rate_halts_after_min_samples(self):
+        fail = [('node-01', 'BMC'), ('node-02', 'BMC')]
+        summary = rollout.Rollout(nodes(20), ['BMC'], Runner(fail), canary=1,
+                                  growth=4, max_failures=None,
+                                  max_failure_rate=0.25, min_samples=5).run()
+        # Wave 2 has 2 of 5 nodes failed, over the 25% budget
+        self.assertEqual(summary['state'], 'halted')
+        self.assertEqual(summary['reason'], '2 of 5 nodes failed, over the 25% budget')
+        self.assertEqual(len(summary['skipped']), 15)
+
+    def test_runner_exception_is_a_failure(self):
+        def runner(host, component):
+            raise RuntimeError('connection refused')
+        summary = rollout.Rollout(nodes(2), ['BMC'], runner).run()
+        self.assertEqual(summary['state'], 'halted')
+        self.assertEqual(summary['results']['node-00']['status'], 'error')
+        self.assertEqual(summary['results']['node-00']['components']['BMC']['detail'],
+                         'connection refused')
+
+
+class WaveLimitTest(unittest.TestCase):
+
+    def check_limits(self, summary, inventory, field, limit):
+        labels = dict((node.host, getattr(node, field)) for node in inventory)
+        for wave in summary['waves']:
+            counts = {}
+            for host in wave['hosts']:
+                counts[labels[host]] = counts.get(labels[host], 0) + 1
+            self.assertLessEqual(max(counts.values()), limit, wave)
+
+    def test_max_per_rack(self):
+        inventory = nodes(12, racks=3)
+        summary = rollout.Rollout(inventory, ['BMC'], Runner(), canary=4,
+                                  max_per_rack=2).run()
+        self.assertEqual(summary['state'], 'done')
+        self.assertEqual(len(summary['succeeded']), 12)
+        self.check_limits(summary, inventory, 'rack', 2)
+        self.assertEqual([len(w['hosts']) for w in summary['waves']], [4, 6, 2])
+
+    def test_max_per_pdu(self):
+        inventory = nodes(12, racks=6, pdus=2)
+        summary = rollout.Rollout(inventory, ['BMC'], Runner(), canary=8,
+                                  max_per_rack=2, max_per_pdu=3).run()
+        self.assertEqual(len(summary['succeeded']), 12)
+        self.check_limits(summary, inventory, 'rack', 2)
+        self.check_limits(summary, inventory, 'pdu', 3)
+        self.assertEqual([len(w['hosts']) for w in summary['waves']], [6, 6])
+
+    def test_unlabelled_nodes_are_not_limited(self):
+        inventory = [rollout.Node('node-{0}'.format(i)) for i in range(4)]
+        summary = rollout.Rollout(inventory, ['BMC'], Runner(), canary=4,
+                                  max_per_rack=1, max_per_pdu=1).run()
+        self.assertEqual([len(w['hosts']) for w in summary['waves']], [4])
+
+
+class ResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'rollout.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def run_rollout(self, runner, inventory, **kwargs):
+        j = journal.Journal(self.path)
+        try:
+            return rollout.Rollout(inventory, ['BMC', 'BIOS'], runner, journal=j,
+                                   max_failures=None, max_failure_rate=None,
+                                   **kwargs).run()
+        finally:
+            j.close()
+
+    def test_resume_skips_updated_components(self):
+        inventory = nodes(6)
+        first = self.run_rollout(Runner(fail=[('node-03', 'BIOS')]), inventory)
+        self.assertEqual(first['failed'], ['node-03'])
+
+        runner = Runner()
+        second = self.run_rollout(runner, inventory)
+        self.assertEqual(second['state'], 'done')
+        self.assertEqual(len(second['succeeded']), 6)
+        # Only the failed component runs again, its BMC is done
+        self.assertEqual(runner.calls, [('node-03', 'BIOS')])
+        self.assertTrue(second['results']['node-00']['resumed'])
+
+    def test_resume_after_halt(self):
+        inventory = nodes(8)
+        first = self.run_rollout(Runner(fail=[('node-00', 'BMC')]), inventory)
+        self.assertEqual(first['state'], 'halted')
+
+        runner = Runner()
+        second = self.run_rollout(runner, inventory)
+        self.assertEqual(second['state'], 'done')
+        self.assertEqual(runner.hosts(), [n.host for n in inventory])
+
+    def test_running_components_are_verified(self):
+        inventory = nodes(2)
+        j = journal.Journal(self.path)
+        for node in inventory:
+            j.record(node.host, 'BMC', journal.SUCCESS)
+            # The previous run crashed while flashing the BIOS
+            j.record(node.host, 'BIOS', journal.RUNNING)
+        j.close()
+
+        runner = Runner()
+        summary = self.run_rollout(runner, inventory,
+                                   verify=lambda host, component: host == 'node-00')
+        self.assertEqual(summary['state'], 'done')
+        self.assertEqual(runner.calls, [('node-01', 'BIOS')])
+        self.assertEqual(summary['results']['node-00']['components']['BIOS']['detail'],
+                         'verified after restart')
+
+        j = journal.Journal(self.path)
+        try:
+            self.assertEqual(j.state('node-00', 'BIOS'), journal.SUCCESS)
+            self.assertEqual(j.history('node-00')[-1][3:], (journal.SUCCESS,
+                                                            'verified after restart'))
+        finally:
+            j.close()
+
+
+class SimFleetTest(unittest.TestCase):
+    '''Rollout of the HBA firmware by the updater script on simulated nodes.'''
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.fleet = SimFleet(os.path.join(self.tmp, 'fleet'), count=4, racks=2,
+                              latency=0, flash_seconds=0, reboot_seconds=0,
+                              bmc_reset_seconds=0)
+        self.fleet.__enter__()
+
+    def tearDown(self):
+        self.fleet.__exit__(None, None, None)
+        shutil.rmtree(self.tmp)
+
+    def test_rollout(self):
+        inventory = rollout.load_inventory(self.fleet.inventory())
+        runner = rollout.ScriptRunner('root', 'nutanix/4u', timeout=120,
+                                      log_dir=os.path.join(self.tmp, 'logs'))
+        j = journal.Journal(os.path.join(self.tmp, 'rollout.db'))
+        try:
+            summary = rollout.Rollout(inventory, ['HBA'], runner, canary=1,
+                                      max_per_rack=1, journal=j).run()
+        finally:
+            j.close()
+        self.assertEqual(summary['state'], 'done', summary['results'])
+        self.assertEqual(summary['succeeded'], self.fleet.hosts)
+        self.assertEqual([len(w['hosts']) for w in summary['waves']], [1, 2, 1])
+        for node in self.fleet.nodes:
+            state = node.read()
+            self.assertEqual(state['versions']['HBA'], state['updates']['HBA'])
+
+        # A second run on the journal has nothing left to do
+        def runner(host, component):
+            self.fail('{0} {1} updated again'.format(host, component))
+        j = journal.Journal(os.path.join(self.tmp, 'rollout.db'))
+        try:
+            summary = rollout.Rollout(inventory, ['HBA'], runner, journal=j).run()
+        finally:
+            j.close()
+        self.assertEqual(summary['state'], 'done')
+        self.assertEqual(summary['waves'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()